@@ -1,3 +1,4 @@
+import os
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
@@ -14,6 +15,10 @@ config = context.config
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
+# Адрес БД переопределяется той же переменной, что и у приложения (миграции идут через синхронный драйвер)
+if os.getenv("BACKEND_DATABASE_URL"):
+    config.set_main_option("sqlalchemy.url", os.environ["BACKEND_DATABASE_URL"].replace("+asyncpg", ""))
+
 # add your model's MetaData object here
 # for 'autogenerate' support
 from app.database import models
@@ -0,0 +1,40 @@
+"""contact list indexes
+
+Revision ID: 3b9e2d7c41f0
+Revises: ef76dc5aa6ee
+Create Date: 2026-10-18 11:04:52.913306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9e2d7c41f0'
+down_revision: Union[str, None] = 'ef76dc5aa6ee'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        # Поиск по началу имени без учета регистра: LIKE 'prefix%' по lower(username)
+        op.create_index(
+            'ix_users_username_lower_pattern',
+            'users',
+            [sa.text('lower(username) text_pattern_ops')],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        # Выборка переписок пользователя для сортировки контактов по последнему сообщению
+        op.create_index('ix_messages_sender_id_id', 'messages', ['sender_id', 'id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_messages_receiver_id_id', 'messages', ['receiver_id', 'id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_messages_receiver_id_id', table_name='messages', postgresql_concurrently=True)
+        op.drop_index('ix_messages_sender_id_id', table_name='messages', postgresql_concurrently=True)
+        op.drop_index('ix_users_username_lower_pattern', table_name='users', postgresql_concurrently=True)
@@ -0,0 +1,37 @@
+"""messages text search
+
+Revision ID: 5c1f8e2a9d47
+Revises: b85eed9a7f65
+Create Date: 2026-10-18 16:42:08.215730
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1f8e2a9d47'
+down_revision: Union[str, None] = 'b85eed9a7f65'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Полнотекстовый поиск по сообщениям. Индекс по выражению, а не по отдельной колонке tsvector:
+    # он строится без перезаписи таблицы, и выражение совпадает с запросом search_messages
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_text_search',
+            'messages',
+            [sa.text("to_tsvector('simple'::regconfig, text)")],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_messages_text_search', table_name='messages', postgresql_concurrently=True)
@@ -0,0 +1,65 @@
+"""group chats
+
+Revision ID: 8d3a6f0c2b15
+Revises: 5c1f8e2a9d47
+Create Date: 2026-10-18 18:05:37.640912
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d3a6f0c2b15'
+down_revision: Union[str, None] = '5c1f8e2a9d47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('groups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('group_members',
+    sa.Column('group_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('joined_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['group_id'], ['groups.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('group_id', 'user_id')
+    )
+    # Группы пользователя читаются при каждом подключении веб-сокета
+    op.create_index('ix_group_members_user_id', 'group_members', ['user_id', 'group_id'], unique=False)
+    
+    # Сообщение группы хранится одной строкой, без копии на каждого участника. Колонка без значения
+    # по умолчанию добавляется без перезаписи таблицы
+    op.add_column('messages', sa.Column('group_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('messages_group_id_fkey', 'messages', 'groups', ['group_id'], ['id'])
+    
+    # История группы читается одним диапазоном индекса; личные сообщения в индекс не попадают
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_group_id_id',
+            'messages',
+            ['group_id', 'id'],
+            unique=False,
+            postgresql_where=sa.text('group_id IS NOT NULL'),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_messages_group_id_id', table_name='messages', postgresql_concurrently=True)
+    op.drop_constraint('messages_group_id_fkey', 'messages', type_='foreignkey')
+    op.drop_column('messages', 'group_id')
+    op.drop_index('ix_group_members_user_id', table_name='group_members')
+    op.drop_table('group_members')
+    op.drop_table('groups')
@@ -0,0 +1,54 @@
+"""conversations summary
+
+Revision ID: b85eed9a7f65
+Revises: 3b9e2d7c41f0
+Create Date: 2026-10-18 11:47:09.218664
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b85eed9a7f65'
+down_revision: Union[str, None] = '3b9e2d7c41f0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('conversations',
+    sa.Column('user1_id', sa.Integer(), nullable=False),
+    sa.Column('user2_id', sa.Integer(), nullable=False),
+    sa.Column('last_message_id', sa.Integer(), nullable=False),
+    sa.Column('last_message_sender_id', sa.Integer(), nullable=False),
+    sa.Column('last_message_text', sa.String(), nullable=False),
+    sa.Column('last_message_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('user1_unread', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('user2_unread', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['user1_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['user2_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user1_id', 'user2_id')
+    )
+
+    # Заполняем сводки по существующим сообщениям: последнее сообщение каждой пары по индексу ix_messages_pair_id.
+    # Время сообщений раньше не хранилось, а прочитанность не отслеживалась, поэтому время — момент миграции, непрочитанных нет
+    op.execute("""
+        INSERT INTO conversations (user1_id, user2_id, last_message_id, last_message_sender_id, last_message_text)
+        SELECT DISTINCT ON (least(sender_id, receiver_id), greatest(sender_id, receiver_id))
+            least(sender_id, receiver_id), greatest(sender_id, receiver_id), id, sender_id, text
+        FROM messages
+        WHERE sender_id IS NOT NULL AND receiver_id IS NOT NULL
+        ORDER BY least(sender_id, receiver_id), greatest(sender_id, receiver_id), id DESC
+    """)
+
+    op.create_index('ix_conversations_user1_last_message', 'conversations', ['user1_id', 'last_message_id'], unique=False)
+    op.create_index('ix_conversations_user2_last_message', 'conversations', ['user2_id', 'last_message_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_conversations_user2_last_message', table_name='conversations')
+    op.drop_index('ix_conversations_user1_last_message', table_name='conversations')
+    op.drop_table('conversations')
@@ -0,0 +1,173 @@
+"""messages partitioning
+
+Revision ID: c2e94b7a1d60
+Revises: 8d3a6f0c2b15
+Create Date: 2026-10-18 19:24:51.307114
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2e94b7a1d60'
+down_revision: Union[str, None] = '8d3a6f0c2b15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Сколько месячных секций создается сразу; дальше их создает app.database.partitions
+PARTITIONS_AHEAD = 3
+
+
+def month_partition(start: datetime) -> tuple[str, datetime, datetime]:
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1, tzinfo=start.tzinfo)
+    return f"messages_{start:%Y_%m}", start, end
+
+
+def upgrade() -> None:
+    # Колонка с постоянным значением по умолчанию добавляется без перезаписи таблицы:
+    # у существующих сообщений временем отправки становится момент миграции
+    op.add_column('messages', sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+
+    # Текущая таблица не копируется, а становится первой секцией messages_legacy. Индексы с ключом секционирования
+    # строятся заранее и без блокировки записи, при подключении секции они становятся частями индексов новой таблицы
+    with op.get_context().autocommit_block():
+        op.create_index('messages_legacy_pkey', 'messages', ['id', 'created_at'], unique=True, postgresql_concurrently=True)
+        op.create_index(
+            'messages_legacy_pair_created_at_idx',
+            'messages',
+            [
+                sa.text('least(sender_id, receiver_id)'),
+                sa.text('greatest(sender_id, receiver_id)'),
+                'created_at',
+                'id'
+            ],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'messages_legacy_group_id_created_at_idx',
+            'messages',
+            ['group_id', 'created_at', 'id'],
+            unique=False,
+            postgresql_where=sa.text('group_id IS NOT NULL'),
+            postgresql_concurrently=True,
+        )
+
+    # Старая секция заканчивается с началом следующего месяца (если до него меньше суток — еще через месяц),
+    # чтобы сообщения, вставленные до переключения, не нарушили ее границу. Проверенное заранее ограничение
+    # избавляет ATTACH PARTITION от сканирования таблицы под блокировкой
+    boundary = op.get_bind().execute(sa.text("SELECT date_trunc('month', now() + interval '1 day', 'UTC') + interval '1 month'")).scalar()
+    op.execute(f"ALTER TABLE messages ADD CONSTRAINT messages_legacy_created_at_check CHECK (created_at < '{boundary.isoformat()}') NOT VALID")
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TABLE messages VALIDATE CONSTRAINT messages_legacy_created_at_check")
+
+    # Переключение: дальше только изменения каталога под короткой блокировкой
+    op.execute("LOCK TABLE messages IN ACCESS EXCLUSIVE MODE")
+    op.rename_table('messages', 'messages_legacy')
+    op.drop_constraint('messages_pkey', 'messages_legacy', type_='primary')
+    op.execute("ALTER TABLE messages_legacy ADD CONSTRAINT messages_legacy_pkey PRIMARY KEY USING INDEX messages_legacy_pkey")
+    op.drop_index('ix_messages_id', table_name='messages_legacy')
+    op.drop_index('ix_messages_pair_id', table_name='messages_legacy')
+    op.drop_index('ix_messages_group_id_id', table_name='messages_legacy')
+    op.execute("ALTER INDEX ix_messages_sender_id_id RENAME TO messages_legacy_sender_id_id_idx")
+    op.execute("ALTER INDEX ix_messages_receiver_id_id RENAME TO messages_legacy_receiver_id_id_idx")
+    op.execute("ALTER INDEX ix_messages_text_search RENAME TO messages_legacy_text_search_idx")
+    for column in ('sender_id', 'receiver_id', 'group_id'):
+        op.execute(f"ALTER TABLE messages_legacy RENAME CONSTRAINT messages_{column}_fkey TO messages_legacy_{column}_fkey")
+
+    # Секционированная таблица: ключ секционирования входит в первичный ключ, ID по-прежнему берется из общей последовательности
+    op.create_table('messages',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('messages_id_seq'::regclass)"), nullable=False),
+    sa.Column('sender_id', sa.Integer(), nullable=True),
+    sa.Column('receiver_id', sa.Integer(), nullable=True),
+    sa.Column('text', sa.String(), nullable=False),
+    sa.Column('group_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['sender_id'], ['users.id'], name='messages_sender_id_fkey'),
+    sa.ForeignKeyConstraint(['receiver_id'], ['users.id'], name='messages_receiver_id_fkey'),
+    sa.ForeignKeyConstraint(['group_id'], ['groups.id'], name='messages_group_id_fkey'),
+    sa.PrimaryKeyConstraint('id', 'created_at', name='messages_pkey'),
+    postgresql_partition_by='RANGE (created_at)'
+    )
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+
+    # Страницы истории упорядочены по (created_at, id): секции совпадают с этим порядком,
+    # и запрос с LIMIT читает только самые новые из них
+    op.create_index(
+        'ix_messages_pair_created_at',
+        'messages',
+        [
+            sa.text('least(sender_id, receiver_id)'),
+            sa.text('greatest(sender_id, receiver_id)'),
+            'created_at',
+            'id'
+        ],
+        unique=False
+    )
+    op.create_index(
+        'ix_messages_group_id_created_at',
+        'messages',
+        ['group_id', 'created_at', 'id'],
+        unique=False,
+        postgresql_where=sa.text('group_id IS NOT NULL')
+    )
+    op.create_index('ix_messages_sender_id_id', 'messages', ['sender_id', 'id'], unique=False)
+    op.create_index('ix_messages_receiver_id_id', 'messages', ['receiver_id', 'id'], unique=False)
+    op.create_index(
+        'ix_messages_text_search',
+        'messages',
+        [sa.text("to_tsvector('simple'::regconfig, text)")],
+        unique=False,
+        postgresql_using='gin'
+    )
+
+    op.execute(f"ALTER TABLE messages ATTACH PARTITION messages_legacy FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat()}')")
+    op.drop_constraint('messages_legacy_created_at_check', 'messages_legacy', type_='check')
+
+    start = boundary
+    for _ in range(PARTITIONS_AHEAD):
+        name, start, end = month_partition(start)
+        op.execute(f"CREATE TABLE {name} PARTITION OF messages FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')")
+        start = end
+
+
+def downgrade() -> None:
+    # Сообщения из месячных секций переносятся в messages_legacy, которая снова становится обычной таблицей.
+    # Архивированные секции нужно восстановить заранее, иначе их сообщения не вернутся
+    op.execute("LOCK TABLE messages IN ACCESS EXCLUSIVE MODE")
+    partitions = op.get_bind().execute(sa.text(
+        "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = 'messages'::regclass AND inhrelid <> 'messages_legacy'::regclass"
+    )).scalars().all()
+    op.execute("ALTER TABLE messages DETACH PARTITION messages_legacy")
+    for name in partitions:
+        op.execute(
+            f"INSERT INTO messages_legacy (id, sender_id, receiver_id, text, group_id, created_at) "
+            f"SELECT id, sender_id, receiver_id, text, group_id, created_at FROM {name}"
+        )
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages_legacy.id")
+    op.drop_table('messages')
+
+    op.rename_table('messages_legacy', 'messages')
+    op.drop_constraint('messages_legacy_pkey', 'messages', type_='primary')
+    op.create_primary_key('messages_pkey', 'messages', ['id'])
+    op.create_index('ix_messages_id', 'messages', ['id'], unique=False)
+    op.drop_index('messages_legacy_pair_created_at_idx', table_name='messages')
+    op.drop_index('messages_legacy_group_id_created_at_idx', table_name='messages')
+    op.create_index(
+        'ix_messages_pair_id',
+        'messages',
+        [sa.text('least(sender_id, receiver_id)'), sa.text('greatest(sender_id, receiver_id)'), 'id'],
+        unique=False
+    )
+    op.create_index('ix_messages_group_id_id', 'messages', ['group_id', 'id'], unique=False, postgresql_where=sa.text('group_id IS NOT NULL'))
+    op.execute("ALTER INDEX messages_legacy_sender_id_id_idx RENAME TO ix_messages_sender_id_id")
+    op.execute("ALTER INDEX messages_legacy_receiver_id_id_idx RENAME TO ix_messages_receiver_id_id")
+    op.execute("ALTER INDEX messages_legacy_text_search_idx RENAME TO ix_messages_text_search")
+    for column in ('sender_id', 'receiver_id', 'group_id'):
+        op.execute(f"ALTER TABLE messages RENAME CONSTRAINT messages_legacy_{column}_fkey TO messages_{column}_fkey")
+    op.drop_column('messages', 'created_at')
@@ -0,0 +1,35 @@
+"""messages pair index
+
+Revision ID: ef76dc5aa6ee
+Revises: 07a7071889c8
+Create Date: 2026-10-18 10:12:31.482190
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ef76dc5aa6ee'
+down_revision: Union[str, None] = '07a7071889c8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Индекс по паре собеседников без учета направления: история чата читается одним диапазоном индекса
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_pair_id',
+            'messages',
+            [sa.text('least(sender_id, receiver_id)'), sa.text('greatest(sender_id, receiver_id)'), 'id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_messages_pair_id', table_name='messages', postgresql_concurrently=True)
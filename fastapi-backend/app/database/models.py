@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -24,16 +24,84 @@ class User(Base):
 
 
 # Модель для сообщений
+#
+# Таблица секционирована по месяцам (RANGE по created_at), поэтому created_at входит в первичный ключ.
+# Секции создает и архивирует app.database.partitions
 class Message(Base):
     __tablename__ = "messages"
     
-    id = Column(Integer, primary_key=True, index=True)                  # ID сообщения
+    id = Column(Integer, primary_key=True, autoincrement=True)          # ID сообщения
     sender_id = Column(Integer, ForeignKey("users.id"))                 # Внешний ключ на отправителя
-    receiver_id = Column(Integer, ForeignKey("users.id"))               # Внешний ключ на получателя
+    receiver_id = Column(Integer, ForeignKey("users.id"))               # Внешний ключ на получателя, у сообщений группы пустой
+    group_id = Column(Integer, ForeignKey("groups.id"))                 # Внешний ключ на группу, у личных сообщений пустой
     text = Column(String, nullable=False)                               # Текст сообщения 
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())      # Время отправки, ключ секционирования
     
     # Связь с отправителем
     sender = relationship("User", foreign_keys=[sender_id], back_populates="sent_messages")
     
     # Связь с получателем
-    receiver = relationship("User", foreign_keys=[receiver_id], back_populates="received_messages")
\ No newline at end of file
+    receiver = relationship("User", foreign_keys=[receiver_id], back_populates="received_messages")
+    
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
+
+
+
+# Модель сводки переписки двух пользователей (денормализация для списка чатов)
+class Conversation(Base):
+    __tablename__ = "conversations"
+    
+    user1_id = Column(Integer, ForeignKey("users.id"), primary_key=True)                            # Меньший ID из пары собеседников
+    user2_id = Column(Integer, ForeignKey("users.id"), primary_key=True)                            # Больший ID из пары собеседников
+    last_message_id = Column(Integer, nullable=False)                                               # ID последнего сообщения
+    last_message_sender_id = Column(Integer, nullable=False)                                        # Отправитель последнего сообщения
+    last_message_text = Column(String, nullable=False)                                              # Текст последнего сообщения
+    last_message_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())    # Время последнего сообщения
+    user1_unread = Column(Integer, nullable=False, server_default="0")                              # Непрочитанные сообщения у user1
+    user2_unread = Column(Integer, nullable=False, server_default="0")                              # Непрочитанные сообщения у user2
+    
+    __table_args__ = (
+        Index("ix_conversations_user1_last_message", "user1_id", "last_message_id"),
+        Index("ix_conversations_user2_last_message", "user2_id", "last_message_id"),
+    )
+
+# Индекс по паре собеседников без учета направления для постраничного чтения истории в порядке секций
+Index(
+    "ix_messages_pair_created_at",
+    func.least(Message.sender_id, Message.receiver_id),
+    func.greatest(Message.sender_id, Message.receiver_id),
+    Message.created_at,
+    Message.id
+)
+
+# Индексы для списка контактов: поиск по началу имени и выборка переписок пользователя
+Index(
+    "ix_users_username_lower_pattern",
+    func.lower(User.username).label("username_lower"),
+    postgresql_ops={"username_lower": "text_pattern_ops"}
+)
+Index("ix_messages_sender_id_id", Message.sender_id, Message.id)
+Index("ix_messages_receiver_id_id", Message.receiver_id, Message.id)
+
+
+# Модель группового чата
+class Group(Base):
+    __tablename__ = "groups"
+    
+    id = Column(Integer, primary_key=True)                                                          # ID группы
+    name = Column(String, nullable=False)                                                           # Название группы
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)                              # Создатель группы, может исключать участников
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())         # Время создания
+
+
+# Модель участника группы
+class GroupMember(Base):
+    __tablename__ = "group_members"
+    
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), primary_key=True)      # ID группы
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)                             # ID участника
+    joined_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())         # Время вступления
+    
+    __table_args__ = (
+        Index("ix_group_members_user_id", "user_id", "group_id"),
+    )
@@ -1,40 +1,176 @@
-from typing import List
-from passlib.context import CryptContext
-from sqlalchemy import or_
-from sqlalchemy.orm import Session
-from app.schemas import user as user_schema
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import case, delete, func, insert, literal, literal_column, or_, select, tuple_, union_all, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import models
+from app.utils.metrics import timed_operation
 
 
-# Создания контекста хэширования паролей
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-# Создает пользователя
-def create_user(db: Session, user: user_schema.UserAuth) -> models.User:
-    hashed_password = pwd_context.hash(user.password)       # Хэшируем пароль
-    
+# Создает пользователя с уже посчитанным хэшем пароля
+@timed_operation
+async def create_user(db: AsyncSession, username: str, hashed_password: str) -> models.User:
     # Создаем пользователя
     db_user = models.User(
-        username=user.username,
+        username=username,
         hashed_password=hashed_password
     )
     
     db.add(db_user)             # Добавляем пользователя в сессию
-    db.commit()                 # Коммитим изменения в сессии
-    db.refresh(db_user)         # Обновляем поля пользователя
+    await db.commit()           # Коммитим изменения в сессии, ID заполняется при вставке
     
     return db_user              # Возвращаем пользователя
 
 # Возвращает пользователя по имени пользователя
-def get_user_by_username(db: Session, username: str) -> models.User:
-    return db.query(models.User).filter(models.User.username == username).first()
+@timed_operation
+async def get_user_by_username(db: AsyncSession, username: str) -> models.User:
+    return await db.scalar(select(models.User).where(models.User.username == username))
 
 # Возвращает пользователя по идентификатору
-def get_user_by_id(db: Session, user_id: int) -> models.User:
-    return db.query(models.User).filter(models.User.id == user_id).first()
+@timed_operation
+async def get_user_by_id(db: AsyncSession, user_id: int) -> models.User:
+    return await db.scalar(select(models.User).where(models.User.id == user_id))
+
+# Возвращает имена пользователей по их идентификаторам
+@timed_operation
+async def get_usernames(db: AsyncSession, user_ids: List[int]) -> Dict[int, str]:
+    result = await db.execute(select(models.User.id, models.User.username).where(models.User.id.in_(user_ids)))
+    return dict(result.tuples())
+
+# Условие поиска пользователей по началу имени без учета регистра (использует индекс ix_users_username_lower_pattern)
+def _username_prefix_filter(prefix: str):
+    pattern = prefix.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return func.lower(models.User.username).like(pattern, escape="\\")
+
+# Возвращает запрос сводок переписок, в которых пользователь стоит на указанной стороне пары
+def _side_conversations_query(user_id: int, side: int, prefix: Optional[str], before_message_id: Optional[int], limit: int):
+    own_id, peer_id = (models.Conversation.user1_id, models.Conversation.user2_id) if side == 1 else (models.Conversation.user2_id, models.Conversation.user1_id)
+    
+    # Переписка с самим собой в список не попадает
+    query = select(models.Conversation).where(own_id == user_id, peer_id != user_id)
+    if prefix:
+        query = query.join(models.User, models.User.id == peer_id).where(_username_prefix_filter(prefix))
+    if before_message_id is not None:
+        query = query.where(models.Conversation.last_message_id < before_message_id)
+    
+    return query.order_by(models.Conversation.last_message_id.desc()).limit(limit)
+
+# Возвращает сводки переписок пользователя вместе с собеседниками, начиная с самой свежей переписки
+@timed_operation
+async def get_conversations(
+    db: AsyncSession,
+    user_id: int,
+    prefix: Optional[str] = None,
+    before_message_id: Optional[int] = None,
+    limit: int = 50
+) -> List[Tuple[models.Conversation, models.User]]:
+    # Каждая половина читается своим индексом ix_conversations_user*_last_message, затем половины сливаются
+    conversations = union_all(
+        _side_conversations_query(user_id, 1, prefix, before_message_id, limit),
+        _side_conversations_query(user_id, 2, prefix, before_message_id, limit)
+    ).subquery()
+    conversation = aliased(models.Conversation, conversations)
+    peer_id = case((conversation.user1_id == user_id, conversation.user2_id), else_=conversation.user1_id)
+    
+    query = select(conversation, models.User).join(models.User, models.User.id == peer_id)
+    result = await db.execute(query.order_by(conversation.last_message_id.desc()).limit(limit))
+    return list(result.tuples())
+
+# Возвращает собеседников пользователей из последних переписок: (ID пользователя, ID собеседника, имя собеседника)
+@timed_operation
+async def get_contacts(db: AsyncSession, user_ids: List[int], limit: int = 100) -> List[Tuple[int, int, str]]:
+    sides = [
+        select(own_id.label("user_id"), peer_id.label("contact_id"), models.Conversation.last_message_id).where(own_id.in_(user_ids), peer_id != own_id)
+        for own_id, peer_id in (
+            (models.Conversation.user1_id, models.Conversation.user2_id),
+            (models.Conversation.user2_id, models.Conversation.user1_id)
+        )
+    ]
+    pairs = union_all(*sides).subquery()
+    
+    # Нумеруем переписки каждого пользователя от самой свежей и оставляем первые limit
+    rank = func.row_number().over(partition_by=pairs.c.user_id, order_by=pairs.c.last_message_id.desc()).label("rank")
+    ranked = select(pairs.c.user_id, pairs.c.contact_id, rank).subquery()
+    
+    query = select(ranked.c.user_id, ranked.c.contact_id, models.User.username).join(
+        models.User, models.User.id == ranked.c.contact_id
+    ).where(ranked.c.rank <= limit)
+    result = await db.execute(query)
+    return list(result.tuples())
+
+# Обнуляет счетчик непрочитанных сообщений пользователя в переписке
+@timed_operation
+async def mark_conversation_read(db: AsyncSession, user_id: int, peer_id: int):
+    low_id, high_id = sorted((user_id, peer_id))
+    unread_column = "user1_unread" if user_id == low_id else "user2_unread"
+    
+    await db.execute(update(models.Conversation).where(
+        models.Conversation.user1_id == low_id,
+        models.Conversation.user2_id == high_id
+    ).values({unread_column: 0}))
+    await db.commit()           # Коммитим изменения в сессии
+
+# Обновляет сводки переписок по уже вставленным сообщениям (без коммита)
+async def _update_conversations(db: AsyncSession, messages: List[dict]):
+    # Сворачиваем сообщения по парам: последнее сообщение и прирост непрочитанных у каждой стороны
+    conversations = {}
+    for message in sorted(messages, key=lambda message: message["id"]):
+        low_id, high_id = sorted((message["sender_id"], message["receiver_id"]))
+        conversation = conversations.setdefault((low_id, high_id), {
+            "user1_id": low_id,
+            "user2_id": high_id,
+            "user1_unread": 0,
+            "user2_unread": 0
+        })
+        conversation["last_message_id"] = message["id"]
+        conversation["last_message_sender_id"] = message["sender_id"]
+        conversation["last_message_text"] = message["text"]
+        if low_id != high_id:
+            conversation["user1_unread" if message["receiver_id"] == low_id else "user2_unread"] += 1
+    
+    # Пары упорядочены, чтобы параллельные воркеры блокировали строки в одном порядке
+    query = pg_insert(models.Conversation).values([conversations[pair] for pair in sorted(conversations)])
+    is_newer = query.excluded.last_message_id > models.Conversation.last_message_id
+    query = query.on_conflict_do_update(
+        index_elements=[models.Conversation.user1_id, models.Conversation.user2_id],
+        set_={
+            "last_message_id": func.greatest(models.Conversation.last_message_id, query.excluded.last_message_id),
+            "last_message_sender_id": case((is_newer, query.excluded.last_message_sender_id), else_=models.Conversation.last_message_sender_id),
+            "last_message_text": case((is_newer, query.excluded.last_message_text), else_=models.Conversation.last_message_text),
+            "last_message_at": case((is_newer, func.now()), else_=models.Conversation.last_message_at),
+            "user1_unread": models.Conversation.user1_unread + query.excluded.user1_unread,
+            "user2_unread": models.Conversation.user2_unread + query.excluded.user2_unread
+        }
+    )
+    await db.execute(query)
+
+# Возвращает пользователей, с которыми у пользователя еще нет переписки, в алфавитном порядке
+@timed_operation
+async def get_other_users(
+    db: AsyncSession,
+    user_id: int,
+    prefix: Optional[str] = None,
+    after_username: Optional[str] = None,
+    limit: int = 50
+) -> List[models.User]:
+    # Наличие переписки проверяется по первичному ключу сводки
+    has_conversation = select(models.Conversation.last_message_id).where(
+        models.Conversation.user1_id == func.least(models.User.id, user_id),
+        models.Conversation.user2_id == func.greatest(models.User.id, user_id)
+    ).exists()
+    
+    query = select(models.User).where(models.User.id != user_id, ~has_conversation)
+    if prefix:
+        query = query.where(_username_prefix_filter(prefix))
+    if after_username is not None:
+        query = query.where(models.User.username > after_username)
+    
+    result = await db.scalars(query.order_by(models.User.username).limit(limit))
+    return list(result)
 
 # Создает сообщение
-def create_message(db: Session, sender_id: int, receiver_id: int, text: str) -> models.Message:
+@timed_operation
+async def create_message(db: AsyncSession, sender_id: int, receiver_id: int, text: str) -> models.Message:
     # Создаем сообщение
     message = models.Message(
         sender_id=sender_id,
@@ -43,18 +179,204 @@ def create_message(db: Session, sender_id: int, receiver_id: int, text: str) ->
     )
     
     db.add(message)             # Добавляем сообщение в сессию
-    db.commit()                 # Коммитим изменения в сессии
-    db.refresh(message)         # Обновляем поля сообщения
+    await db.flush()            # Вставляем сообщение, чтобы получить его ID
+    await _update_conversations(db, [{"id": message.id, "sender_id": sender_id, "receiver_id": receiver_id, "text": text}])
+    await db.commit()           # Коммитим изменения в сессии
     
     return message              # Возвращаем сообщение
 
-# Возвращает все сообщения двух пользователей
-def get_messages_by_user_ids(db: Session, user1_id: int, user2_id: int) -> List[models.Message]:
-    messages = db.query(models.Message).filter(
-        or_(
-            models.Message.sender_id.in_([user1_id, user2_id]),
-            models.Message.receiver_id.in_([user1_id, user2_id])
+# Создает сообщения одним многострочным INSERT и возвращает их ID в порядке переданных строк
+@timed_operation
+async def create_messages(db: AsyncSession, messages: List[dict]) -> List[int]:
+    query = insert(models.Message).returning(models.Message.id, sort_by_parameter_order=True)
+    result = await db.execute(query, messages)
+    message_ids = list(result.scalars())
+    
+    # Сводки переписок ведутся только для личных сообщений
+    direct = [{**message, "id": message_id} for message, message_id in zip(messages, message_ids) if message.get("receiver_id") is not None]
+    if direct:
+        await _update_conversations(db, direct)
+    await db.commit()           # Коммитим изменения в сессии
+    
+    return message_ids          # Возвращаем ID сообщений
+
+# Ограничивает запрос истории страницей до сообщения before_id, от новых к старым, или с after_id —
+# страницей после сообщения after_id, от старых к новым (догрузка только новых сообщений).
+# Порядок (created_at, id) совпадает с порядком секций: первая страница читает только самые новые секции,
+# а время сообщения-курсора отсекает лишние секции еще до выполнения запроса
+def _history_page(query, before_id: Optional[int], limit: int, after_id: Optional[int] = None):
+    if after_id is not None:
+        cursor_at = select(models.Message.created_at).where(models.Message.id == after_id).scalar_subquery()
+        query = query.where(
+            models.Message.created_at >= cursor_at,
+            tuple_(models.Message.created_at, models.Message.id) > tuple_(cursor_at, after_id)
+        )
+        return query.order_by(models.Message.created_at, models.Message.id).limit(limit)
+    if before_id is not None:
+        cursor_at = select(models.Message.created_at).where(models.Message.id == before_id).scalar_subquery()
+        query = query.where(
+            models.Message.created_at <= cursor_at,
+            tuple_(models.Message.created_at, models.Message.id) < tuple_(cursor_at, before_id)
         )
-    ).all()
+    return query.order_by(models.Message.created_at.desc(), models.Message.id.desc()).limit(limit)
+
+# Возвращает страницу переписки двух пользователей в хронологическом порядке
+@timed_operation
+async def get_messages_by_user_ids(
+    db: AsyncSession,
+    user1_id: int,
+    user2_id: int,
+    before_id: Optional[int] = None,
+    limit: int = 50,
+    after_id: Optional[int] = None
+) -> List[models.Message]:
+    low_id, high_id = sorted((user1_id, user2_id))
+    
+    # Условия повторяют выражения индекса ix_messages_pair_created_at, поэтому страница читается одним диапазоном индекса
+    query = select(models.Message).where(
+        func.least(models.Message.sender_id, models.Message.receiver_id) == low_id,
+        func.greatest(models.Message.sender_id, models.Message.receiver_id) == high_id
+    )
+    
+    result = await db.scalars(_history_page(query, before_id, limit, after_id))
+    messages = list(result)
+    if after_id is None:
+        messages.reverse()
+    
+    return messages
+
+# Конфигурация полнотекстового поиска без стемминга: в переписках смешиваются языки.
+# Выражение to_tsvector должно совпадать с индексом ix_messages_text_search, иначе индекс не используется
+SEARCH_CONFIG = literal_column("'simple'::regconfig")
+HEADLINE_START = "\ue000"                                      # Маркеры найденных слов во фрагменте, заменяются при выдаче
+HEADLINE_STOP = "\ue001"
+
+# Ищет сообщения личных переписок пользователя по тексту, от новых к старым; с peer_id — только в переписке с этим собеседником.
+# Возвращает (ID, отправитель, получатель, текст, фрагмент с найденными словами)
+@timed_operation
+async def search_messages(
+    db: AsyncSession,
+    user_id: int,
+    query: str,
+    peer_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: int = 20
+) -> List[Tuple[int, int, int, str, str]]:
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, query)
+    page = select(models.Message.id, models.Message.created_at).where(func.to_tsvector(SEARCH_CONFIG, models.Message.text).op("@@")(tsquery))
+    
+    # Ищем только в личных переписках: у сообщений группы нет получателя, и собеседника для результата не найти
+    page = page.where(models.Message.group_id.is_(None))
+    if peer_id is not None:
+        low_id, high_id = sorted((user_id, peer_id))
+        page = page.where(
+            func.least(models.Message.sender_id, models.Message.receiver_id) == low_id,
+            func.greatest(models.Message.sender_id, models.Message.receiver_id) == high_id
+        )
+    else:
+        page = page.where(or_(models.Message.sender_id == user_id, models.Message.receiver_id == user_id))
+    if before_id is not None:
+        page = page.where(models.Message.id < before_id)
+    page = page.order_by(models.Message.id.desc()).limit(limit).subquery()
+    
+    # Фрагменты строятся только для сообщений страницы: ts_headline заново разбирает текст.
+    # Соединение по полному первичному ключу позволяет обращаться только к секции каждого сообщения
+    headline = func.ts_headline(
+        SEARCH_CONFIG, models.Message.text, tsquery,
+        f"StartSel={HEADLINE_START}, StopSel={HEADLINE_STOP}, MaxWords=30, MinWords=10"
+    )
+    result = await db.execute(
+        select(models.Message.id, models.Message.sender_id, models.Message.receiver_id, models.Message.text, headline)
+        .join(page, (page.c.id == models.Message.id) & (page.c.created_at == models.Message.created_at))
+        .order_by(models.Message.id.desc())
+    )
+    return list(result.tuples())
+
+# Создает группу с создателем и участниками
+@timed_operation
+async def create_group(db: AsyncSession, name: str, owner_id: int, member_ids: List[int]) -> models.Group:
+    group = models.Group(name=name, owner_id=owner_id)
+    db.add(group)
+    await db.flush()            # Вставляем группу, чтобы получить ее ID
+    
+    # Участники, которых нет среди пользователей, не добавляются
+    user_ids = select(models.User.id).where(models.User.id.in_({owner_id, *member_ids}))
+    await db.execute(insert(models.GroupMember).from_select(["group_id", "user_id"], select(literal(group.id), user_ids.subquery().c.id)))
+    await db.commit()           # Коммитим изменения в сессии
+    
+    return group
+
+# Возвращает группу по идентификатору
+@timed_operation
+async def get_group(db: AsyncSession, group_id: int) -> models.Group:
+    return await db.scalar(select(models.Group).where(models.Group.id == group_id))
+
+# Возвращает группы пользователя по возрастанию ID
+@timed_operation
+async def get_user_groups(db: AsyncSession, user_id: int) -> List[models.Group]:
+    result = await db.scalars(
+        select(models.Group).join(models.GroupMember, models.GroupMember.group_id == models.Group.id)
+        .where(models.GroupMember.user_id == user_id)
+        .order_by(models.Group.id)
+    )
+    return list(result)
+
+# Возвращает ID групп пользователя (по индексу ix_group_members_user_id без обращения к таблице)
+@timed_operation
+async def get_user_group_ids(db: AsyncSession, user_id: int) -> List[int]:
+    result = await db.scalars(select(models.GroupMember.group_id).where(models.GroupMember.user_id == user_id))
+    return list(result)
+
+# Возвращает участников группы по алфавиту
+@timed_operation
+async def get_group_members(db: AsyncSession, group_id: int) -> List[models.User]:
+    result = await db.scalars(
+        select(models.User).join(models.GroupMember, models.GroupMember.user_id == models.User.id)
+        .where(models.GroupMember.group_id == group_id)
+        .order_by(models.User.username)
+    )
+    return list(result)
+
+# Возвращает число участников группы
+@timed_operation
+async def count_group_members(db: AsyncSession, group_id: int) -> int:
+    return await db.scalar(select(func.count()).select_from(models.GroupMember).where(models.GroupMember.group_id == group_id))
+
+# Добавляет участников в группу, возвращает ID действительно добавленных
+@timed_operation
+async def add_group_members(db: AsyncSession, group_id: int, user_ids: List[int]) -> List[int]:
+    existing = select(models.User.id).where(models.User.id.in_(user_ids)).subquery()
+    query = pg_insert(models.GroupMember).from_select(["group_id", "user_id"], select(literal(group_id), existing.c.id))
+    result = await db.scalars(query.on_conflict_do_nothing().returning(models.GroupMember.user_id))
+    added = list(result)
+    await db.commit()           # Коммитим изменения в сессии
+    
+    return added
+
+# Исключает участника из группы, возвращает False, если он в ней не состоял
+@timed_operation
+async def remove_group_member(db: AsyncSession, group_id: int, user_id: int) -> bool:
+    result = await db.execute(
+        delete(models.GroupMember).where(models.GroupMember.group_id == group_id, models.GroupMember.user_id == user_id)
+    )
+    await db.commit()           # Коммитим изменения в сессии
+    
+    return result.rowcount > 0
+
+# Возвращает страницу истории группы в хронологическом порядке (по индексу ix_messages_group_id_created_at)
+@timed_operation
+async def get_group_messages(
+    db: AsyncSession,
+    group_id: int,
+    before_id: Optional[int] = None,
+    limit: int = 50,
+    after_id: Optional[int] = None
+) -> List[models.Message]:
+    query = select(models.Message).where(models.Message.group_id == group_id)
+    
+    result = await db.scalars(_history_page(query, before_id, limit, after_id))
+    messages = list(result)
+    if after_id is None:
+        messages.reverse()
     
     return messages
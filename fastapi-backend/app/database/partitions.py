@@ -0,0 +1,195 @@
+import argparse, asyncio, gzip, json, logging, os, re
+from datetime import datetime, timezone
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import config
+from app.database import Session, engine
+
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "messages"
+COLUMNS = ["id", "sender_id", "receiver_id", "group_id", "text", "created_at"]   # Порядок колонок в архиве
+PARTITION_NAME = re.compile(r"^messages_(\d{4})_(\d{2})$")
+UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+LOCK_ID = 0x6d736770                                                            # Ключ advisory-блокировки создания секций
+
+
+# Возвращает начало месяца (UTC), сдвинутого на months от месяца moment
+def month_start(moment: datetime, months: int = 0) -> datetime:
+    index = moment.year * 12 + moment.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+def partition_name(start: datetime) -> str:
+    return f"{PARENT_TABLE}_{start:%Y_%m}"
+
+# Имена секций подставляются в DDL, поэтому принимаются только имена, которые создает миграция и ensure_partitions
+def check_partition_name(name: str):
+    if name != "messages_legacy" and PARTITION_NAME.match(name) is None:
+        raise ValueError(f"{name} is not a message partition name")
+
+
+# Возвращает секции таблицы сообщений: (имя, граница FOR VALUES, примерное число строк, размер в байтах), от старых к новым
+async def list_partitions(db: AsyncSession) -> list[tuple[str, str, int, int]]:
+    result = await db.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), GREATEST(c.reltuples, 0)::bigint, pg_total_relation_size(c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = CAST(:parent AS regclass)
+        ORDER BY c.relname = 'messages_legacy' DESC, c.relname
+    """), {"parent": PARENT_TABLE})
+    return list(result.tuples())
+
+
+# Создает месячные секции на months_ahead месяцев вперед, начиная с конца последней существующей.
+# Вставка в диапазон без секции завершается ошибкой, поэтому секции создаются заранее при старте и по таймеру.
+# Воркеры делают это одновременно: работу выполняет тот, кто взял блокировку, остальные пропускают проход
+async def ensure_partitions(db: AsyncSession, months_ahead: int = config.MESSAGE_PARTITIONS_AHEAD) -> list[str]:
+    if not await db.scalar(text("SELECT pg_try_advisory_xact_lock(:lock_id)"), {"lock_id": LOCK_ID}):
+        return []
+
+    now = datetime.now(timezone.utc)
+    start = month_start(now)
+    bounds = [UPPER_BOUND.search(bound) for _, bound, _, _ in await list_partitions(db)]
+    uppers = [datetime.fromisoformat(match.group(1)) for match in bounds if match is not None]
+    if uppers:
+        start = max(start, max(uppers))
+
+    # Создание секции ненадолго блокирует таблицу; не ждем дольше lock_timeout за долгими запросами
+    await db.execute(text("SET LOCAL lock_timeout = '2s'"))
+    created = []
+    while start < month_start(now, months_ahead + 1):
+        end = month_start(start, 1)
+        name = partition_name(start)
+        await db.execute(text(
+            f"CREATE TABLE {name} PARTITION OF {PARENT_TABLE} FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+        created.append(name)
+        start = end
+    await db.commit()
+
+    return created
+
+# Периодически досоздает секции, пока работает воркер
+async def maintain_partitions(interval: float = config.MESSAGE_PARTITIONS_CHECK_INTERVAL):
+    while True:
+        try:
+            async with Session() as db:
+                created = await ensure_partitions(db)
+            if created:
+                logger.info("Created message partitions: %s", ", ".join(created))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.warning("Failed to create message partitions", exc_info=True)
+        await asyncio.sleep(interval)
+
+
+# Отсоединяет секцию, выгружает ее в <directory>/<секция>.csv.gz с описанием границ в <секция>.json и удаляет.
+# Отсоединение CONCURRENTLY не блокирует чтение и запись в messages; прерванное отсоединение завершается повторным запуском
+async def archive_partition(name: str, directory: str) -> int:
+    check_partition_name(name)
+    async with engine.connect() as connection:
+        raw = (await connection.get_raw_connection()).driver_connection
+        row = await raw.fetchrow("""
+            SELECT pg_get_expr(c.relpartbound, c.oid) AS bound, i.inhdetachpending AS pending
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = $1::regclass AND c.relname = $2
+        """, PARENT_TABLE, name)
+        if row is None:
+            raise ValueError(f"{name} is not a partition of {PARENT_TABLE}")
+
+        # Текущая и будущие секции принимают новые сообщения
+        match = UPPER_BOUND.search(row["bound"])
+        if match is None or datetime.fromisoformat(match.group(1)) > month_start(datetime.now(timezone.utc)):
+            raise ValueError(f"{name} still receives new messages")
+
+        if row["pending"]:
+            await raw.execute(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name} FINALIZE")
+        else:
+            await raw.execute(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name} CONCURRENTLY")
+
+        os.makedirs(directory, exist_ok=True)
+        data_path = os.path.join(directory, f"{name}.csv.gz")
+        with gzip.open(data_path + ".tmp", "wb") as file:
+            async def write(chunk: bytes):
+                file.write(chunk)
+            status = await raw.copy_from_table(name, columns=COLUMNS, output=write, format="csv", header=True)
+        rows = int(status.split()[-1])
+        os.replace(data_path + ".tmp", data_path)
+
+        with open(os.path.join(directory, f"{name}.json"), "w") as file:
+            json.dump({"table": name, "bound": row["bound"], "rows": rows, "columns": COLUMNS}, file, indent=2)
+
+        # Таблица удаляется только после того, как архив полностью записан
+        await raw.execute(f"DROP TABLE {name}")
+        return rows
+
+# Восстанавливает секцию из архива archive_partition и снова подключает ее к messages
+async def restore_partition(name: str, directory: str) -> int:
+    check_partition_name(name)
+    with open(os.path.join(directory, f"{name}.json")) as file:
+        manifest = json.load(file)
+
+    async with engine.connect() as connection:
+        raw = (await connection.get_raw_connection()).driver_connection
+        async with raw.transaction():
+            await raw.execute(f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS)")
+
+            async def read():
+                with gzip.open(os.path.join(directory, f"{name}.csv.gz"), "rb") as file:
+                    while chunk := file.read(1 << 20):
+                        yield chunk
+            status = await raw.copy_to_table(name, source=read(), columns=manifest["columns"], format="csv", header=True)
+            rows = int(status.split()[-1])
+            if rows != manifest["rows"]:
+                raise ValueError(f"{name}: archive has {rows} rows, expected {manifest['rows']}")
+
+            # Индексы и внешние ключи секция получает от messages при подключении
+            await raw.execute(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} {manifest['bound']}")
+        return rows
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Управление месячными секциями таблицы сообщений")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="показать секции")
+    ensure = commands.add_parser("ensure", help="создать секции на месяцы вперед")
+    ensure.add_argument("--months-ahead", type=int, default=config.MESSAGE_PARTITIONS_AHEAD)
+    archive = commands.add_parser("archive", help="выгрузить секции в сжатые файлы и удалить их из БД")
+    archive.add_argument("partitions", nargs="*", help="имена секций (messages_2024_01, messages_legacy)")
+    archive.add_argument("--older-than", type=int, help="архивировать все месячные секции старше стольких месяцев")
+    archive.add_argument("--dir", default="archive", help="каталог архива")
+    restore = commands.add_parser("restore", help="вернуть секции из архива")
+    restore.add_argument("partitions", nargs="+")
+    restore.add_argument("--dir", default="archive", help="каталог архива")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "list":
+            async with Session() as db:
+                for name, bound, rows, size in await list_partitions(db):
+                    print(f"{name:<20} {rows:>12} rows {size / 2 ** 20:>10.1f} MB  {bound}")
+        elif args.command == "ensure":
+            async with Session() as db:
+                created = await ensure_partitions(db, args.months_ahead)
+            print("created: " + (", ".join(created) or "nothing"))
+        elif args.command == "archive":
+            names = list(args.partitions)
+            if args.older_than is not None:
+                boundary = month_start(datetime.now(timezone.utc), -args.older_than)
+                async with Session() as db:
+                    for name, _, _, _ in await list_partitions(db):
+                        match = PARTITION_NAME.match(name)
+                        if match is not None and datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc) < boundary:
+                            names.append(name)
+            for name in names:
+                print(f"{name}: archived {await archive_partition(name, args.dir)} rows")
+        elif args.command == "restore":
+            for name in args.partitions:
+                print(f"{name}: restored {await restore_partition(name, args.dir)} rows")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+import asyncio, logging, time
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from app import config
+from app.database import Session, replica_engines
+from app.utils.metrics import register_stats
+from app.utils.redis_client import redis
+
+
+logger = logging.getLogger(__name__)
+
+WRITTEN_KEY_PREFIX = "chat:db:written:"                        # Время последней записи по области (user:<ID>, group:<ID>)
+
+# Отставание реплики в секундах. Пока вся полученная WAL применена, реплика не отстает,
+# даже если основная БД давно ничего не писала и время последней транзакции старое
+LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+# Класс маршрутизации чтения между основной БД и репликами
+#
+# Запросы только на чтение уходят на реплики по кругу, если их отставание не больше MAX_LAG.
+# Чтобы пользователь сразу видел свои записи, запись отмечает время в Redis для затронутых областей
+# (отправитель и получатель сообщения, группа), и реплика выбирается, только если отставание
+# наверняка меньше возраста последней записи. Отставание измеряется раз в LAG_CHECK_INTERVAL,
+# поэтому к нему прибавляется время с момента измерения. Иначе и при недоступности Redis чтение идет в основную БД.
+# Без реплик отметки не пишутся и все сессии — основная БД.
+class ReplicaRouter:
+    def __init__(
+        self,
+        engines: list = replica_engines,
+        max_lag: float = config.DATABASE_REPLICA_MAX_LAG,
+        check_interval: float = config.DATABASE_REPLICA_LAG_CHECK_INTERVAL
+    ):
+        self.sessions = [async_sessionmaker(engine, autoflush=False, expire_on_commit=False) for engine in engines]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lags: list[float | None] = [None] * len(self.sessions)            # Последнее измеренное отставание, None — реплика недоступна
+        self._measured_at = [0.0] * len(self.sessions)
+        self._task: asyncio.Task | None = None
+        self._next = 0
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.lag_fallbacks = 0                                                   # Ни одна реплика не укладывается в MAX_LAG
+        self.write_fallbacks = 0                                                 # Реплики еще не получили последнюю запись
+
+    def start(self):
+        if self.sessions:
+            self._task = asyncio.create_task(self._monitor())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def mark_written(self, *scopes: str):
+        if not self.sessions or not scopes:
+            return
+
+        # Отметка нужна, пока реплика может не успеть ее применить
+        ttl_ms = int((self.max_lag + self.check_interval) * 1000)
+        now = time.time()
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                for scope in set(scopes):
+                    pipe.set(WRITTEN_KEY_PREFIX + scope, now, px=ttl_ms)
+                await pipe.execute()
+        except Exception:
+            logger.warning("Failed to mark database write", exc_info=True)
+
+    async def sessionmaker(self, *scopes: str) -> async_sessionmaker:
+        now = time.monotonic()
+        lags = {
+            index: lag + now - self._measured_at[index]
+            for index, lag in enumerate(self.lags)
+            if lag is not None and lag <= self.max_lag
+        }
+        if not lags:
+            if self.sessions:
+                self.lag_fallbacks += 1
+            self.primary_reads += 1
+            return Session
+
+        if scopes:
+            try:
+                written = await redis.mget([WRITTEN_KEY_PREFIX + scope for scope in scopes])
+                age = time.time() - max((float(value) for value in written if value is not None), default=0)
+            except Exception:
+                logger.warning("Failed to read database write marks", exc_info=True)
+                age = 0
+            lags = {index: lag for index, lag in lags.items() if lag < age}
+            if not lags:
+                self.write_fallbacks += 1
+                self.primary_reads += 1
+                return Session
+
+        candidates = sorted(lags)
+        index = candidates[self._next % len(candidates)]
+        self._next += 1
+        self.replica_reads += 1
+        return self.sessions[index]
+
+    def stats(self) -> dict:
+        return {
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+            "lag_fallbacks": self.lag_fallbacks,
+            "write_fallbacks": self.write_fallbacks,
+            "replicas": {
+                str(index): {"lag_seconds": lag if lag is not None else -1}
+                for index, lag in enumerate(self.lags)
+            }
+        }
+
+    async def _monitor(self):
+        while True:
+            await asyncio.gather(*(self._measure(index) for index in range(len(self.sessions))))
+            await asyncio.sleep(self.check_interval)
+
+    async def _measure(self, index: int):
+        try:
+            async with self.sessions[index]() as db:
+                lag = await asyncio.wait_for(db.scalar(LAG_QUERY), self.max_lag)
+            self.lags[index] = float(lag)
+            self._measured_at[index] = time.monotonic()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            if self.lags[index] is not None:
+                logger.warning("Database replica %d is unavailable", index, exc_info=True)
+            self.lags[index] = None
+
+
+replica_router = ReplicaRouter()
+register_stats("db_replicas", replica_router.stats, label="replica")
@@ -10,5 +10,9 @@ tags_metadata = [
     {
         "name": "chats",
         "description": "Работа с чатами"
+    },
+    {
+        "name": "groups",
+        "description": "Работа с групповыми чатами"
     }
 ]
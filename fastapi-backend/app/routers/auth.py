@@ -1,9 +1,11 @@
 import datetime
 from jose import jwt
-from sqlalchemy import orm
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import  Depends, HTTPException, status
 from fastapi.routing import APIRouter
 from app.utils import auth
+from app.utils.password_hasher import password_hasher, PasswordHasherOverloaded
 from app.database import operations, get_db
 from app.schemas import token as token_schema
 from app.schemas import user as user_schema
@@ -12,9 +14,24 @@ from app.schemas import user as user_schema
 router = APIRouter(prefix="/auth") 
 
 
+# Хэширует пароль, при переполненной очереди хэширования возвращает 503
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherOverloaded:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server is busy, try again later")
+
+# Проверяет пароль, при переполненной очереди хэширования возвращает 503
+async def verify_password(password: str, hashed_password: str) -> bool:
+    try:
+        return await password_hasher.verify(password, hashed_password)
+    except PasswordHasherOverloaded:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server is busy, try again later")
+
+
 # Эндпоинт для регистрации пользователя
 @router.post("/register", response_model=token_schema.Token, tags=["auth"], summary="Регистрации пользователя")
-def register_user(user: user_schema.UserAuth, db: orm.Session = Depends(get_db)):
+async def register_user(user: user_schema.UserAuth, db: AsyncSession = Depends(get_db)):
     """
     ## Регистрация пользователя
     
@@ -31,6 +48,7 @@ def register_user(user: user_schema.UserAuth, db: orm.Session = Depends(get_db))
     ### Возможные ответы:
     - **200 OK**: Возвращает JSON с токеном доступа, если регистрация прошла успешно.
     - **400 BAD REQUEST**: Возвращается, если имя пользователя уже зарегистрировано.
+    - **503 SERVICE UNAVAILABLE**: Возвращается, если очередь хэширования паролей переполнена.
 
     ### Пример успешного ответа:
     ```json
@@ -46,11 +64,18 @@ def register_user(user: user_schema.UserAuth, db: orm.Session = Depends(get_db))
     - Токен доступа действителен в течение определенного времени, указанного в конфигурации.
     """
     
-    db_user = operations.get_user_by_username(db, username=user.username)
+    db_user = await operations.get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already registered")
+    await db.close()                                        # Не держим соединение с БД, пока считается bcrypt
     
-    db_user = operations.create_user(db=db, user=user)
+    hashed_password = await hash_password(user.password)     # Хэшируем пароль в пуле потоков
+    try:
+        db_user = await operations.create_user(db=db, username=user.username, hashed_password=hashed_password)
+    except IntegrityError:
+        # Пока считался bcrypt, это имя мог занять параллельный запрос
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already registered")
 
     access_token_expires = datetime.timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     
@@ -64,7 +89,7 @@ def register_user(user: user_schema.UserAuth, db: orm.Session = Depends(get_db))
 
 # Эндпоинт для аутентификации пользователя
 @router.post("/login", response_model=token_schema.Token, tags=["auth"], summary="Аутентификация пользователя")
-async def login_endpoint(credentials: user_schema.UserAuth, db: orm.Session = Depends(get_db)):
+async def login_endpoint(credentials: user_schema.UserAuth, db: AsyncSession = Depends(get_db)):
     """
     ## Аутентификация пользователя
     
@@ -81,6 +106,7 @@ async def login_endpoint(credentials: user_schema.UserAuth, db: orm.Session = De
     ### Возможные ответы:
     - **200 OK**: Возвращает JSON с токеном доступа, если регистрация прошла успешно.
     - **401 UNAUTHORIZED**: Возвращается, если имя пользователя или пароль неверные.
+    - **503 SERVICE UNAVAILABLE**: Возвращается, если очередь хэширования паролей переполнена.
 
     ### Пример успешного ответа:
     ```json
@@ -96,8 +122,9 @@ async def login_endpoint(credentials: user_schema.UserAuth, db: orm.Session = De
     - Токен доступа действителен в течение определенного времени, указанного в конфигурации.
     """
     
-    user = operations.get_user_by_username(db, username=credentials.username)
-    if not user or not auth.pwd_context.verify(credentials.password, user.hashed_password):
+    user = await operations.get_user_by_username(db, username=credentials.username)
+    await db.close()                                        # Не держим соединение с БД, пока считается bcrypt
+    if not user or not await verify_password(credentials.password, user.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
     
     access_token_expires = datetime.timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
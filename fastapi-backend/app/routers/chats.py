@@ -1,35 +1,67 @@
-import asyncio, json
+import asyncio, base64, html, json, logging
+from typing import Optional
 from fastapi import  Depends, HTTPException, status
 from fastapi.routing import APIRouter
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from sqlalchemy import orm
-from redis.asyncio import Redis
-from app.utils.auth import get_current_user, get_user_by_token
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from app import config
+from app.utils.auth import get_current_user, get_read_db, get_user_by_token
 from app.schemas import chat as chat_schema
 from app.schemas import user as user_schema
-from app.database import models, get_db
-from app.database.operations import get_user_by_id, create_message, get_messages_by_user_ids
-from app.utils.connection_manager import ConnectionManager
+from app.database import get_db
+from app.database.replicas import replica_router
+from app.database.operations import HEADLINE_START, HEADLINE_STOP, get_conversations, get_other_users, get_messages_by_user_ids, mark_conversation_read, search_messages
+from app.utils.connection_directory import connection_directory
+from app.utils.connection_manager import Connection, ConnectionManager
+from app.utils.events import DEFAULT_CODEC, TRANSIENT_EVENT_TYPES, Event, format_event_id, negotiate_codec, parse_event_id, receive_event
+from app.utils.event_stream import EventStream
+from app.utils.identity_cache import identity_cache
+from app.utils.group_membership import group_membership
+from app.utils.presence import presence
+from app.utils.rate_limiter import RateLimiter
+from app.utils.metrics import REDIS_RECEIVED, register_stats
+from app.utils.redis_client import redis
+from app.utils.message_writer import MessageWriter
 
 
+logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/chats")
-redis = Redis(host="chat_redis", db=1, decode_responses=True)
-manager = ConnectionManager()
+manager = ConnectionManager(directory=connection_directory)
+message_writer = MessageWriter()
+event_stream = EventStream(redis)
+rate_limiter = RateLimiter(redis)
+register_stats("websocket", manager.stats)
+register_stats("message_writer", message_writer.stats)
+register_stats("rate_limiter", rate_limiter.stats, label="budget")
+background_tasks: set[asyncio.Task] = set()
 
 
 @router.get("", response_model=user_schema.UserList, tags=["chats"], summary="Список чатов")
-async def get_all_chats(current_user: user_schema.User = Depends(get_current_user), db: orm.Session = Depends(get_db)):
+async def get_all_chats(
+    q: Optional[str] = Query(None, max_length=64),
+    cursor: Optional[str] = None,
+    limit: int = Query(config.CONTACTS_PAGE_SIZE, ge=1, le=config.CONTACTS_MAX_PAGE_SIZE),
+    current_user: user_schema.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
     """
     ## Получение списка пользователей для чатов
 
-    Позволяет получить список всех пользователей, кроме текущего авторизованного пользователя.
+    Позволяет получить страницу списка пользователей, кроме текущего авторизованного пользователя.
+    Сначала идут собеседники, начиная с самой свежей переписки, затем остальные пользователи в алфавитном порядке.
     Это может быть использовано для отображения доступных контактов для начала чата.
 
+    ### Параметры:
+    - **q**: Поиск по началу имени пользователя без учета регистра.
+    - **cursor**: Курсор страницы из `next_cursor` предыдущего ответа. Для первой страницы не передается.
+    - **limit**: Количество пользователей на странице.
+
     ### Пример запроса:
     Запрос делается с использованием токена в заголовке:
 
     ```http
-    GET /chats
+    GET /chats?q=us&limit=2
     Authorization: Bearer <токен>
     ```
 
@@ -45,36 +77,223 @@ async def get_all_chats(current_user: user_schema.User = Depends(get_current_use
                 "id": 2,
                 "username": "user2"
             }
-        ]
+        ],
+        "next_cursor": "WyJhbGwiLCAidXNlcjIiXQ"
     }
     ```
 
     ### Возможные ответы:
-    - **200 OK**: Возвращает список всех пользователей, кроме текущего.
+    - **200 OK**: Возвращает страницу пользователей, кроме текущего.
+    - **400 BAD REQUEST**: Возвращается, если курсор некорректен.
     - **401 UNAUTHORIZED**: Возвращается, если токен авторизации недействителен или отсутствует.
 
     ### Ошибки:
+    - **400**: "Invalid cursor" — если курсор поврежден или получен не от этого эндпоинта.
     - **401**: "Unauthorized" — если токен авторизации отсутствует или недействителен.
 
     ### Заметки:
     - Текущий авторизованный пользователь исключается из списка пользователей.
+    - `next_cursor` равный `null` означает, что список закончился.
     - Пользователь должен быть авторизован для доступа к этому эндпоинту.
 
     """
     
-    users =  db.query(models.User).filter(models.User.username != current_user.username).all()
-    return user_schema.UserList(users=users)
+    phase, position = decode_contacts_cursor(cursor)
+    users = []
+    next_cursor = None
+    
+    # Собеседники по убыванию ID последнего сообщения
+    if phase == "recent":
+        conversations = await get_conversations(db, current_user.id, prefix=q, before_message_id=position, limit=limit + 1)
+        if len(conversations) > limit:
+            conversations = conversations[:limit]
+            next_cursor = encode_contacts_cursor("recent", conversations[-1][0].last_message_id)
+            return user_schema.UserList(users=[user for _, user in conversations], next_cursor=next_cursor)
+        
+        users = [user for _, user in conversations]
+        position = None
+    
+    # Остальные пользователи по алфавиту
+    remaining = limit - len(users)
+    others = await get_other_users(db, current_user.id, prefix=q, after_username=position, limit=remaining + 1)
+    if len(others) > remaining:
+        others = others[:remaining]
+        next_cursor = encode_contacts_cursor("all", others[-1].username if others else (position or ""))
+    users.extend(others)
+    
+    return user_schema.UserList(users=users, next_cursor=next_cursor)
+
+@router.get("/conversations", response_model=chat_schema.ConversationList, tags=["chats"], summary="Список переписок")
+async def get_conversation_list(
+    before_id: Optional[int] = None,
+    limit: int = Query(config.CONTACTS_PAGE_SIZE, ge=1, le=config.CONTACTS_MAX_PAGE_SIZE),
+    current_user: user_schema.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    ## Получение списка переписок
+
+    Позволяет получить переписки текущего пользователя для боковой панели чатов: собеседника,
+    последнее сообщение и количество непрочитанных сообщений. Переписки идут от самой свежей.
+
+    ### Параметры:
+    - **before_id**: Курсор страницы — вернуть переписки, последнее сообщение которых старше сообщения с этим ID.
+    - **limit**: Количество переписок на странице.
+
+    ### Пример запроса:
+    ```http
+    GET /chats/conversations?limit=20
+    Authorization: Bearer <токен>
+    ```
+
+    ### Пример успешного ответа:
+    ```json
+    {
+        "conversations": [
+            {
+                "user": {
+                    "id": 2,
+                    "username": "user2"
+                },
+                "last_message": {
+                    "id": 42,
+                    "type": "received",
+                    "text": "Hi, how are you?"
+                },
+                "last_message_at": "2024-10-23T12:00:00Z",
+                "unread": 3
+            }
+        ],
+        "next_cursor": null
+    }
+    ```
+
+    ### Возможные ответы:
+    - **200 OK**: Возвращает страницу переписок.
+    - **401 UNAUTHORIZED**: Возвращается, если токен авторизации недействителен или отсутствует.
+
+    ### Заметки:
+    - Для следующей страницы передайте `next_cursor` в параметре `before_id`; `null` означает, что список закончился.
+    - Счетчик непрочитанных сбрасывается запросом `POST /chats/{user_id}/read`.
+
+    """
+    
+    rows = await get_conversations(db, current_user.id, before_message_id=before_id, limit=limit + 1)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    # Формируем список переписок
+    conversations = []
+    for conversation, user in rows:
+        is_sent = conversation.last_message_sender_id == current_user.id
+        last_message = chat_schema.Message(
+            id=conversation.last_message_id,
+            type=chat_schema.MessageType.SENT if is_sent else chat_schema.MessageType.RECEIVED,
+            text=conversation.last_message_text
+        )
+        unread = conversation.user1_unread if conversation.user1_id == current_user.id else conversation.user2_unread
+        conversations.append(chat_schema.Conversation(user=user, last_message=last_message, last_message_at=conversation.last_message_at, unread=unread))
+    
+    next_cursor = rows[-1][0].last_message_id if has_more else None
+    return chat_schema.ConversationList(conversations=conversations, next_cursor=next_cursor)
+
+@router.get("/search", response_model=chat_schema.SearchResults, tags=["chats"], summary="Поиск по сообщениям")
+async def search_chat_messages(
+    q: str = Query(..., min_length=1, max_length=256),
+    user_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: int = Query(config.SEARCH_PAGE_SIZE, ge=1, le=config.SEARCH_MAX_PAGE_SIZE),
+    current_user: user_schema.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    ## Поиск по сообщениям
+
+    Ищет сообщения текущего пользователя по тексту во всех его переписках или в переписке с одним собеседником.
+    Результаты идут от новых сообщений к старым.
+
+    ### Параметры:
+    - **q**: Поисковый запрос. Поддерживаются фразы в кавычках, `or` и исключение слов через `-`.
+    - **user_id**: ID собеседника, чтобы искать только в переписке с ним.
+    - **before_id**: Курсор страницы — вернуть сообщения с ID меньше указанного. Для первой страницы не передается.
+    - **limit**: Количество результатов на странице.
+
+    ### Пример запроса:
+    ```http
+    GET /chats/search?q=hello&limit=20
+    Authorization: Bearer <токен>
+    ```
+
+    ### Пример успешного ответа:
+    ```json
+    {
+        "results": [
+            {
+                "id": 41,
+                "type": "sent",
+                "user": {
+                    "id": 2,
+                    "username": "user2"
+                },
+                "text": "Hello!",
+                "highlight": "<mark>Hello</mark>!"
+            }
+        ],
+        "next_cursor": null
+    }
+    ```
+
+    ### Возможные ответы:
+    - **200 OK**: Возвращает страницу найденных сообщений.
+    - **401 UNAUTHORIZED**: Возвращается, если токен авторизации недействителен или отсутствует.
+
+    ### Заметки:
+    - Слова сравниваются целиком без учета регистра и словоформ.
+    - Ищутся только личные сообщения, сообщения групп в результаты не попадают.
+    - `highlight` экранирован для HTML, найденные слова обернуты в `<mark>`.
+    - Для следующей страницы передайте `next_cursor` в параметре `before_id`; `null` означает, что результаты закончились.
+
+    """
+    
+    rows = await search_messages(db, current_user.id, q, peer_id=user_id, before_id=before_id, limit=limit + 1)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    # Собеседник каждого найденного сообщения, имена берутся из кэша
+    peer_ids = [receiver_id if sender_id == current_user.id else sender_id for _, sender_id, receiver_id, _, _ in rows]
+    usernames = await identity_cache.get_usernames(list(set(peer_ids)), db)
+    
+    results = []
+    for (message_id, sender_id, _, text, headline), peer_id in zip(rows, peer_ids):
+        message_type = chat_schema.MessageType.SENT if sender_id == current_user.id else chat_schema.MessageType.RECEIVED
+        highlight = html.escape(headline).replace(HEADLINE_START, "<mark>").replace(HEADLINE_STOP, "</mark>")
+        user = user_schema.User(id=peer_id, username=usernames.get(peer_id, ""))
+        results.append(chat_schema.SearchResult(id=message_id, type=message_type, user=user, text=text, highlight=highlight))
+    
+    next_cursor = rows[-1][0] if has_more else None
+    return chat_schema.SearchResults(results=results, next_cursor=next_cursor)
 
 @router.get("/{user_id}", response_model=chat_schema.Chat, tags=["chats"], summary="Информация о чате")
-async def get_chat(user_id, current_user: user_schema.User = Depends(get_current_user), db: orm.Session = Depends(get_db)):
+async def get_chat(
+    user_id: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(config.HISTORY_PAGE_SIZE, ge=1, le=config.HISTORY_MAX_PAGE_SIZE),
+    current_user: user_schema.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
     """
     ## Получение информации о чате
 
     Позволяет получить чат между текущим авторизованным пользователем и другим пользователем по его ID.
-    Возвращает список сообщений, которые были отправлены или получены текущим пользователем.
+    Возвращает страницу переписки этих двух пользователей: последние `limit` сообщений, идущих до `before_id`,
+    или первые `limit` сообщений после `after_id`.
 
     ### Параметры:
     - **user_id**: ID пользователя, с которым ведется чат.
+    - **before_id**: Курсор страницы — вернуть сообщения, отправленные до сообщения с этим ID. Для первой страницы не передается.
+    - **after_id**: Вернуть только сообщения, отправленные после сообщения с этим ID (догрузка после переподключения).
+    - **limit**: Количество сообщений на странице.
 
     ### Пример запроса:
     Запрос делается с использованием токена в заголовке и включает ID пользователя, с которым необходимо получить чат:
@@ -93,19 +312,23 @@ async def get_chat(user_id, current_user: user_schema.User = Depends(get_current
         },
         "messages": [
             {
+                "id": 41,
                 "type": "sent",
                 "text": "Hello!"
             },
             {
+                "id": 42,
                 "type": "received",
                 "text": "Hi, how are you?"
             }
-        ]
+        ],
+        "next_cursor": 41
     }
     ```
 
     ### Возможные ответы:
     - **200 OK**: Возвращает информацию о пользователе и список сообщений между пользователями.
+    - **400 BAD REQUEST**: Возвращается, если переданы одновременно `before_id` и `after_id`.
     - **404 NOT FOUND**: Возвращается, если указанный пользователь не найден.
     - **401 UNAUTHORIZED**: Возвращается, если токен авторизации недействителен или отсутствует.
 
@@ -115,77 +338,286 @@ async def get_chat(user_id, current_user: user_schema.User = Depends(get_current
 
     ### Заметки:
     - Сообщения классифицируются как отправленные (`sent`) или полученные (`received`) в зависимости от их отправителя.
+    - Сообщения на странице идут в хронологическом порядке.
+    - Для загрузки более ранних сообщений передайте `next_cursor` в параметре `before_id`; `null` означает, что история закончилась.
+    - Клиент, у которого уже есть переписка, догружает только новые сообщения: в `after_id` передается ID последнего
+      известного сообщения, а пока `next_cursor` не `null` — следующая порция с `after_id=next_cursor`.
+    - Ответы больше `BACKEND_GZIP_MINIMUM_SIZE` байт сжимаются gzip, если клиент передал `Accept-Encoding: gzip`.
+    - История может читаться с реплики БД. Только что отправленные и полученные сообщения видны сразу: пока реплика их не получила, запрос идет в основную БД.
     - Доступ к чату возможен только при авторизации текущего пользователя.
 
     """
     
-    user = get_user_by_id(db, user_id)
+    user = await identity_cache.get_user(user_id, db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
-    db_messages = get_messages_by_user_ids(db, current_user.id, user.id)
+    
+    check_history_cursors(before_id, after_id)
+    
+    # Запрашиваем на одно сообщение больше, чтобы понять, есть ли еще страница
+    db_messages = await get_messages_by_user_ids(db, current_user.id, user.id, before_id=before_id, limit=limit + 1, after_id=after_id)
+    db_messages, next_cursor = split_history_page(db_messages, limit, after_id)
     
     # Формируем список сообщений
     messages = []
     for message in db_messages:
         message_type = chat_schema.MessageType.SENT if message.sender_id == current_user.id else chat_schema.MessageType.RECEIVED
-        messages.append(chat_schema.Message(type=message_type, text=message.text))
+        messages.append(chat_schema.Message(id=message.id, type=message_type, text=message.text))
+    
+    return chat_schema.Chat(user=user, messages=messages, next_cursor=next_cursor)
+
+@router.post("/{user_id}/read", status_code=status.HTTP_204_NO_CONTENT, tags=["chats"], summary="Отметить чат прочитанным")
+async def read_chat(user_id: int, current_user: user_schema.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """
+    ## Отметка чата прочитанным
+
+    Обнуляет счетчик непрочитанных сообщений текущего пользователя в переписке с указанным пользователем.
+
+    ### Параметры:
+    - **user_id**: ID пользователя, с которым ведется чат.
+
+    ### Возможные ответы:
+    - **204 NO CONTENT**: Счетчик обнулен (или переписки еще нет).
+    - **401 UNAUTHORIZED**: Возвращается, если токен авторизации недействителен или отсутствует.
+
+    """
     
-    return chat_schema.Chat(user=user, messages=messages)
+    await mark_conversation_read(db, current_user.id, user_id)
+    await replica_router.mark_written(f"user:{current_user.id}")
 
 @router.websocket("/{user_id}/ws")
-async def chat_endpoint(websocket: WebSocket, user_id: int, access_token: str, db: orm.Session = Depends(get_db)):
-    current_user = await get_user_by_token(db, access_token)
-    user = get_user_by_id(db, user_id)
+async def chat_endpoint(websocket: WebSocket, user_id: int, access_token: str, last_event_id: Optional[str] = None):
+    if manager.draining:
+        await websocket.close(code=status.WS_1012_SERVICE_RESTART)      # Воркер останавливается, клиент переподключится к другому
+        return
     
-    await websocket.accept()                                    # Принимаем веб-сокет
-    await manager.connect(current_user.username, websocket)     # Добавляем веб-сокет в менеджер и привязываем его к username текущего пользователя
+    # Пользователи берутся из кэшей, при промахе — через короткую сессию: открытый сокет не держит соединение с БД
+    current_user = await get_user_by_token(None, access_token)
+    user = await identity_cache.get_user(user_id)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)     # Собеседник не найден
+        return
     
+    await serve_socket(websocket, current_user, user.username, last_event_id, receiver_id=user.id)
+
+
+# Обслуживает веб-сокет переписки с собеседником (receiver_id) или группы (group_id).
+# Сокет получает все события пользователя, а отправленные через него события уходят в эту переписку
+async def serve_socket(
+    websocket: WebSocket,
+    current_user: user_schema.User,
+    receiver: str,
+    last_event_id: Optional[str],
+    receiver_id: Optional[int] = None,
+    group_id: Optional[int] = None
+):
+    group_ids = await group_membership.groups(current_user.id)  # Воркер подписывается на каналы групп пользователя
     
-    # Формируем событие подключения к чату текущего пользователя
-    event = {
-        "type": "joined",
-        "sender": current_user.username,
-        "receiver": user.username,
-        "payload": {}
-    }
+    # Кодек выбирается подпротоколом веб-сокета (json или msgpack), без подпротокола — JSON
+    codec = negotiate_codec(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=codec)                   # Принимаем веб-сокет
+    connection = await manager.connect(current_user.username, websocket, codec or DEFAULT_CODEC, group_ids, replay=True)   # Добавляем веб-сокет в менеджер и привязываем его к username текущего пользователя
+    await replay_events(current_user.username, [connection], last_event_id)        # Досылаем события, пропущенные после last_event_id
     
-    await redis.publish("chat", json.dumps(event))      # Публикуем событие в канал Redis
-    await websocket.send_json(event)                    # Отправляем текущему пользователю событие
+    await presence.connect(current_user.id, current_user.username)             # Отмечаем пользователя в сети, собеседники узнают об этом пачкой
+    
+    # Подтверждаем подключение к чату только этому сокету, собеседнику о присутствии сообщает сервис присутствия
+    extra = {"group_id": group_id} if group_id is not None else {}
+    connection.send(Event.create("joined", current_user.username, receiver, extra))
+    limits = rate_limiter.connect()                             # Ведра токенов этого сокета
 
     try:
         while True:
-            event = await websocket.receive_json()              # Ловим сообщение с веб-сокета
+            event = await receive_event(websocket)              # Ловим событие с веб-сокета в кодеке клиента
+            payload = event.get("payload") or {}
+            
+            # Сверх лимита кратковременные события молча отбрасываем, остальные отклоняем событием error
+            retry_after = await rate_limiter.acquire(current_user.id, limits, event["type"])
+            if retry_after:
+                if limits.throttled_in_row >= config.RATE_LIMIT_DISCONNECT_AFTER:
+                    await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+                    break
+                if event["type"] not in TRANSIENT_EVENT_TYPES:
+                    connection.send(Event.create("error", current_user.username, receiver, {
+                        "detail": "Rate limit exceeded",
+                        "event_type": event["type"],
+                        "retry_after": round(retry_after, 3),
+                        **extra
+                    }))
+                continue
             
-            await redis.publish("chat", json.dumps(event))      # Публикуем событие в канал Redis
-            await websocket.send_json(event)                    # Отправляем текущему пользователю событие
+            # Сокет группы работает, пока пользователь в ней состоит: состав меняется событиями group_removed
+            if group_id is not None:
+                if group_id not in manager.user_groups.get(current_user.username, ()):
+                    await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+                    break
+                payload["group_id"] = group_id
             
-            # Сохраняем сообщение в БД, если событие позволяет
+            # Маршрутизация определяется сокетом, а не полями от клиента.
+            # Сообщение ставим в очередь записи в БД и рассылаем после коммита, остальные события — сразу
             if event["type"] == "new_message":
-                sender_id = current_user.id if current_user.username == event["sender"] else user.id
-                receiver_id = current_user.id if current_user.username == event["receiver"] else user.id
-                create_message(db, sender_id, receiver_id, event["payload"]["text"])
+                saved = await message_writer.submit(current_user.id, receiver_id, payload["text"], group_id)
+                track_task(asyncio.create_task(publish_saved_message(connection, current_user.username, receiver, payload, saved, group_id)))
+                continue
+            
+            # Публикуем событие собеседнику (или группе) и всем устройствам текущего пользователя, включая этот сокет
+            event = Event.create(event["type"], current_user.username, receiver, payload)
+            await publish_to_chat(event, receiver, current_user.username, group_id)
     except WebSocketDisconnect:
-        manager.disconnect(current_user.username)               # Отключаем веб-сокет от менеджера
+        pass
+    finally:
+        await manager.disconnect(current_user.username, connection)     # Отключаем веб-сокет от менеджера и снимаем аренду в каталоге, если сокетов не осталось
+        await presence.disconnect(current_user.id)                          # Пользователь уходит из сети, когда закрыт его последний сокет
+
+
+# Запрещает одновременную загрузку страницы до before_id и после after_id
+def check_history_cursors(before_id: Optional[int], after_id: Optional[int]):
+    if before_id is not None and after_id is not None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="before_id and after_id are mutually exclusive")
+
+# Отбрасывает лишнее сообщение страницы, запрошенной с limit + 1, и возвращает сообщения и курсор следующей страницы:
+# более ранней — ID первого сообщения, с after_id — более новой, ID последнего
+def split_history_page(db_messages: list, limit: int, after_id: Optional[int]) -> tuple[list, Optional[int]]:
+    if len(db_messages) <= limit:
+        return db_messages, None
+    if after_id is not None:
+        db_messages = db_messages[:limit]
+        return db_messages, db_messages[-1].id
+    db_messages = db_messages[1:]
+    return db_messages, db_messages[0].id
+
+# Кодирует курсор списка контактов: этап выборки и позиция в нем
+def encode_contacts_cursor(phase: str, position) -> str:
+    return base64.urlsafe_b64encode(json.dumps([phase, position]).encode()).decode().rstrip("=")
+
+# Декодирует курсор списка контактов, без курсора список начинается со свежих переписок
+def decode_contacts_cursor(cursor: Optional[str]) -> tuple:
+    if not cursor:
+        return "recent", None
+    
+    try:
+        phase, position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    if not (phase == "recent" and isinstance(position, int) or phase == "all" and isinstance(position, str)):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    
+    return phase, position
+
+
+# Рассылает сообщение после записи в БД: эхо отправителю с ID сообщения служит подтверждением сохранения
+async def publish_saved_message(connection: Connection, sender: str, receiver: str, payload: dict, saved: asyncio.Future, group_id: Optional[int] = None):
+    try:
+        payload["id"] = await saved
+    except Exception:
+        extra = {"group_id": group_id} if group_id is not None else {}
+        connection.send(Event.create("error", sender, receiver, {"detail": "Message was not saved", **extra}))
+        return
+    
+    # Публикуем событие собеседнику (или группе) и всем устройствам отправителя, включая отправивший сокет
+    await publish_to_chat(Event.create("new_message", sender, receiver, payload), receiver, sender, group_id)
+
+
+# Публикует событие переписки: один раз в канал группы или в каналы собеседника и отправителя
+async def publish_to_chat(event: Event, receiver: str, sender: str, group_id: Optional[int] = None):
+    if group_id is not None:
+        await event_stream.publish_group(event, group_id)
+    else:
+        await publish_event(event, receiver, sender)
+
+
+# Публикует событие в персональные каналы пользователей, долговременные события еще и в их журналы
+async def publish_event(event: Event, *usernames: str):
+    await event_stream.publish(event, list(dict.fromkeys(usernames)))
+
+
+# Досылает подключениям пользователя события журнала после after_id.
+# Без after_id только запоминает конец журнала, чтобы после переподключения слушателя было от чего досылать.
+# Если пропущенное уже не восстановить, клиент получает событие resync и должен заново загрузить историю
+async def replay_events(username: str, connections: list[Connection], after_id: Optional[str]):
+    for connection in connections:
+        connection.start_replay()
+    
+    events = []
+    position = end = None
+    try:
+        missed = None
+        if after_id is not None:
+            position = parse_event_id(after_id)
+            missed = await event_stream.read_after(username, format_event_id(position))
         
-        # Формируем событие отключения от чата текущего пользователя
-        event = {
-            "type": "left",
-            "sender": current_user.username,
-            "receiver": user.username,
-            "payload": {}
-        }
-        await redis.publish("chat", json.dumps(event))                      # Публикуем событие в канал Redis
+        if missed is not None:
+            events = missed
+        elif after_id is not None:
+            position = parse_event_id(await event_stream.last_id(username))
+            events = [Event.create("resync", username, username)]
+        else:
+            end = parse_event_id(await event_stream.last_id(username))      # Придержанные живые события клиент еще не видел
+    except ValueError:
+        position = None
+        events = [Event.create("resync", username, username)]           # Клиент прислал некорректный last_event_id
+    except Exception:
+        logger.warning("Failed to replay events of %s", username, exc_info=True)
+    finally:
+        for connection in connections:
+            connection.finish_replay(events, position, end)
+
+
+# Разгружает воркер перед остановкой: новые сокеты отклоняются, подключенные клиенты получают событие reconnect
+# со случайной задержкой и закрываются после отправки своих очередей. Закрывая сокеты, обработчики снимают отметки присутствия
+async def drain_connections():
+    manager.drain(config.DRAIN_RECONNECT_MIN_DELAY, config.DRAIN_RECONNECT_MAX_DELAY)
+    if not await manager.wait_empty(config.DRAIN_TIMEOUT):
+        logger.warning("Drain timed out with %d websockets still open", manager.stats()["connections"])
+
+
+# Хранит ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+def track_task(task: asyncio.Task):
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
 
 
 async def redis_listener():
-    pubsub = redis.pubsub()
-    await pubsub.subscribe("chat")                                          # Подписываемся на публикацию в канал Redis
+    reconnect_delay = config.REDIS_LISTENER_RECONNECT_DELAY
 
+    # Переподключаемся к Redis при обрыве соединения, пока задачу не отменят
     while True:
-        message = await pubsub.get_message(ignore_subscribe_messages=True)  # Ловаим события из канала Redis
-        if message:
-            await manager.send_message_to_receiver(message["data"])         # Отправляем событие в менеджер для дальнейшей пересылки клиентам
-        await asyncio.sleep(0.1)
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            await manager.attach(pubsub)                                            # Подписываемся на входящий канал воркера и каналы групп
+            reconnect_delay = config.REDIS_LISTENER_RECONNECT_DELAY
+
+            # Досылаем локальным сокетам события, опубликованные, пока слушатель был отключен
+            for username, connections in list(manager.active_connections.items()):
+                positions = [connection.last_position for connection in connections if connection.last_position is not None]
+                after_id = format_event_id(min(positions)) if positions else None
+                track_task(asyncio.create_task(replay_events(username, list(connections), after_id)))
+
+            while True:
+                message = await pubsub.get_message(timeout=None)                    # Ждем событие из Redis без опроса
+                if message is None:
+                    continue
+
+                # Забираем из буфера остальные уже пришедшие события, чтобы разослать их одной пачкой
+                messages = [message]
+                while len(messages) < config.REDIS_LISTENER_BATCH_SIZE:
+                    message = await pubsub.get_message(timeout=0)
+                    if message is None:
+                        break
+                    messages.append(message)
+
+                REDIS_RECEIVED.inc(len(messages))
+                manager.send_messages_to_receivers(messages)                        # Раскладываем события по очередям сокетов получателей
+        except (RedisConnectionError, RedisTimeoutError):
+            logger.warning("Redis listener disconnected, reconnecting in %.1f s", reconnect_delay, exc_info=True)
+            await asyncio.sleep(reconnect_delay)
+            reconnect_delay = min(reconnect_delay * 2, config.REDIS_LISTENER_RECONNECT_MAX_DELAY)
+        finally:
+            manager.detach()
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
@@ -0,0 +1,278 @@
+from typing import List, Optional
+from fastapi import Depends, HTTPException, Query, WebSocket, status
+from fastapi.routing import APIRouter
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import config
+from app.database import get_db
+from app.database import operations
+from app.database.replicas import replica_router
+from app.schemas import group as group_schema
+from app.schemas import user as user_schema
+from app.utils.auth import get_current_user, get_user_by_token
+from app.utils.events import Event
+from app.utils.group_membership import group_membership
+from app.utils.identity_cache import identity_cache
+from app.routers.chats import check_history_cursors, event_stream, manager, serve_socket, split_history_page
+
+
+router = APIRouter(prefix="/groups")
+
+
+@router.post("", response_model=group_schema.Group, tags=["groups"], summary="Создание группы")
+async def create_group(
+    group: group_schema.GroupCreate,
+    current_user: user_schema.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    ## Создание группы
+
+    Создает групповой чат. Текущий пользователь становится его создателем и участником.
+
+    ### Пример тела запроса:
+    ```json
+    {
+        "name": "Команда",
+        "member_ids": [2, 3, 4]
+    }
+    ```
+
+    ### Пример успешного ответа:
+    ```json
+    {
+        "id": 1,
+        "name": "Команда",
+        "owner_id": 1,
+        "created_at": "2024-10-23T12:00:00Z"
+    }
+    ```
+
+    ### Возможные ответы:
+    - **200 OK**: Группа создана.
+    - **400 BAD REQUEST**: Возвращается, если участников больше допустимого.
+    - **401 UNAUTHORIZED**: Возвращается, если токен авторизации недействителен или отсутствует.
+
+    ### Заметки:
+    - Несуществующие пользователи из `member_ids` пропускаются.
+    - Участники в сети получают событие `group_added` и сразу начинают получать события группы.
+
+    """
+
+    member_ids = set(group.member_ids) - {current_user.id}
+    if len(member_ids) + 1 > config.GROUP_MAX_MEMBERS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Too many members")
+
+    db_group = await operations.create_group(db, group.name, current_user.id, list(member_ids))
+    member_ids = [user.id for user in await operations.get_group_members(db, db_group.id)]
+    await notify_members_changed(db, db_group, current_user, added=member_ids)
+
+    return db_group
+
+@router.get("", response_model=group_schema.GroupList, tags=["groups"], summary="Список групп")
+async def get_groups(current_user: user_schema.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """
+    ## Список групп
+
+    Возвращает группы, в которых состоит текущий пользователь, по возрастанию ID.
+
+    ### Возможные ответы:
+    - **200 OK**: Возвращает список групп.
+    - **401 UNAUTHORIZED**: Возвращается, если токен авторизации недействителен или отсутствует.
+
+    """
+
+    return group_schema.GroupList(groups=await operations.get_user_groups(db, current_user.id))
+
+@router.get("/{group_id}", response_model=group_schema.GroupDetails, tags=["groups"], summary="Информация о группе")
+async def get_group(group_id: int, current_user: user_schema.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """
+    ## Информация о группе
+
+    Возвращает группу и список ее участников по алфавиту.
+
+    ### Возможные ответы:
+    - **200 OK**: Возвращает группу с участниками.
+    - **401 UNAUTHORIZED**: Возвращается, если токен авторизации недействителен или отсутствует.
+    - **404 NOT FOUND**: Возвращается, если группы нет или текущий пользователь в ней не состоит.
+
+    """
+
+    db_group = await get_member_group(db, group_id, current_user)
+    members = await operations.get_group_members(db, group_id)
+    return group_schema.GroupDetails(
+        id=db_group.id,
+        name=db_group.name,
+        owner_id=db_group.owner_id,
+        created_at=db_group.created_at,
+        members=members
+    )
+
+@router.post("/{group_id}/members", response_model=group_schema.GroupMembersAdded, tags=["groups"], summary="Добавление участников")
+async def add_members(
+    group_id: int,
+    members: group_schema.GroupMembersAdd,
+    current_user: user_schema.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    ## Добавление участников
+
+    Добавляет пользователей в группу. Добавлять может любой участник группы.
+
+    ### Пример тела запроса:
+    ```json
+    {
+        "user_ids": [5, 6]
+    }
+    ```
+
+    ### Пример успешного ответа:
+    ```json
+    {
+        "added": [5]
+    }
+    ```
+
+    ### Возможные ответы:
+    - **200 OK**: Возвращает ID добавленных пользователей; уже состоящие в группе и несуществующие пропускаются.
+    - **400 BAD REQUEST**: Возвращается, если участников станет больше допустимого.
+    - **401 UNAUTHORIZED**: Возвращается, если токен авторизации недействителен или отсутствует.
+    - **404 NOT FOUND**: Возвращается, если группы нет или текущий пользователь в ней не состоит.
+
+    """
+
+    db_group = await get_member_group(db, group_id, current_user)
+    if await operations.count_group_members(db, group_id) + len(set(members.user_ids)) > config.GROUP_MAX_MEMBERS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Too many members")
+
+    added = await operations.add_group_members(db, group_id, list(set(members.user_ids)))
+    await notify_members_changed(db, db_group, current_user, added=added)
+
+    return group_schema.GroupMembersAdded(added=added)
+
+@router.delete("/{group_id}/members/{user_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["groups"], summary="Исключение участника")
+async def remove_member(
+    group_id: int,
+    user_id: int,
+    current_user: user_schema.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    ## Исключение участника
+
+    Исключает участника из группы. Создатель может исключить любого участника, остальные — только выйти сами.
+
+    ### Возможные ответы:
+    - **204 NO CONTENT**: Участник исключен (или уже не состоял в группе).
+    - **400 BAD REQUEST**: Возвращается, если создатель пытается выйти из своей группы.
+    - **401 UNAUTHORIZED**: Возвращается, если токен авторизации недействителен или отсутствует.
+    - **403 FORBIDDEN**: Возвращается, если участник пытается исключить другого участника.
+    - **404 NOT FOUND**: Возвращается, если группы нет или текущий пользователь в ней не состоит.
+
+    """
+
+    db_group = await get_member_group(db, group_id, current_user)
+    if user_id == db_group.owner_id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Owner cannot leave the group")
+    if user_id != current_user.id and current_user.id != db_group.owner_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only the owner can remove members")
+
+    if await operations.remove_group_member(db, group_id, user_id):
+        await notify_members_changed(db, db_group, current_user, removed=[user_id])
+
+@router.get("/{group_id}/messages", response_model=group_schema.GroupChat, tags=["groups"], summary="История группы")
+async def get_group_messages(
+    group_id: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(config.HISTORY_PAGE_SIZE, ge=1, le=config.HISTORY_MAX_PAGE_SIZE),
+    current_user: user_schema.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    ## История группы
+
+    Возвращает страницу сообщений группы: последние `limit` сообщений, идущих до `before_id`,
+    или первые `limit` сообщений после `after_id`, в хронологическом порядке.
+
+    ### Возможные ответы:
+    - **200 OK**: Возвращает группу и страницу сообщений.
+    - **400 BAD REQUEST**: Возвращается, если переданы одновременно `before_id` и `after_id`.
+    - **401 UNAUTHORIZED**: Возвращается, если токен авторизации недействителен или отсутствует.
+    - **404 NOT FOUND**: Возвращается, если группы нет или текущий пользователь в ней не состоит.
+
+    ### Заметки:
+    - События группы не попадают в журнал пользователя, поэтому после переподключения пропущенные сообщения группы загружаются отсюда:
+      `after_id` — ID последнего полученного сообщения, следующая порция — с `after_id=next_cursor`, пока он не `null`.
+    - Для загрузки более ранних сообщений передайте `next_cursor` в параметре `before_id`; `null` означает, что история закончилась.
+
+    """
+
+    check_history_cursors(before_id, after_id)
+    db_group = await get_member_group(db, group_id, current_user)
+    
+    # История читается с реплики, если та уже получила последние сообщения группы
+    sessionmaker = await replica_router.sessionmaker(f"user:{current_user.id}", f"group:{group_id}")
+    async with sessionmaker() as read_db:
+        db_messages = await operations.get_group_messages(read_db, group_id, before_id=before_id, limit=limit + 1, after_id=after_id)
+    db_messages, next_cursor = split_history_page(db_messages, limit, after_id)
+
+    # Имена отправителей берутся из кэша
+    usernames = await identity_cache.get_usernames(list({message.sender_id for message in db_messages}), db)
+    messages = [
+        group_schema.GroupMessage(
+            id=message.id,
+            sender=user_schema.User(id=message.sender_id, username=usernames.get(message.sender_id, "")),
+            text=message.text
+        )
+        for message in db_messages
+    ]
+
+    return group_schema.GroupChat(group=db_group, messages=messages, next_cursor=next_cursor)
+
+@router.websocket("/{group_id}/ws")
+async def group_endpoint(websocket: WebSocket, group_id: int, access_token: str, last_event_id: Optional[str] = None):
+    if manager.draining:
+        await websocket.close(code=status.WS_1012_SERVICE_RESTART)      # Воркер останавливается, клиент переподключится к другому
+        return
+
+    current_user = await get_user_by_token(None, access_token)
+    if not await group_membership.is_member(group_id, current_user.id):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)     # Группы нет или пользователь в ней не состоит
+        return
+
+    await serve_socket(websocket, current_user, "", last_event_id, group_id=group_id)
+
+
+# Возвращает группу, если текущий пользователь в ней состоит, иначе 404
+async def get_member_group(db: AsyncSession, group_id: int, current_user: user_schema.User):
+    if not await group_membership.is_member(group_id, current_user.id, db):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Group not found")
+
+    db_group = await operations.get_group(db, group_id)
+    if db_group is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Group not found")
+    return db_group
+
+
+# Сообщает об изменении состава группы: затронутым пользователям — group_added / group_removed
+# через каталог подключений (по ним воркеры меняют подписки), участникам — одно событие group_updated в канал группы
+async def notify_members_changed(db: AsyncSession, group, current_user: user_schema.User, added: List[int] = (), removed: List[int] = ()):
+    group_membership.forget(*added, *removed)
+    usernames = await identity_cache.get_usernames([*added, *removed], db)
+
+    events = []
+    for event_type, user_ids in (("group_added", added), ("group_removed", removed)):
+        for user_id in user_ids:
+            username = usernames.get(user_id)
+            if username is not None:
+                payload = {"group_id": group.id, "user_id": user_id, "name": group.name}
+                events.append((Event.create(event_type, current_user.username, username, payload), username))
+    if events:
+        await event_stream.publish_each(events)
+
+    await event_stream.publish_group(Event.create("group_updated", current_user.username, "", {
+        "group_id": group.id,
+        "added": [usernames[user_id] for user_id in added if user_id in usernames],
+        "removed": [usernames[user_id] for user_id in removed if user_id in usernames]
+    }), group.id)
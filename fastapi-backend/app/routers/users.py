@@ -1,7 +1,10 @@
-from fastapi import  Depends
+from typing import List
+from fastapi import  Depends, Query
 from fastapi.routing import APIRouter
 from app.schemas import user as user_schema
+from app.utils import auth
 from app.utils.auth import get_current_user
+from app.utils.presence import presence
 
 
 router = APIRouter(prefix="/users") 
@@ -43,4 +46,43 @@ async def get_current_user(current_user: user_schema.User = Depends(get_current_
     - Токен должен быть передан в заголовке Authorization как `Bearer token`.
     """
     
-    return current_user
\ No newline at end of file
+    return current_user
+
+
+# Эндпоинт для проверки, кто из пользователей в сети
+@router.get("/online", response_model=user_schema.OnlineUsers, tags=["users"], summary="Пользователи в сети")
+async def get_online_users(
+    ids: List[int] = Query(..., max_length=200),
+    current_user: user_schema.User = Depends(auth.get_current_user)     # get_current_user в этом модуле переопределен эндпоинтом /me
+):
+    """
+    ## Пользователи в сети
+    
+    Позволяет одним запросом узнать, кто из перечисленных пользователей сейчас в сети,
+    например для отметок в списке контактов.
+
+    ### Параметры:
+    - **ids**: ID пользователей, не больше 200 за запрос.
+
+    ### Пример запроса:
+    ```http
+    GET /users/online?ids=2&ids=3&ids=5
+    Authorization: Bearer <токен>
+    ```
+
+    ### Пример успешного ответа:
+    ```json
+    {
+        "online": [2, 5]
+    }
+    ```
+
+    ### Возможные ответы:
+    - **200 OK**: Возвращает ID пользователей из запроса, которые сейчас в сети.
+    - **401 UNAUTHORIZED**: Возвращается, если токен авторизации недействителен или отсутствует.
+    
+    ### Заметки:
+    - Дальнейшие изменения приходят по веб-сокету событием `presence` со списками `online` и `offline`.
+    """
+    
+    return user_schema.OnlineUsers(online=await presence.online(list(dict.fromkeys(ids))))
@@ -1,6 +1,7 @@
 from . import user
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+from datetime import datetime
 from enum import Enum
 
 
@@ -12,6 +13,7 @@ class MessageType(Enum):
 
 # Модель сообщения
 class Message(BaseModel):
+    id: int
     type: str
     text: str
 
@@ -19,4 +21,34 @@ class Message(BaseModel):
 # Модель чата
 class Chat(BaseModel):
     user: user.User
-    messages: List[Message]
\ No newline at end of file
+    messages: List[Message]
+    next_cursor: Optional[int] = None           # ID для запроса предыдущей страницы (с after_id — следующей порции новых), None если история закончилась
+
+
+# Модель сводки переписки для списка чатов
+class Conversation(BaseModel):
+    user: user.User
+    last_message: Message
+    last_message_at: datetime
+    unread: int
+
+
+# Модель списка переписок
+class ConversationList(BaseModel):
+    conversations: List[Conversation]
+    next_cursor: Optional[int] = None           # ID для запроса следующей страницы, None если список закончился
+
+
+# Модель найденного сообщения
+class SearchResult(BaseModel):
+    id: int
+    type: str
+    user: user.User                             # Собеседник в переписке, где найдено сообщение
+    text: str
+    highlight: str                              # Фрагменты текста, экранированные для HTML, найденные слова в <mark>
+
+
+# Модель страницы результатов поиска
+class SearchResults(BaseModel):
+    results: List[SearchResult]
+    next_cursor: Optional[int] = None           # ID для запроса следующей страницы, None если результаты закончились
@@ -0,0 +1,56 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from datetime import datetime
+from . import user
+
+
+# Модель создания группы
+class GroupCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=128)
+    member_ids: List[int] = []                  # Участники кроме создателя
+
+
+# Модель группы
+class Group(BaseModel):
+    id: int
+    name: str
+    owner_id: int
+    created_at: datetime
+
+    model_config = {
+        "from_attributes": True
+    }
+
+
+# Модель списка групп
+class GroupList(BaseModel):
+    groups: List[Group]
+
+
+# Модель группы с участниками
+class GroupDetails(Group):
+    members: List[user.User]
+
+
+# Модель добавления участников
+class GroupMembersAdd(BaseModel):
+    user_ids: List[int] = Field(..., min_length=1)
+
+
+# Модель добавленных участников
+class GroupMembersAdded(BaseModel):
+    added: List[int]                            # ID пользователей, которых действительно добавили
+
+
+# Модель сообщения группы
+class GroupMessage(BaseModel):
+    id: int
+    sender: user.User
+    text: str
+
+
+# Модель истории группы
+class GroupChat(BaseModel):
+    group: Group
+    messages: List[GroupMessage]
+    next_cursor: Optional[int] = None           # ID для запроса предыдущей страницы (с after_id — следующей порции новых), None если история закончилась
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 
 # Модель базового пользователя
@@ -23,4 +23,10 @@ class User(UserBase):
 
 # Модель списка пользователей
 class UserList(BaseModel):
-    users: List[User]
\ No newline at end of file
+    users: List[User]
+    next_cursor: Optional[str] = None           # Курсор следующей страницы, None если список закончился
+
+
+# Модель списка пользователей в сети
+class OnlineUsers(BaseModel):
+    online: List[int]                           # ID пользователей из запроса, которые сейчас в сети
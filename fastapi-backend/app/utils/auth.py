@@ -1,14 +1,20 @@
 from fastapi import  Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy import orm
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from app import config
-from app.database import operations, get_db
+from app.database import get_db
+from app.database.replicas import replica_router
+from app.schemas import user as user_schema
+from app.utils.redis_client import redis
+from app.utils.token_cache import TokenCache
+from app.utils.identity_cache import identity_cache
+from app.utils.metrics import register_stats
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+token_cache = TokenCache(redis=redis if config.TOKEN_CACHE_REDIS else None)
+register_stats("token_cache", token_cache.stats)
 
 
 SECRET_KEY = config.SECRET_KEY                                      # Секретный ключ
@@ -16,10 +22,16 @@ ALGORITHM = "HS256"                                                 # Алгор
 ACCESS_TOKEN_EXPIRE_MINUTES = config.ACCESS_TOKEN_EXPIRE_MINUTES    # Время жизни токена
 
 
-# Позволяет получить объект пользователя по токену
-async def get_user_by_token(db: orm.Session, token: str):
+# Позволяет получить объект пользователя по токену.
+# Без сессии БД (веб-сокеты) пользователь при промахе кэшей загружается через короткую сессию
+async def get_user_by_token(db: AsyncSession | None, token: str) -> user_schema.User:
     credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
     
+    # Токен уже проверялся и еще не истек — обходимся без декодирования и запроса в БД
+    user = await token_cache.get(token)
+    if user is not None:
+        return user
+    
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username = payload.get("sub")
@@ -28,12 +40,21 @@ async def get_user_by_token(db: orm.Session, token: str):
     except JWTError:
         raise credentials_exception
     
-    user = operations.get_user_by_username(db, username=username)
+    user = await identity_cache.get_user_by_username(username, db)
     if user is None:
         raise credentials_exception
     
+    if "exp" in payload:
+        await token_cache.set(token, user, payload["exp"])
+    
     return user
 
 # Позволяет получить объект пользователя по Bearer авторизации
-async def get_current_user(token: str = Depends(oauth2_scheme), db: orm.Session = Depends(get_db)):
-    return await get_user_by_token(db, token)
\ No newline at end of file
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    return await get_user_by_token(db, token)
+
+# Сессия для запросов только на чтение: реплика, если она уже получила последние записи пользователя, иначе основная БД
+async def get_read_db(current_user: user_schema.User = Depends(get_current_user)):
+    sessionmaker = await replica_router.sessionmaker(f"user:{current_user.id}")
+    async with sessionmaker() as db:
+        yield db
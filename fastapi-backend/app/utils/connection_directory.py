@@ -0,0 +1,162 @@
+import asyncio, logging
+from redis.asyncio import Redis
+from app import config
+from app.utils.connection_manager import WORKER_CHANNEL_PREFIX, WORKER_ID
+from app.utils.metrics import REDIS_PUBLISHED, register_stats
+from app.utils.redis_client import redis
+
+
+logger = logging.getLogger(__name__)
+
+DIRECTORY_KEY_PREFIX = "chat:directory:"                        # Хэш пользователя: воркер с его сокетами -> окончание аренды (мс)
+
+# Продлевает аренду воркера в записях пользователей и удаляет истекшие аренды других воркеров.
+# Время берется из Redis, поэтому расхождение часов воркеров на аренду не влияет.
+# KEYS — записи пользователей, ARGV — воркер и длительность аренды (мс)
+LEASE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+for _, key in ipairs(KEYS) do
+    local entries = redis.call('HGETALL', key)
+    for index = 1, #entries, 2 do
+        if entries[index] ~= ARGV[1] and tonumber(entries[index + 1]) <= now then
+            redis.call('HDEL', key, entries[index])
+        end
+    end
+    redis.call('HSET', key, ARGV[1], now + tonumber(ARGV[2]))
+    redis.call('PEXPIRE', key, ARGV[2])
+end
+"""
+
+# Публикует события во входящие каналы воркеров, на которых есть сокеты получателей, в формате pack_inbox_message.
+# Получатели на одном воркере с одинаковым событием получают его одним сообщением.
+# KEYS — записи получателей, ARGV — префикс каналов воркеров, длина префикса записей и события:
+# одно общее для всех получателей или по одному на каждого. Возвращает число опубликованных сообщений
+ROUTE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local prefix_length = tonumber(ARGV[2])
+local shared = #ARGV == 3
+local batches = {}
+local order = {}
+for index, key in ipairs(KEYS) do
+    local data_index = shared and 3 or index + 2
+    local entries = redis.call('HGETALL', key)
+    for entry = 1, #entries, 2 do
+        if tonumber(entries[entry + 1]) > now then
+            local batch_key = entries[entry] .. ':' .. data_index
+            local batch = batches[batch_key]
+            if batch == nil then
+                batch = {entries[entry], data_index, {}}
+                batches[batch_key] = batch
+                order[#order + 1] = batch
+            end
+            batch[3][#batch[3] + 1] = string.sub(key, prefix_length + 1)
+        end
+    end
+end
+for _, batch in ipairs(order) do
+    redis.call('PUBLISH', ARGV[1] .. batch[1], table.concat(batch[3], '\\31') .. '\\29' .. ARGV[batch[2]])
+end
+return #order
+"""
+
+
+# Возвращает ключ записи пользователя в каталоге подключений
+def get_directory_key(username: str) -> str:
+    return DIRECTORY_KEY_PREFIX + username
+
+
+# Класс каталога подключений
+#
+# Для каждого пользователя Redis хранит воркеры, на которых открыты его сокеты. Воркер берет аренду
+# при первом локальном сокете пользователя, снимает ее при последнем и раз в RENEW_INTERVAL продлевает
+# аренды всех своих пользователей, поэтому записи упавшего воркера перестают учитываться через LEASE.
+# Публикующий воркер одним скриптом находит получателей в каталоге и отправляет событие только
+# во входящие каналы (chat:worker:<ID>) их воркеров: каждый воркер подписан на один свой канал
+# вместо канала на каждого пользователя, и подключение не требует SUBSCRIBE.
+class ConnectionDirectory:
+    def __init__(
+        self,
+        redis: Redis,
+        lease: float = config.CONNECTION_DIRECTORY_LEASE,
+        renew_interval: float = config.CONNECTION_DIRECTORY_RENEW_INTERVAL
+    ):
+        self.redis = redis
+        self.lease = lease
+        self.renew_interval = renew_interval
+        self.local: set[str] = set()                            # Пользователи, аренду которых держит воркер
+        self._lease_script = redis.register_script(LEASE_SCRIPT)
+        self._route_script = redis.register_script(ROUTE_SCRIPT)
+        self._task: asyncio.Task | None = None
+        self.routed = 0
+        self.delivered = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._renew_loop())
+
+    async def stop(self):
+        # Снимаем аренды сразу, не дожидаясь их истечения
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for username in self.local:
+                    pipe.hdel(get_directory_key(username), WORKER_ID)
+                await pipe.execute()
+        except Exception:
+            logger.warning("Connection directory: failed to release leases", exc_info=True)
+        self.local.clear()
+
+    async def register(self, username: str):
+        # Аренда берется до подписки клиента на журнал: события, записанные после нее, придут в канал воркера
+        self.local.add(username)
+        await self.renew([username])
+
+    async def unregister(self, username: str):
+        self.local.discard(username)
+        try:
+            await self.redis.hdel(get_directory_key(username), WORKER_ID)
+        except Exception:
+            logger.warning("Connection directory: failed to release lease of %s", username, exc_info=True)
+
+    async def renew(self, usernames: list[str] | None = None):
+        usernames = list(self.local) if usernames is None else usernames
+        lease_ms = int(self.lease * 1000)
+        for index in range(0, len(usernames), 1000):
+            keys = [get_directory_key(username) for username in usernames[index:index + 1000]]
+            await self._lease_script(keys=keys, args=[WORKER_ID, lease_ms])
+
+    async def route(self, usernames: list[str], data: str | list[str]):
+        # Одно событие всем получателям или по событию на каждого (data в порядке usernames)
+        if not usernames:
+            return
+        keys = [get_directory_key(username) for username in usernames]
+        args = [WORKER_CHANNEL_PREFIX, len(DIRECTORY_KEY_PREFIX), *([data] if isinstance(data, str) else data)]
+        published = await self._route_script(keys=keys, args=args)
+        REDIS_PUBLISHED.inc(published)
+        self.routed += len(usernames)
+        self.delivered += published
+
+    def stats(self) -> dict:
+        return {
+            "local_users": len(self.local),
+            "routed": self.routed,
+            "delivered": self.delivered
+        }
+
+    async def _renew_loop(self):
+        while True:
+            await asyncio.sleep(self.renew_interval)
+            try:
+                await self.renew()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Connection directory: failed to renew leases", exc_info=True)
+
+
+connection_directory = ConnectionDirectory(redis)
+register_stats("connection_directory", connection_directory.stats)
@@ -1,25 +1,404 @@
-import json
+import asyncio, logging, random, time, uuid
+from collections import deque
+import orjson
 from fastapi import WebSocket
+from redis.asyncio.client import PubSub
+from app import config
+from app.utils.events import DEFAULT_CODEC, GROUP_MEMBERSHIP_EVENT_TYPES, HEADER_SEPARATOR, Event
+from app.utils.group_membership import group_membership
+from app.utils.metrics import REDIS_DELIVERY_LAG
+
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID = uuid.uuid4().hex                                    # Идентификатор текущего воркера
+GROUP_CHANNEL_PREFIX = "chat:group:"                            # Префикс каналов групп
+WORKER_CHANNEL_PREFIX = "chat:worker:"                          # Префикс входящих каналов воркеров
+WORKER_CHANNEL = WORKER_CHANNEL_PREFIX + WORKER_ID              # Входящий канал воркера: события пользователей с сокетами на нем
+INBOX_SEPARATOR = "\x1d"                                        # Отделяет получателей от события во входящем канале
+OVERFLOW_POLICIES = {"drop_oldest", "coalesce", "disconnect"}
+SLOW_CONSUMER_CLOSE_CODE = 1013                                 # Код закрытия «Try Again Later» для медленных клиентов
+SERVICE_RESTART_CLOSE_CODE = 1012                               # Код закрытия «Service Restart» при остановке воркера
+
+
+# Упаковывает событие для входящего канала воркера: имена локальных получателей и само событие
+def pack_inbox_message(usernames: list[str], data: str) -> str:
+    return HEADER_SEPARATOR.join(usernames) + INBOX_SEPARATOR + data
+
+
+# Возвращает канал Redis, в который публикуются события группы
+def get_group_channel(group_id: int) -> str:
+    return f"{GROUP_CHANNEL_PREFIX}{group_id}"
+
+
+# Класс подключения: ограниченная исходящая очередь и отдельная задача записи в сокет
+class Connection:
+    __slots__ = ("websocket", "codec", "queue", "max_queue", "overflow_policy", "closed", "last_position", "_replay", "_counters", "_wakeup", "_kick", "_close_code", "_task")
+
+    def __init__(self, websocket: WebSocket, counters: dict, max_queue: int, overflow_policy: str, codec: str = DEFAULT_CODEC):
+        self.websocket = websocket
+        self.codec = codec
+        self.queue: deque[Event] = deque()
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.closed = False
+        self.last_position: tuple[int, int] | None = None      # Позиция последнего поставленного события журнала
+        self._replay: list[Event] | None = None                 # Живые события, пришедшие во время досылки пропущенных
+        self._counters = counters
+        self._wakeup = asyncio.Event()
+        self._kick = False
+        self._close_code: int | None = None                     # Код закрытия после отправки очереди
+        self._task = asyncio.create_task(self._run())
+
+    def send(self, event: Event):
+        # Ставит событие в очередь, не дожидаясь отправки.
+        # Одно событие можно разослать на все устройства пользователя: тело и его кодировки общие
+        if self.closed:
+            return
+
+        if self._replay is not None:
+            self._replay.append(event)
+            return
+        self._enqueue(event)
+
+    def start_replay(self):
+        # Придерживаем живые события, пока из журнала читаются пропущенные
+        if self._replay is None:
+            self._replay = []
+
+    def finish_replay(self, events: list[Event], position: tuple[int, int] | None = None, end: tuple[int, int] | None = None):
+        # Ставит пропущенные события, затем придержанные живые; уже поставленные по позиции отбрасываются.
+        # position — до какого события клиент уже все получил, end — конец журнала, если клиент пропущенное не запрашивал:
+        # придержанные события свежее загруженной клиентом истории, поэтому конец журнала учитывается только после них
+        self._advance(position)
+        held, self._replay = self._replay or [], None
+        for event in events:
+            self._enqueue(event)
+        for event in held:
+            self._enqueue(event)
+        self._advance(end)
+
+    def _advance(self, position: tuple[int, int] | None):
+        if position is not None and (self.last_position is None or position > self.last_position):
+            self.last_position = position
+
+    def _enqueue(self, event: Event):
+        if self.closed:
+            return
+
+        position = event.position
+        if position is not None:
+            if self.last_position is not None and position <= self.last_position:
+                return
+            self.last_position = position
+
+        if len(self.queue) >= self.max_queue and not self._make_room(event):
+            return
+
+        self.queue.append(event)
+        self._wakeup.set()
+
+    def close_after_flush(self, code: int):
+        # Закрывает сокет, когда будут отправлены уже поставленные события
+        self._close_code = code
+        self._wakeup.set()
+
+    async def close(self):
+        self.closed = True
+        self.queue.clear()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def _make_room(self, event: Event) -> bool:
+        # Освобождает место в переполненной очереди, возвращает False, если новое событие ставить не нужно
+        if self.overflow_policy == "disconnect":
+            self._disconnect_slow_consumer()
+            return False
+
+        if self.overflow_policy == "coalesce":
+            # Более свежее состояние заменяет ожидающее событие того же типа от того же отправителя
+            if event.key is not None:
+                for index in range(len(self.queue) - 1, -1, -1):
+                    if self.queue[index].key == event.key:
+                        self.queue[index] = event
+                        self._counters["coalesced"] += 1
+                        return False
+
+            # Иначе в первую очередь жертвуем самым старым кратковременным событием
+            for index, queued in enumerate(self.queue):
+                if queued.key is not None:
+                    del self.queue[index]
+                    self._counters["dropped"] += 1
+                    return True
+
+        self.queue.popleft()
+        self._counters["dropped"] += 1
+        return True
+
+    def _disconnect_slow_consumer(self):
+        if self._kick:
+            return
+        self._kick = True
+        self.queue.clear()
+        self._wakeup.set()
+
+    async def _run(self):
+        try:
+            while True:
+                while not self.queue and not self._kick and (self._close_code is None or self._replay is not None):
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+
+                if self._kick or not self.queue:
+                    break
+
+                data = self.queue.popleft().encode(self.codec)
+                send = self.websocket.send_text if isinstance(data, str) else self.websocket.send_bytes
+                await asyncio.wait_for(send(data), config.WEBSOCKET_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Websocket send stalled for %.1f s, disconnecting", config.WEBSOCKET_SEND_TIMEOUT)
+            self._kick = True
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.debug("Websocket writer stopped", exc_info=True)
+            self.closed = True
+            return
+
+        # Закрываем сокет медленного клиента или остановленного воркера: обработчик получит WebSocketDisconnect и уберет подключение
+        self.closed = True
+        self.queue.clear()
+        code = self._close_code
+        if self._kick:
+            self._counters["disconnected"] += 1
+            code = SLOW_CONSUMER_CLOSE_CODE
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
 
 
 # Класс для управления веб-сокетами
+#
+# Воркер держит аренды своих пользователей в каталоге подключений (directory), и события пользователей
+# приходят в его входящий канал с именами получателей. Без каталога (бенчмарки) сокеты только локальные.
+# Кроме того, воркер подписан на каналы групп своих пользователей.
+# Событие группы публикуется один раз в канал группы, и Redis доставляет его по одному разу
+# каждому воркеру, где есть участники. Воркер раскладывает его локальным участникам по своему
+# составу групп, который меняется событиями group_added / group_removed.
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[str, WebSocket] = {}
+    def __init__(
+        self,
+        max_queue: int = config.WEBSOCKET_SEND_QUEUE_SIZE,
+        overflow_policy: str = config.WEBSOCKET_OVERFLOW_POLICY,
+        directory=None
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown websocket overflow policy: {overflow_policy}")
+
+        self.active_connections: dict[str, set[Connection]] = {}   # Подключения пользователя со всех его устройств
+        self.user_groups: dict[str, set[int]] = {}              # Группы пользователей с локальными сокетами
+        self.local_groups: dict[int, set[str]] = {}             # Локальные участники групп
+        self.pubsub: PubSub | None = None                       # Подписка слушателя Redis, через которую управляем каналами групп
+        self.directory = directory                              # Каталог подключений (ConnectionDirectory)
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.draining = False                                   # Воркер останавливается и не принимает новые сокеты
+        self.counters = {"dropped": 0, "coalesced": 0, "disconnected": 0}
+        self._empty = asyncio.Event()                           # Установлено, когда локальных сокетов нет
+        self._empty.set()
+        self._tasks: set[asyncio.Task] = set()
+
+    async def attach(self, pubsub: PubSub):
+        # Привязываем новую подписку слушателя, восстанавливаем каналы групп и аренды пользователей:
+        # пока Redis был недоступен, они могли истечь
+        self.pubsub = pubsub
+        channels = [get_group_channel(group_id) for group_id in self.local_groups]
+        await pubsub.subscribe(WORKER_CHANNEL, *channels)
+        if self.directory is not None:
+            await self.directory.renew()
+
+    def detach(self):
+        self.pubsub = None
+
+    async def connect(self, username: str, websocket: WebSocket, codec: str = DEFAULT_CODEC, group_ids=(), replay: bool = False) -> Connection:
+        # С replay живые события придерживаются до finish_replay еще до того, как сокет станет доступен для рассылки:
+        # иначе живое событие продвинуло бы last_position, и досылка из журнала отбросила бы все события до него
+        connection = Connection(websocket, self.counters, self.max_queue, self.overflow_policy, codec)
+        if replay:
+            connection.start_replay()
+        connections = self.active_connections.get(username)
+        if connections is not None:
+            connections.add(connection)
+            return connection
+
+        # Берем аренду в каталоге и подписываемся на каналы групп только при появлении первого локального сокета
+        self.active_connections[username] = {connection}
+        self._empty.clear()
+        self.user_groups[username] = set(group_ids)
+        channels = []
+        for group_id in group_ids:
+            if self._join_group(group_id, username):
+                channels.append(get_group_channel(group_id))
+        await self._register(username)
+        if channels:
+            await self._execute_subscription("subscribe", *channels)
+        return connection
+
+    async def disconnect(self, username: str, connection: Connection):
+        await connection.close()
+
+        connections = self.active_connections.get(username)
+        if connections is None or connection not in connections:
+            return
+        connections.discard(connection)
+
+        # Снимаем аренду и отписываемся от каналов групп, когда закрыт последний сокет пользователя на воркере
+        if not connections:
+            del self.active_connections[username]
+            if not self.active_connections:
+                self._empty.set()
+            channels = []
+            for group_id in self.user_groups.pop(username, ()):
+                if self._leave_group(group_id, username):
+                    channels.append(get_group_channel(group_id))
+            if self.directory is not None:
+                await self.directory.unregister(username)
+            if channels:
+                await self._execute_subscription("unsubscribe", *channels)
 
-    async def connect(self, username: str, websocket: WebSocket):
-        self.active_connections[username] = websocket
+            # Пока снималась аренда и шла отписка, пользователь или другие участники групп могли подключиться снова
+            if username in self.active_connections:
+                await self._register(username)
+            channels = [channel for channel in channels if int(channel[len(GROUP_CHANNEL_PREFIX):]) in self.local_groups]
+            if channels:
+                await self._execute_subscription("subscribe", *channels)
 
-    def disconnect(self, username: str):
-        del self.active_connections[username]
+    def drain(self, min_delay: float, max_delay: float):
+        # Просит клиентов переподключиться к другим воркерам и закрывает их сокеты после отправки очередей.
+        # Задержка переподключения у каждого сокета своя, чтобы клиенты не пришли на остальные воркеры одновременно
+        self.draining = True
+        for username, connections in self.active_connections.items():
+            for connection in connections:
+                retry_after = round(random.uniform(min_delay, max_delay), 3)
+                connection.send(Event.create("reconnect", username, username, {"retry_after": retry_after}))
+                connection.close_after_flush(SERVICE_RESTART_CLOSE_CODE)
 
-    async def send_message_to_receiver(self, event_text: dict):
-        event = json.loads(event_text)
-        
+    async def wait_empty(self, timeout: float) -> bool:
+        # Ждет, пока обработчики закроют все локальные сокеты, возвращает False по истечении timeout
         try:
-            receiver_websocket = self.active_connections[event["receiver"]]
-            await receiver_websocket.send_text(event_text)
-        except KeyError:
-            pass
-        
-        
\ No newline at end of file
+            await asyncio.wait_for(self._empty.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _join_group(self, group_id: int, username: str) -> bool:
+        # Возвращает True, если это первый локальный участник группы и на ее канал нужно подписаться
+        members = self.local_groups.get(group_id)
+        if members is None:
+            self.local_groups[group_id] = {username}
+            return True
+        members.add(username)
+        return False
+
+    def _leave_group(self, group_id: int, username: str) -> bool:
+        # Возвращает True, если локальных участников группы не осталось и от ее канала нужно отписаться
+        members = self.local_groups.get(group_id)
+        if members is None:
+            return False
+        members.discard(username)
+        if members:
+            return False
+        del self.local_groups[group_id]
+        return True
+
+    async def _register(self, username: str):
+        if self.directory is None:
+            return
+        try:
+            await self.directory.register(username)
+        except Exception:
+            # Аренду возьмет продление по таймеру, пропущенные до этого события клиент получит из журнала
+            logger.warning("Failed to register %s in connection directory", username, exc_info=True)
+
+    def _apply_membership(self, username: str, event: Event):
+        # Пользователя добавили в группу или исключили из нее: меняем локальный состав и подписку на канал группы
+        payload = orjson.loads(event.body)["payload"]
+        group_id = payload["group_id"]
+        group_membership.forget(payload["user_id"])
+        groups = self.user_groups.get(username)
+        if groups is None:
+            return
+
+        if event.type == "group_added":
+            groups.add(group_id)
+            changed = self._join_group(group_id, username)
+            command = "subscribe"
+        else:
+            groups.discard(group_id)
+            changed = self._leave_group(group_id, username)
+            command = "unsubscribe"
+        if changed:
+            task = asyncio.create_task(self._execute_subscription(command, get_group_channel(group_id)))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute_subscription(self, command: str, *channels: str):
+        pubsub = self.pubsub
+        if pubsub is None:
+            return                                              # Слушатель переподключается и сам восстановит подписки
+
+        try:
+            await getattr(pubsub, command)(*channels)
+        except Exception:
+            logger.warning("Failed to %s channels %s", command, ", ".join(channels), exc_info=True)
+
+    def send_message_to_receiver(self, receiver: str, event: Event):
+        connections = self.active_connections.get(receiver)
+        if not connections:
+            return
+
+        for connection in connections:
+            connection.send(event)
+
+    def send_messages_to_receivers(self, messages: list[dict]):
+        # Получатели определяются по входящему или групповому каналу, из события отделяется только заголовок, тело не разбирается.
+        # События только ставятся в очереди сокетов, медленный клиент не задерживает остальных
+        now = time.time()
+        for message in messages:
+            channel = message["channel"]
+            if channel == WORKER_CHANNEL:
+                # Событие во входящем канале разбирается один раз для всех его локальных получателей
+                receivers, _, data = message["data"].partition(INBOX_SEPARATOR)
+                event = None
+                for receiver in receivers.split(HEADER_SEPARATOR):
+                    if receiver not in self.active_connections:
+                        continue                                # Сокет закрылся, пока событие шло через Redis
+                    if event is None:
+                        event = Event.unpack(data)
+                        REDIS_DELIVERY_LAG.observe(max(0.0, now - event.published_at))
+                    if event.type in GROUP_MEMBERSHIP_EVENT_TYPES:
+                        self._apply_membership(receiver, event)
+                    self.send_message_to_receiver(receiver, event)
+            elif channel.startswith(GROUP_CHANNEL_PREFIX):
+                # Событие группы разбирается один раз и ставится в очереди всех локальных участников
+                members = self.local_groups.get(int(channel[len(GROUP_CHANNEL_PREFIX):]))
+                if members:
+                    event = Event.unpack(message["data"])
+                    REDIS_DELIVERY_LAG.observe(max(0.0, now - event.published_at))
+                    for receiver in members:
+                        self.send_message_to_receiver(receiver, event)
+
+    def stats(self) -> dict:
+        depths = [len(connection.queue) for connections in self.active_connections.values() for connection in connections]
+        return {
+            "users": len(self.active_connections),
+            "groups": len(self.local_groups),
+            "connections": len(depths),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            **self.counters
+        }
@@ -0,0 +1,110 @@
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+from app import config
+from app.utils.connection_directory import DIRECTORY_KEY_PREFIX, ConnectionDirectory, connection_directory, get_directory_key
+from app.utils.connection_manager import WORKER_CHANNEL_PREFIX, get_group_channel
+from app.utils.events import DURABLE_EVENT_TYPES, Event, parse_event_id
+from app.utils.metrics import REDIS_PUBLISHED
+
+
+STREAM_KEY_PREFIX = "chat:stream:"                              # Префикс журналов событий пользователей
+
+# Дописывает событие в журналы получателей и сразу публикует его вместе с ID записи во входящие каналы
+# воркеров из каталога подключений. Запись, поиск в каталоге и публикация выполняются атомарно, поэтому
+# живые события идут в том же порядке, что и в журнале, а сокет, взявший аренду до чтения журнала, ничего не пропустит.
+# KEYS — журналы, затем записи получателей в каталоге; ARGV — максимальная длина, TTL, упакованное событие,
+# префикс каналов воркеров и длина префикса записей каталога
+PUBLISH_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local count = #KEYS / 2
+local ids = {}
+for index = 1, count do
+    local id = redis.call('XADD', KEYS[index], 'MAXLEN', '~', ARGV[1], '*', 'data', ARGV[3])
+    redis.call('EXPIRE', KEYS[index], ARGV[2])
+    local username = string.sub(KEYS[count + index], tonumber(ARGV[5]) + 1)
+    local entries = redis.call('HGETALL', KEYS[count + index])
+    for entry = 1, #entries, 2 do
+        if tonumber(entries[entry + 1]) > now then
+            redis.call('PUBLISH', ARGV[4] .. entries[entry], username .. '\\29' .. id .. ARGV[3])
+        end
+    end
+    ids[index] = id
+end
+return ids
+"""
+
+
+# Возвращает ключ журнала событий пользователя
+def get_user_stream(username: str) -> str:
+    return STREAM_KEY_PREFIX + username
+
+
+# Класс журнала событий пользователей
+#
+# Каждое долговременное событие (сообщения) дописывается в Redis Stream получателя
+# с ограниченной длиной и временем жизни, а остальные события (typing, presence и т. п.)
+# только публикуются. Живые события уходят только на воркеры с сокетами получателей по каталогу подключений.
+# Клиент, переподключаясь с последним полученным event_id, получает из журнала только пропущенные события.
+class EventStream:
+    def __init__(
+        self,
+        redis: Redis,
+        directory: ConnectionDirectory = connection_directory,
+        max_len: int = config.EVENT_STREAM_MAX_LEN,
+        ttl: int = config.EVENT_STREAM_TTL,
+        replay_limit: int = config.EVENT_STREAM_REPLAY_LIMIT
+    ):
+        self.redis = redis
+        self.directory = directory
+        self.max_len = max_len
+        self.ttl = ttl
+        self.replay_limit = replay_limit
+        self._publish_script = redis.register_script(PUBLISH_SCRIPT)
+
+    async def publish(self, event: Event, usernames: list[str]):
+        # Событие упаковывается один раз для всех получателей и уходит в Redis одним обращением
+        data = event.pack()
+        if event.type not in DURABLE_EVENT_TYPES:
+            await self.directory.route(usernames, data)
+            return
+
+        keys = [get_user_stream(username) for username in usernames] + [get_directory_key(username) for username in usernames]
+        await self._publish_script(keys=keys, args=[self.max_len, self.ttl, data, WORKER_CHANNEL_PREFIX, len(DIRECTORY_KEY_PREFIX)])
+        REDIS_PUBLISHED.inc(len(usernames))
+
+    async def publish_each(self, events: list[tuple[Event, str]]):
+        # Разные кратковременные события разным пользователям одним обращением к Redis
+        await self.directory.route([username for _, username in events], [event.pack() for event, _ in events])
+
+    async def publish_group(self, event: Event, group_id: int):
+        # Событие группы публикуется один раз, Redis доставляет его каждому воркеру с участниками.
+        # В журналы участников оно не пишется: пропущенное клиент дочитывает из истории группы
+        REDIS_PUBLISHED.inc()
+        await self.redis.publish(get_group_channel(group_id), event.pack())
+
+    async def last_id(self, username: str) -> str:
+        # ID последнего события в журнале, "0-0" для пустого журнала
+        entries = await self.redis.xrevrange(get_user_stream(username), count=1)
+        return entries[0][0] if entries else "0-0"
+
+    async def read_after(self, username: str, after_id: str) -> list[Event] | None:
+        # События журнала после after_id по порядку.
+        # None — часть пропущенных событий уже вытеснена из журнала (или журнал истек), либо их больше лимита:
+        # клиенту нужно заново загрузить историю
+        key = get_user_stream(username)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xinfo_stream(key)
+            pipe.xrange(key, min=f"({after_id}", count=self.replay_limit + 1)
+            info, entries = await pipe.execute(raise_on_error=False)
+
+        position = parse_event_id(after_id)
+        if isinstance(info, ResponseError):
+            # Журнала нет: он истек, пока пользователь был не в сети, или в него еще ничего не писали
+            return [] if position == (0, 0) else None
+        if isinstance(entries, Exception):
+            raise entries
+        if parse_event_id(info["max-deleted-entry-id"]) > position or len(entries) > self.replay_limit:
+            return None
+
+        return [Event.unpack(fields["data"], id) for id, fields in entries]
@@ -0,0 +1,116 @@
+import time
+import msgpack, orjson
+from fastapi import WebSocket, WebSocketDisconnect
+
+
+CODECS = ("json", "msgpack")                                    # Кодеки, которые клиент может выбрать подпротоколом веб-сокета
+DEFAULT_CODEC = "json"
+TRANSIENT_EVENT_TYPES = {"typing", "joined", "left"}             # События, важно только последнее состояние которых
+DURABLE_EVENT_TYPES = {"new_message"}                           # События, которые сохраняются в журнал получателя
+GROUP_MEMBERSHIP_EVENT_TYPES = {"group_added", "group_removed"}  # События изменения групп пользователя, по ним воркер меняет подписки
+HEADER_SEPARATOR = "\x1f"                                       # Разделитель полей заголовка в Redis
+HEADER_END = "\x1e"                                             # Конец заголовка, дальше идет тело события
+
+
+# Разбирает ID записи Redis Streams («миллисекунды-номер») в кортеж для сравнения
+def parse_event_id(event_id: str) -> tuple[int, int]:
+    milliseconds, _, sequence = event_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+# Собирает ID записи Redis Streams из кортежа
+def format_event_id(position: tuple[int, int]) -> str:
+    return f"{position[0]}-{position[1]}"
+
+
+# Класс конверта события
+#
+# Событие сериализуется в JSON один раз при создании, это же тело отправляется в Redis и JSON-клиентам.
+# Тип, отправитель и получатель дублируются в заголовке перед телом, поэтому маршрутизация
+# и схлопывание событий не разбирают JSON. Для клиентов msgpack тело перекодируется
+# не больше одного раза на воркер, сколько бы устройств ни получало событие.
+# id — ID события в журнале получателя (Redis Streams), у кратковременных событий его нет.
+# Клиент получает его в поле event_id и передает при переподключении, чтобы получить пропущенное.
+class Event:
+    __slots__ = ("id", "type", "sender", "receiver", "body", "published_at", "_position", "_json", "_msgpack")
+
+    def __init__(self, type: str, sender: str, receiver: str, body: str, id: str | None = None, published_at: float | None = None):
+        self.id = id
+        self.type = type
+        self.sender = sender
+        self.receiver = receiver
+        self.body = body
+        self.published_at = published_at                        # Время упаковки для Redis, по нему считается задержка доставки
+        self._position: tuple[int, int] | None = None
+        self._json: str | None = None
+        self._msgpack: bytes | None = None
+
+    @classmethod
+    def create(cls, type: str, sender: str, receiver: str, payload: dict | None = None) -> "Event":
+        body = orjson.dumps({"type": type, "sender": sender, "receiver": receiver, "payload": payload or {}}).decode()
+        return cls(type, sender, receiver, body)
+
+    def pack(self) -> str:
+        # Формат сообщения в Redis: заголовок с ID, маршрутом и временем публикации и тело события.
+        # Событие без ID начинается с разделителя, и ID журнала можно просто дописать перед ним
+        header = HEADER_SEPARATOR.join((self.id or "", self.type, self.sender, self.receiver, f"{time.time():.6f}"))
+        return f"{header}{HEADER_END}{self.body}"
+
+    @classmethod
+    def unpack(cls, data: str, id: str | None = None) -> "Event":
+        header, _, body = data.partition(HEADER_END)
+        packed_id, type, sender, receiver, published_at = header.split(HEADER_SEPARATOR)
+        return cls(type, sender, receiver, body, id or packed_id or None, float(published_at))
+
+    # Позиция события в журнале получателя для сравнения, None для событий без ID
+    @property
+    def position(self) -> tuple[int, int] | None:
+        if self._position is None and self.id is not None:
+            self._position = parse_event_id(self.id)
+        return self._position
+
+    # Ключ схлопывания (тип, отправитель) для кратковременных событий, None для остальных
+    @property
+    def key(self) -> tuple | None:
+        if self.type in TRANSIENT_EVENT_TYPES:
+            return self.type, self.sender
+        return None
+
+    def encode(self, codec: str) -> str | bytes:
+        if codec == "msgpack":
+            if self._msgpack is None:
+                event = orjson.loads(self.body)
+                if self.id is not None:
+                    event["event_id"] = self.id
+                self._msgpack = msgpack.packb(event)
+            return self._msgpack
+
+        if self.id is None:
+            return self.body
+        if self._json is None:
+            # ID журнала вставляется в начало готового JSON без повторной сериализации
+            self._json = f'{{"event_id":"{self.id}",{self.body[1:]}'
+        return self._json
+
+
+# Выбирает кодек по подпротоколам, предложенным клиентом. None — клиент кодек не выбирал, используется JSON
+def negotiate_codec(subprotocols: list[str]) -> str | None:
+    for subprotocol in subprotocols:
+        if subprotocol in CODECS:
+            return subprotocol
+    return None
+
+
+# Принимает событие от клиента: текстовый кадр — JSON, бинарный — msgpack
+async def receive_event(websocket: WebSocket) -> dict:
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+
+    if message.get("bytes") is not None:
+        event = msgpack.unpackb(message["bytes"])
+    else:
+        event = orjson.loads(message["text"])
+
+    if not isinstance(event, dict):
+        raise ValueError("Event must be an object")
+    return event
@@ -0,0 +1,66 @@
+import time
+from collections import OrderedDict
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import config
+from app.database import Session, operations
+from app.utils.metrics import register_stats
+
+
+# Класс кэша групп пользователей
+#
+# Группы пользователя нужны при каждом подключении веб-сокета и при каждой проверке доступа к группе.
+# Состав групп меняют и другие воркеры, поэтому запись живет не дольше TTL. Изменения на этом воркере
+# и события group_added / group_removed, пришедшие его пользователям, сбрасывают запись сразу.
+# При промахе запрос идет через переданную сессию или через короткую сессию, как в кэше пользователей.
+class GroupMembership:
+    def __init__(
+        self,
+        max_size: int = config.GROUP_MEMBERSHIP_CACHE_MAX_SIZE,
+        ttl: float = config.GROUP_MEMBERSHIP_CACHE_TTL
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._groups: OrderedDict[int, tuple[frozenset[int], float]] = OrderedDict()   # ID пользователя -> (ID групп, когда истекает)
+        self.hits = 0
+        self.misses = 0
+
+    async def groups(self, user_id: int, db: AsyncSession | None = None) -> frozenset[int]:
+        entry = self._groups.get(user_id)
+        if entry is not None:
+            group_ids, expires_at = entry
+            if expires_at > time.monotonic():
+                self._groups.move_to_end(user_id)
+                self.hits += 1
+                return group_ids
+            del self._groups[user_id]
+
+        self.misses += 1
+        if db is not None:
+            group_ids = frozenset(await operations.get_user_group_ids(db, user_id))
+        else:
+            async with Session() as db:
+                group_ids = frozenset(await operations.get_user_group_ids(db, user_id))
+
+        self._groups[user_id] = (group_ids, time.monotonic() + self.ttl)
+        while len(self._groups) > self.max_size:
+            self._groups.popitem(last=False)
+        return group_ids
+
+    async def is_member(self, group_id: int, user_id: int, db: AsyncSession | None = None) -> bool:
+        return group_id in await self.groups(user_id, db)
+
+    def forget(self, *user_ids: int):
+        for user_id in user_ids:
+            self._groups.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._groups),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+group_membership = GroupMembership()
+register_stats("group_membership", group_membership.stats)
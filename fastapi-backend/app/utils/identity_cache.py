@@ -0,0 +1,101 @@
+from collections import OrderedDict
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import config
+from app.database import Session, operations
+from app.schemas import user as user_schema
+from app.utils.metrics import register_stats
+
+
+# Класс кэша соответствия ID и имени пользователя
+#
+# Имя пользователя не меняется, поэтому записи не устаревают и вытесняются только по LRU.
+# Отсутствующие пользователи не кэшируются: ID может появиться после регистрации.
+# При промахе запрос идет через переданную сессию, а без нее — через короткую сессию,
+# которая сразу возвращает соединение в пул: веб-сокеты не держат соединения с БД.
+class IdentityCache:
+    def __init__(self, max_size: int = config.IDENTITY_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self._users: OrderedDict[int, str] = OrderedDict()      # ID -> имя пользователя
+        self._ids: dict[str, int] = {}                          # Имя пользователя -> ID
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def remember(self, user_id: int, username: str):
+        self._users.pop(user_id, None)
+        self._users[user_id] = username
+        self._ids[username] = user_id
+
+        # Вытесняем давно не использованных пользователей
+        while len(self._users) > self.max_size:
+            _, oldest = self._users.popitem(last=False)
+            self._ids.pop(oldest, None)
+            self.evictions += 1
+
+    async def get_user(self, user_id: int, db: AsyncSession | None = None) -> user_schema.User | None:
+        username = self._users.get(user_id)
+        if username is not None:
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return user_schema.User(id=user_id, username=username)
+
+        self.misses += 1
+        db_user = await self._query(operations.get_user_by_id, db, user_id)
+        if db_user is None:
+            return None
+        self.remember(db_user.id, db_user.username)
+        return user_schema.User(id=db_user.id, username=db_user.username)
+
+    async def get_user_by_username(self, username: str, db: AsyncSession | None = None) -> user_schema.User | None:
+        user_id = self._ids.get(username)
+        if user_id is not None:
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return user_schema.User(id=user_id, username=username)
+
+        self.misses += 1
+        db_user = await self._query(operations.get_user_by_username, db, username)
+        if db_user is None:
+            return None
+        self.remember(db_user.id, db_user.username)
+        return user_schema.User(id=db_user.id, username=db_user.username)
+
+    async def get_usernames(self, user_ids: list[int], db: AsyncSession | None = None) -> dict[int, str]:
+        # Имена нескольких пользователей, недостающие загружаются одним запросом
+        usernames = {}
+        missing = []
+        for user_id in user_ids:
+            username = self._users.get(user_id)
+            if username is None:
+                missing.append(user_id)
+            else:
+                usernames[user_id] = username
+        self.hits += len(usernames)
+        self.misses += len(missing)
+
+        if missing:
+            loaded = await self._query(operations.get_usernames, db, missing)
+            for user_id, username in loaded.items():
+                self.remember(user_id, username)
+            usernames.update(loaded)
+        return usernames
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._users),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    @staticmethod
+    async def _query(operation, db: AsyncSession | None, *args):
+        if db is not None:
+            return await operation(db, *args)
+        async with Session() as db:
+            return await operation(db, *args)
+
+
+identity_cache = IdentityCache()
+register_stats("identity_cache", identity_cache.stats)
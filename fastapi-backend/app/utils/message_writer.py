@@ -0,0 +1,147 @@
+import asyncio, logging
+from app import config
+from app.database import Session, operations
+from app.database.replicas import replica_router
+
+
+logger = logging.getLogger(__name__)
+
+
+# Класс для отложенной пакетной записи сообщений в БД
+#
+# Сообщения со всех сокетов воркера копятся в очереди и записываются одним INSERT,
+# когда набирается BATCH_SIZE сообщений или проходит FLUSH_INTERVAL с первого сообщения пачки.
+# submit() возвращает future, который завершается ID сообщения после коммита
+# или исключением, если сообщение записать не удалось. Пачки пишутся по порядку,
+# поэтому future завершаются в порядке отправки. stop() дописывает всю очередь, а сообщения,
+# не успевшие встать в нее до остановки, завершаются исключением.
+class MessageWriter:
+    def __init__(
+        self,
+        batch_size: int = config.MESSAGE_WRITER_BATCH_SIZE,
+        flush_interval: float = config.MESSAGE_WRITER_FLUSH_INTERVAL,
+        max_pending: int = config.MESSAGE_WRITER_MAX_PENDING
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue(max_pending)
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self.batches = 0
+        self.saved = 0
+        self.failed = 0
+
+    def start(self):
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Перестаем принимать сообщения и ждем, пока запишется все, что уже в очереди
+        self._closing = True
+        if self._task is None:
+            return
+        await self.queue.put(None)
+        await self._task
+        self._task = None
+        self._reject_queued()
+
+    async def submit(self, sender_id: int, receiver_id: int | None, text: str, group_id: int | None = None) -> asyncio.Future:
+        if self._closing or self._task is None:
+            raise RuntimeError("Message writer is not running")
+
+        saved = asyncio.get_running_loop().create_future()
+        # При заполненной очереди отправитель ждет, пока БД не разберет накопившееся
+        await self.queue.put(({"sender_id": sender_id, "receiver_id": receiver_id, "group_id": group_id, "text": text}, saved))
+        if self._task is None:
+            self._reject_queued()                               # Пока отправитель ждал места в очереди, запись остановилась
+        return saved
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "batches": self.batches,
+            "saved": self.saved,
+            "failed": self.failed
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+
+            # Добираем пачку до BATCH_SIZE, но не дольше FLUSH_INTERVAL
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list):
+        rows = [row for row, _ in batch]
+        try:
+            async with Session() as db:
+                message_ids = await operations.create_messages(db, rows)
+        except Exception:
+            if len(batch) == 1:
+                logger.exception("Failed to save message")
+                self.failed += 1
+                self._resolve(batch, None)
+                return
+
+            # Пишем пачку по одному сообщению, чтобы одна некорректная строка не отклонила остальные
+            logger.warning("Failed to save batch of %d messages, retrying one by one", len(batch), exc_info=True)
+            for item in batch:
+                await self._flush([item])
+            return
+
+        # Отмечаем запись до подтверждения: получив сообщение, участники сразу читают историю
+        scopes = []
+        for row in rows:
+            scopes.append(f"user:{row['sender_id']}")
+            if row["receiver_id"] is not None:
+                scopes.append(f"user:{row['receiver_id']}")
+            if row["group_id"] is not None:
+                scopes.append(f"group:{row['group_id']}")
+        await replica_router.mark_written(*scopes)
+
+        self.batches += 1
+        self.saved += len(message_ids)
+        self._resolve(batch, message_ids)
+
+    def _reject_queued(self):
+        # Сообщения, попавшие в очередь после сигнала остановки, уже не запишутся
+        rejected = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not None:
+                rejected.append(item)
+        self.failed += len(rejected)
+        self._resolve(rejected, None)
+
+    @staticmethod
+    def _resolve(batch: list, message_ids: list[int] | None):
+        for index, (_, saved) in enumerate(batch):
+            if saved.done():
+                continue
+            if message_ids is None:
+                saved.set_exception(RuntimeError("Message was not saved"))
+            else:
+                saved.set_result(message_ids[index])
@@ -0,0 +1,117 @@
+import functools, time
+from typing import Callable
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+# Метрики горячих путей. Значения пишутся в момент события, счетчики подсистем снимаются только при запросе /metrics
+HTTP_REQUEST_DURATION = Histogram(
+    "chat_http_request_duration_seconds", "HTTP request latency by route template",
+    ["method", "route", "status"]
+)
+DB_QUERY_DURATION = Histogram(
+    "chat_db_operation_duration_seconds", "Duration of database operations from app.database.operations",
+    ["operation"]
+)
+PASSWORD_HASH_DURATION = Histogram(
+    "chat_password_hash_duration_seconds", "Time spent in bcrypt",
+    ["operation"], buckets=(0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0, 5.0)
+)
+REDIS_PUBLISHED = Counter("chat_redis_published_messages_total", "Messages published to Redis user channels")
+REDIS_RECEIVED = Counter("chat_redis_received_messages_total", "Messages received by the Redis listener")
+REDIS_DELIVERY_LAG = Histogram(
+    "chat_redis_delivery_lag_seconds", "Time from publishing an event to queueing it on local sockets",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+
+# Класс сборщика счетчиков подсистем
+#
+# Подсистемы уже ведут свои счетчики (stats()), поэтому они не дублируются на горячем пути,
+# а читаются при каждом запросе /metrics и отдаются как gauge с префиксом chat_<подсистема>_.
+# Вложенный словарь {значение метки: {метрика: число}} превращается в метрики с меткой label.
+class StatsCollector:
+    def __init__(self):
+        self.sources: dict[str, tuple[Callable[[], dict], str | None]] = {}
+
+    def register(self, name: str, stats: Callable[[], dict], label: str | None = None):
+        self.sources[name] = (stats, label)
+
+    def collect(self):
+        for name, (stats, label) in self.sources.items():
+            families: dict[str, GaugeMetricFamily] = {}
+            for key, value in stats().items():
+                if isinstance(value, dict) and label is not None:
+                    for label_value, values in value.items():
+                        for metric, number in values.items():
+                            family = families.get(metric)
+                            if family is None:
+                                family = families[metric] = GaugeMetricFamily(f"chat_{name}_{metric}", f"{name} {metric}", labels=[label])
+                            family.add_metric([label_value], number)
+                elif isinstance(value, (int, float)):
+                    families[key] = GaugeMetricFamily(f"chat_{name}_{key}", f"{name} {key}", value=value)
+            yield from families.values()
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+# Регистрирует функцию stats() подсистемы для экспорта в /metrics
+def register_stats(name: str, stats: Callable[[], dict], label: str | None = None):
+    stats_collector.register(name, stats, label)
+
+
+# Декоратор, измеряющий время асинхронной операции с БД
+def timed_operation(func):
+    histogram = DB_QUERY_DURATION.labels(func.__name__)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+# ASGI-middleware, измеряющее задержку HTTP-запросов.
+# Метка route — шаблон пути маршрута (/api/chats/{user_id}), поэтому число рядов не зависит от ID в запросах
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._histograms: dict[tuple, Histogram] = {}           # Ряды гистограммы по (метод, маршрут, статус) без поиска в labels()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            key = (scope["method"], route.path if route is not None else "unmatched", status_code)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = HTTP_REQUEST_DURATION.labels(*key)
+            histogram.observe(elapsed)
+
+
+# Эндпоинт /metrics в текстовом формате Prometheus
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
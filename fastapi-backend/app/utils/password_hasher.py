@@ -0,0 +1,76 @@
+import asyncio, time
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+from app import config
+from app.utils.metrics import PASSWORD_HASH_DURATION, register_stats
+
+
+# Исключение при переполнении очереди хэширования
+class PasswordHasherOverloaded(Exception):
+    pass
+
+
+# Класс для хэширования и проверки паролей вне цикла событий
+#
+# bcrypt отпускает GIL, поэтому пула потоков достаточно, чтобы вход и регистрация
+# не останавливали веб-сокеты воркера. Одновременно считается не больше WORKERS хэшей,
+# в очереди ждет не больше MAX_PENDING запросов, остальные сразу отклоняются.
+class PasswordHasher:
+    def __init__(self, workers: int = config.PASSWORD_HASHER_WORKERS, max_pending: int = config.PASSWORD_HASHER_MAX_PENDING):
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hasher")
+        self._semaphore = asyncio.Semaphore(workers)
+        self.pending = 0                    # Запросов ждут свободный поток
+        self.active = 0                     # Хэшей считается прямо сейчас
+        self.max_pending_seen = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0             # Суммарное время работы bcrypt
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run("verify", self.context.verify, password, hashed_password)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "active": self.active,
+            "max_pending_seen": self.max_pending_seen,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "busy_seconds": self.busy_seconds
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self, operation: str, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordHasherOverloaded()
+
+        self.pending += 1
+        self.max_pending_seen = max(self.max_pending_seen, self.pending)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.pending -= 1
+
+        self.active += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            PASSWORD_HASH_DURATION.labels(operation).observe(elapsed)
+            self.busy_seconds += elapsed
+            self.active -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+
+password_hasher = PasswordHasher()
+register_stats("password_hasher", password_hasher.stats)
@@ -0,0 +1,273 @@
+import asyncio, logging, time
+from redis.asyncio import Redis
+from app import config
+from app.database import Session, operations
+from app.utils.connection_directory import connection_directory
+from app.utils.connection_manager import WORKER_ID
+from app.utils.events import Event
+from app.utils.identity_cache import identity_cache
+from app.utils.metrics import register_stats
+from app.utils.redis_client import redis
+
+
+logger = logging.getLogger(__name__)
+
+ONLINE_KEY = "presence:online"                                  # Сортированное множество: ID пользователя -> время последнего heartbeat (мс)
+USER_KEY_PREFIX = "presence:user:"                              # Хэш пользователя: воркер -> время последнего heartbeat (мс)
+
+# Отмечает пользователя на воркере, возвращает 1, если до этого он не был в сети.
+# KEYS — хэш пользователя и множество online, ARGV — воркер, текущее время, TTL (мс) и ID пользователя
+CONNECT_SCRIPT = """
+local score = redis.call('ZSCORE', KEYS[2], ARGV[4])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[4])
+if score and tonumber(score) > tonumber(ARGV[2]) - tonumber(ARGV[3]) then
+    return 0
+end
+return 1
+"""
+
+# Снимает отметку воркера, возвращает 1, если у пользователя не осталось живых воркеров.
+# Отметки воркеров без heartbeat дольше TTL считаются мертвыми и удаляются
+DISCONNECT_SCRIPT = """
+redis.call('HDEL', KEYS[1], ARGV[1])
+local fields = redis.call('HGETALL', KEYS[1])
+local alive = 0
+for index = 1, #fields, 2 do
+    if tonumber(fields[index + 1]) > tonumber(ARGV[2]) - tonumber(ARGV[3]) then
+        alive = alive + 1
+    else
+        redis.call('HDEL', KEYS[1], fields[index])
+    end
+end
+if alive > 0 then
+    return 0
+end
+redis.call('ZREM', KEYS[2], ARGV[4])
+return 1
+"""
+
+# Забирает пользователей, heartbeat которых не обновлялся дольше TTL (например, их воркер упал).
+# Пользователь достается только одному воркеру, тот и рассылает уведомление
+EXPIRE_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #expired > 0 then
+    redis.call('ZREM', KEYS[1], unpack(expired))
+end
+return expired
+"""
+
+
+# Возвращает ключ хэша присутствия пользователя
+def get_user_key(user_id: int) -> str:
+    return f"{USER_KEY_PREFIX}{user_id}"
+
+
+# Класс сервиса присутствия пользователей
+#
+# Воркер отмечает в Redis пользователей со своими сокетами и раз в HEARTBEAT_INTERVAL продлевает отметки.
+# Пользователь в сети, пока его отметку кто-то продлевает, поэтому после падения воркера
+# его пользователи уходят из сети не позже чем через TTL.
+# Изменения копятся и раз в FLUSH_INTERVAL рассылаются одной пачкой: переподключение внутри
+# интервала не дает уведомлений, а каждый собеседник получает одно событие presence со всеми изменениями.
+# Уведомления получают только собеседники из последних переписок, которые сейчас в сети.
+class PresenceService:
+    def __init__(
+        self,
+        redis: Redis,
+        ttl: float = config.PRESENCE_TTL,
+        heartbeat_interval: float = config.PRESENCE_HEARTBEAT_INTERVAL,
+        flush_interval: float = config.PRESENCE_FLUSH_INTERVAL,
+        max_contacts: int = config.PRESENCE_MAX_CONTACTS
+    ):
+        self.redis = redis
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.flush_interval = flush_interval
+        self.max_contacts = max_contacts
+        self.local_users: dict[int, list] = {}                  # ID пользователя -> [username, число локальных сокетов]
+        self._pending: dict[int, list] = {}                     # ID пользователя -> [username, был в сети, в сети]
+        self._connect_script = redis.register_script(CONNECT_SCRIPT)
+        self._disconnect_script = redis.register_script(DISCONNECT_SCRIPT)
+        self._expire_script = redis.register_script(EXPIRE_SCRIPT)
+        self._tasks: list[asyncio.Task] = []
+        self.notifications = 0
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._heartbeat()), asyncio.create_task(self._flush_loop())]
+
+    async def stop(self):
+        # Снимаем отметки всех локальных пользователей и рассылаем накопленные уведомления
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        for user_id in list(self.local_users):
+            local = self.local_users.pop(user_id, None)
+            if local is not None:                                # Пока снималась предыдущая отметка, пользователь мог отключиться сам
+                await self._leave(user_id, local[0])
+        await self.flush()
+
+    async def connect(self, user_id: int, username: str):
+        local = self.local_users.get(user_id)
+        if local is not None:
+            local[1] += 1
+            return
+
+        self.local_users[user_id] = [username, 1]
+        try:
+            became_online = await self._connect_script(
+                keys=[get_user_key(user_id), ONLINE_KEY],
+                args=[WORKER_ID, self._now(), self._ttl_ms(), user_id]
+            )
+        except Exception:
+            logger.warning("Presence: failed to mark %s online", username, exc_info=True)
+            return
+        if became_online:
+            self._mark(user_id, username, True)
+
+    async def disconnect(self, user_id: int):
+        local = self.local_users.get(user_id)
+        if local is None:
+            return
+        local[1] -= 1
+        if local[1] > 0:
+            return
+
+        # Последний сокет пользователя на воркере закрыт
+        del self.local_users[user_id]
+        await self._leave(user_id, local[0])
+
+    async def online(self, user_ids: list[int]) -> list[int]:
+        # Кто из перечисленных пользователей сейчас в сети, одним запросом к Redis
+        if not user_ids:
+            return []
+        scores = await self.redis.zmscore(ONLINE_KEY, user_ids)
+        deadline = self._now() - self._ttl_ms()
+        return [user_id for user_id, score in zip(user_ids, scores) if score is not None and score > deadline]
+
+    async def flush(self):
+        # Рассылает накопленные изменения; состояние, вернувшееся к исходному, не рассылается
+        pending, self._pending = self._pending, {}
+        changes = {user_id: (username, online) for user_id, (username, was_online, online) in pending.items() if was_online != online}
+        if not changes:
+            return
+
+        try:
+            await self._notify(changes)
+        except BaseException:
+            self._restore(pending)                              # Изменения разошлются следующим проходом
+            raise
+
+    async def _notify(self, changes: dict[int, tuple]):
+        missing = [user_id for user_id, (username, _) in changes.items() if username is None]
+        usernames = await identity_cache.get_usernames(missing) if missing else {}
+        async with Session() as db:
+            contacts = await operations.get_contacts(db, list(changes), self.max_contacts)
+
+        # Собираем для каждого собеседника одно событие со всеми изменениями
+        updates: dict[int, list] = {}
+        for user_id, contact_id, contact_username in contacts:
+            username, online = changes[user_id]
+            username = username or usernames.get(user_id)
+            if username is None:
+                continue
+            update = updates.setdefault(contact_id, [contact_username, [], []])
+            update[1 if online else 2].append(username)
+
+        recipients = set(await self.online(list(updates)))
+        usernames, events = [], []
+        for contact_id, (contact_username, online, offline) in updates.items():
+            if contact_id in recipients:
+                event = Event.create("presence", contact_username, contact_username, {"online": online, "offline": offline})
+                usernames.append(contact_username)
+                events.append(event.pack())
+        await connection_directory.route(usernames, events)
+        self.notifications += len(events)
+
+    def stats(self) -> dict:
+        return {
+            "local_users": len(self.local_users),
+            "pending": len(self._pending),
+            "notifications": self.notifications
+        }
+
+    async def _leave(self, user_id: int, username: str):
+        try:
+            went_offline = await self._disconnect_script(
+                keys=[get_user_key(user_id), ONLINE_KEY],
+                args=[WORKER_ID, self._now(), self._ttl_ms(), user_id]
+            )
+        except Exception:
+            logger.warning("Presence: failed to mark %s offline", username, exc_info=True)
+            return
+        if went_offline:
+            self._mark(user_id, username, False)
+
+    def _restore(self, pending: dict[int, list]):
+        # Возвращает неразосланные изменения; более новые отметки, сделанные во время рассылки, сохраняются
+        for user_id, (username, was_online, online) in pending.items():
+            change = self._pending.get(user_id)
+            if change is None:
+                self._pending[user_id] = [username, was_online, online]
+            else:
+                change[0] = change[0] or username
+                change[1] = was_online
+
+    def _mark(self, user_id: int, username: str | None, online: bool):
+        change = self._pending.get(user_id)
+        if change is None:
+            self._pending[user_id] = [username, not online, online]
+        else:
+            change[0] = change[0] or username
+            change[2] = online
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self._touch()
+
+                # Пользователи упавших воркеров уходят из сети
+                expired = await self._expire_script(keys=[ONLINE_KEY], args=[self._now() - self._ttl_ms(), 1000])
+                for user_id in expired:
+                    self._mark(int(user_id), None, False)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Presence heartbeat failed", exc_info=True)
+
+    async def _touch(self):
+        # Продлеваем отметки всех локальных пользователей одним обращением к Redis
+        now = self._now()
+        user_ids = list(self.local_users)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for index in range(0, len(user_ids), 1000):
+                pipe.zadd(ONLINE_KEY, {user_id: now for user_id in user_ids[index:index + 1000]})
+            for user_id in user_ids:
+                pipe.hset(get_user_key(user_id), WORKER_ID, now)
+                pipe.pexpire(get_user_key(user_id), self._ttl_ms())
+            await pipe.execute()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Presence flush failed", exc_info=True)
+
+    def _ttl_ms(self) -> int:
+        return int(self.ttl * 1000)
+
+    @staticmethod
+    def _now() -> int:
+        return int(time.time() * 1000)
+
+
+presence = PresenceService(redis)
+register_stats("presence", presence.stats)
@@ -0,0 +1,136 @@
+import logging, time
+from redis.asyncio import Redis
+from app import config
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET = "*"                                            # Бюджет для типов событий, не перечисленных в лимитах
+
+# Общее для воркеров ведро токенов пользователя. Время берется у Redis, чтобы часы воркеров не расходились.
+# KEYS — ведро, ARGV — скорость (токенов/сек) и емкость. Возвращает 0 или через сколько мс появится токен
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - updated) * rate / 1000)
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait
+"""
+
+
+# Разбирает лимиты вида "new_message=5/10,typing=2/5,*=5/10": тип события = скорость в секунду / емкость
+def parse_limits(spec: str) -> dict[str, tuple[float, int]]:
+    limits = {}
+    for item in filter(None, (item.strip() for item in spec.split(","))):
+        event_type, _, budget = item.partition("=")
+        rate, _, burst = budget.partition("/")
+        limits[event_type.strip()] = (float(rate), int(burst or max(1, float(rate))))
+    return limits
+
+
+# Класс ведра токенов в памяти процесса
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        # Берет токен, возвращает 0 или сколько секунд ждать следующего
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+# Класс лимитов одного подключения: свои ведра на каждый бюджет и счетчик отказов подряд
+class ConnectionLimits:
+    __slots__ = ("buckets", "throttled_in_row")
+
+    def __init__(self, limits: dict[str, tuple[float, int]]):
+        self.buckets = {budget: TokenBucket(rate, burst) for budget, (rate, burst) in limits.items()}
+        self.throttled_in_row = 0
+
+
+# Класс ограничителя частоты событий веб-сокета
+#
+# Событие проходит два ведра токенов: ведро подключения в памяти воркера и общее ведро
+# пользователя в Redis, которое делят все его устройства на всех воркерах.
+# У каждого типа события свой бюджет, типы без своего бюджета делят бюджет "*".
+# Ведро подключения проверяется первым, поэтому поток от одного сокета отсекается без обращений к Redis.
+# Если Redis недоступен, событие пропускается: ограничитель не должен останавливать чат.
+class RateLimiter:
+    def __init__(
+        self,
+        redis: Redis,
+        connection_limits: str = config.RATE_LIMIT_CONNECTION,
+        user_limits: str = config.RATE_LIMIT_USER,
+        redis_prefix: str = "ratelimit:"
+    ):
+        self.redis = redis
+        self.connection_limits = parse_limits(connection_limits)
+        self.user_limits = parse_limits(user_limits)
+        self.redis_prefix = redis_prefix
+        self._script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self.counters: dict[str, dict[str, int]] = {}           # Бюджет -> allowed / throttled_connection / throttled_user
+        self.errors = 0
+
+    def connect(self) -> ConnectionLimits:
+        return ConnectionLimits(self.connection_limits)
+
+    def budget(self, event_type: str) -> str:
+        return event_type if event_type in self.connection_limits or event_type in self.user_limits else DEFAULT_BUDGET
+
+    async def acquire(self, user_id: int, limits: ConnectionLimits, event_type: str) -> float:
+        # Возвращает 0, если событие можно обработать, иначе через сколько секунд стоит повторить
+        budget = self.budget(event_type)
+        counters = self.counters.get(budget)
+        if counters is None:
+            counters = self.counters[budget] = {"allowed": 0, "throttled_connection": 0, "throttled_user": 0}
+
+        bucket = limits.buckets.get(budget)
+        wait = bucket.take() if bucket is not None else 0.0
+        if wait:
+            counters["throttled_connection"] += 1
+            limits.throttled_in_row += 1
+            return wait
+
+        user_limit = self.user_limits.get(budget)
+        if user_limit is not None:
+            try:
+                wait = await self._script(keys=[f"{self.redis_prefix}{user_id}:{budget}"], args=list(user_limit)) / 1000
+            except Exception:
+                self.errors += 1
+                logger.debug("Rate limiter: Redis is unavailable", exc_info=True)
+                wait = 0.0
+            if wait:
+                counters["throttled_user"] += 1
+                limits.throttled_in_row += 1
+                return wait
+
+        counters["allowed"] += 1
+        limits.throttled_in_row = 0
+        return 0.0
+
+    def stats(self) -> dict:
+        return {"budgets": {budget: dict(counters) for budget, counters in self.counters.items()}, "errors": self.errors}
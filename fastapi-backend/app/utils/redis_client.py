@@ -0,0 +1,5 @@
+from redis.asyncio import Redis
+from app import config
+
+
+redis = Redis.from_url(config.REDIS_URL, decode_responses=True)      # Общее подключение к Redis для всего приложения
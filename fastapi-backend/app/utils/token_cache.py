@@ -0,0 +1,139 @@
+import hashlib, json, logging, time
+from collections import OrderedDict
+from redis.asyncio import Redis
+from app import config
+from app.schemas import user as user_schema
+
+
+logger = logging.getLogger(__name__)
+
+
+# Класс кэша пользователей по проверенным токенам
+#
+# Первый уровень — LRU в памяти процесса, второй (необязательный) — Redis, общий для воркеров.
+# Запись живет не дольше срока действия токена (exp); в памяти процесса — не дольше TTL,
+# поэтому инвалидация на одном воркере доходит до остальных не позже чем через TTL.
+# Токены хранятся только в виде SHA-256, попадание по ключу означает, что подпись уже проверялась.
+class TokenCache:
+    def __init__(
+        self,
+        max_size: int = config.TOKEN_CACHE_MAX_SIZE,
+        ttl: float = config.TOKEN_CACHE_TTL,
+        redis: Redis | None = None,
+        redis_prefix: str = "auth:"
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis = redis
+        self.redis_prefix = redis_prefix
+        self._entries: OrderedDict[str, tuple[user_schema.User, float]] = OrderedDict()
+        self._keys_by_username: dict[str, set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.redis_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def _token_key(self, key: str) -> str:
+        return f"{self.redis_prefix}token:{key}"
+
+    def _user_key(self, username: str) -> str:
+        return f"{self.redis_prefix}user:{username}"
+
+    async def get(self, token: str) -> user_schema.User | None:
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is not None:
+            user, expires_at = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return user
+            self._remove(key)
+
+        # Пробуем общий кэш в Redis
+        if self.redis is not None:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.get(self._token_key(key))
+                    pipe.pttl(self._token_key(key))
+                    value, ttl = await pipe.execute()
+            except Exception:
+                logger.warning("Token cache: Redis is unavailable", exc_info=True)
+                value = None
+            if value is not None and ttl > 0:
+                user = user_schema.User.model_validate(json.loads(value))
+                self._store(key, user, time.time() + ttl / 1000)
+                self.redis_hits += 1
+                return user
+
+        self.misses += 1
+        return None
+
+    async def set(self, token: str, user: user_schema.User, expires_at: float):
+        key = self._key(token)
+        if expires_at <= time.time():
+            return
+        self._store(key, user, expires_at)
+
+        if self.redis is not None:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.set(self._token_key(key), user.model_dump_json(), exat=int(expires_at))
+                    pipe.sadd(self._user_key(user.username), key)
+                    # Множество токенов пользователя живет до истечения самого позднего из них
+                    pipe.expireat(self._user_key(user.username), int(expires_at), gt=True)
+                    pipe.expireat(self._user_key(user.username), int(expires_at), nx=True)
+                    await pipe.execute()
+            except Exception:
+                logger.warning("Token cache: Redis is unavailable", exc_info=True)
+
+    async def invalidate(self, token: str):
+        key = self._key(token)
+        self._remove(key)
+        if self.redis is not None:
+            await self.redis.delete(self._token_key(key))
+
+    async def invalidate_user(self, username: str):
+        # Сбрасываем все токены пользователя, например после смены пароля или удаления
+        for key in list(self._keys_by_username.get(username, ())):
+            self._remove(key)
+
+        if self.redis is not None:
+            keys = await self.redis.smembers(self._user_key(username))
+            await self.redis.delete(self._user_key(username), *(self._token_key(key) for key in keys))
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def _store(self, key: str, user: user_schema.User, expires_at: float):
+        self._remove(key)
+        self._entries[key] = (user, min(expires_at, time.time() + self.ttl))
+        self._keys_by_username.setdefault(user.username, set()).add(key)
+
+        # Вытесняем давно не использованные записи
+        while len(self._entries) > self.max_size:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        username = entry[0].username
+        keys = self._keys_by_username.get(username)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_username[username]
@@ -0,0 +1,34 @@
+import os, statistics
+
+
+# Значения по умолчанию, без которых не импортируется app.config
+os.environ.setdefault("BACKEND_SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("BACKEND_ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+
+
+# Возвращает перцентиль по отсортированному списку значений
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+# Возвращает сводку по задержкам: количество, пропускная способность и перцентили в миллисекундах
+def summarize(latencies: list[float], elapsed: float) -> dict:
+    return {
+        "count": len(latencies),
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "mean": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "p50": percentile(latencies, 50) * 1000,
+        "p99": percentile(latencies, 99) * 1000
+    }
+
+# Печатает сводку по задержкам в миллисекундах
+def print_latency(name: str, latencies: list[float], elapsed: float):
+    summary = summarize(latencies, elapsed)
+    print(
+        f"{name:<28} events={summary['count']:<8} throughput={summary['throughput']:>10.0f}/s "
+        f"mean={summary['mean']:>8.2f}ms p50={summary['p50']:>8.2f}ms "
+        f"p99={summary['p99']:>8.2f}ms"
+    )
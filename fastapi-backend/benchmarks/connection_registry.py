@@ -0,0 +1,76 @@
+import argparse, asyncio, random, time, tracemalloc
+import benchmarks.common  # noqa: F401
+from app.utils.connection_manager import WORKER_CHANNEL, ConnectionManager, pack_inbox_message
+from app.utils.events import Event
+
+
+# Веб-сокет, который только считает отправленные кадры
+class FakeWebSocket:
+    __slots__ = ("sent",)
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_text(self, text: str):
+        self.sent += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Реестр подключений: много устройств на пользователя")
+    parser.add_argument("--connections", type=int, default=100000)
+    parser.add_argument("--min-sessions", type=int, default=1)
+    parser.add_argument("--max-sessions", type=int, default=10)
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    manager = ConnectionManager()
+
+    # Раскладываем подключения по пользователям с 1–10 сессиями
+    sessions = []
+    while len(sessions) < args.connections:
+        username = f"user{len(sessions)}"
+        for _ in range(min(random.randint(args.min_sessions, args.max_sessions), args.connections - len(sessions))):
+            sessions.append(username)
+    usernames = list(dict.fromkeys(sessions))
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    connections = [(username, await manager.connect(username, FakeWebSocket())) for username in sessions]
+    connect_time = time.perf_counter() - started
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"connect     {len(connections)} connections / {len(usernames)} users: {len(connections) / connect_time:>10.0f} ops/s, {memory / len(connections):.0f} B/connection")
+
+    # Рассылка: одно событие пользователю уходит на все его устройства
+    event_data = Event.create("new_message", "bench", "user", {"text": "hello"}).pack()
+    messages = [{"channel": WORKER_CHANNEL, "data": pack_inbox_message([random.choice(usernames)], event_data)} for _ in range(args.events)]
+    started = time.perf_counter()
+    enqueue_time = 0.0
+    for index in range(0, len(messages), 256):
+        batch_started = time.perf_counter()
+        manager.send_messages_to_receivers(messages[index:index + 256])
+        enqueue_time += time.perf_counter() - batch_started
+        await asyncio.sleep(0)                                  # Даем поработать задачам записи
+    while manager.stats()["queued"]:
+        await asyncio.sleep(0.01)
+    total_time = time.perf_counter() - started
+    frames = sum(connection.websocket.sent for _, connection in connections)
+    assert frames > 0, "events were not routed to connections"
+    print(f"fan-out     {args.events} events -> {frames} frames: enqueue {args.events / enqueue_time:>10.0f} events/s, delivered {frames / total_time:>10.0f} frames/s")
+
+    # Отключение в случайном порядке
+    random.shuffle(connections)
+    started = time.perf_counter()
+    for username, connection in connections:
+        await manager.disconnect(username, connection)
+    disconnect_time = time.perf_counter() - started
+    print(f"disconnect  {len(connections)} connections: {len(connections) / disconnect_time:>10.0f} ops/s, users left {len(manager.active_connections)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
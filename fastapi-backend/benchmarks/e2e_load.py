@@ -0,0 +1,244 @@
+import argparse, asyncio, json, os, random, subprocess, sys, time, uuid
+import httpx, websockets
+from benchmarks.common import summarize
+
+
+# Класс сборщика результатов: задержки и ошибки по каждой операции сценария
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    def record(self, name: str, seconds: float):
+        self.latencies.setdefault(name, []).append(seconds)
+
+    def error(self, name: str):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    async def request(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs) -> httpx.Response | None:
+        # Выполняет запрос и записывает задержку под именем шаблона маршрута
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.error(name)
+            return None
+        if response.is_success:
+            self.record(name, time.perf_counter() - started)
+        else:
+            self.error(name)
+        return response
+
+    def report(self, elapsed: dict[str, float]) -> dict:
+        return {
+            name: {**summarize(latencies, elapsed.get(name, elapsed["total"])), "errors": self.errors.get(name, 0)}
+            for name, latencies in sorted(self.latencies.items())
+        } | {
+            name: {**summarize([], 1), "errors": errors}
+            for name, errors in self.errors.items() if name not in self.latencies
+        }
+
+
+# Виртуальный пользователь: вход, REST-запросы клиента, обмен сообщениями по веб-сокету и чтение истории
+async def virtual_user(args, client: httpx.AsyncClient, recorder: Recorder, user: dict, peer: dict, ready: asyncio.Barrier, sent: dict[str, int]):
+    response = await recorder.request(client, "POST /api/auth/login", "POST", "/api/auth/login", json={"username": user["username"], "password": "password"})
+    token = response.json()["access_token"] if response is not None and response.is_success else user["token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    await recorder.request(client, "GET /api/users/me", "GET", "/api/users/me", headers=headers)
+    await recorder.request(client, "GET /api/chats", "GET", "/api/chats", params={"limit": 20}, headers=headers)
+    await recorder.request(client, "GET /api/chats/conversations", "GET", "/api/chats/conversations", params={"limit": 20}, headers=headers)
+    await recorder.request(client, "GET /api/users/online", "GET", "/api/users/online", params={"ids": [peer["id"]]}, headers=headers)
+
+    url = f"{args.ws_url}/api/chats/{peer['id']}/ws?access_token={token}"
+    started = time.perf_counter()
+    try:
+        websocket = await websockets.connect(url, max_queue=None, open_timeout=30)
+    except Exception:
+        recorder.error("WS connect")
+        await ready.wait()
+        sent[user["username"]] = 0
+        return
+    recorder.record("WS connect", time.perf_counter() - started)
+
+    async with websocket:
+        await ready.wait()
+        count = 0
+        received = 0
+
+        # Сообщения собеседника дают задержку доставки, эхо своих — время до сохранения в БД и рассылки
+        async def receive():
+            nonlocal received
+            async for frame in websocket:
+                event = json.loads(frame)
+                if event["type"] == "new_message" and "ts" in event["payload"]:
+                    name = "WS delivery" if event["sender"] == peer["username"] else "WS ack"
+                    recorder.record(name, time.perf_counter() - event["payload"]["ts"])
+                    received += event["sender"] == peer["username"]
+                elif event["type"] == "error":
+                    recorder.error("WS " + event["payload"].get("detail", "error"))
+
+        receiver = asyncio.create_task(receive())
+        deadline = time.perf_counter() + args.duration
+        await asyncio.sleep(random.uniform(0, args.interval))  # Разносим отправку клиентов во времени
+        while time.perf_counter() < deadline:
+            event = {"type": "new_message", "payload": {"text": "load", "ts": time.perf_counter()}}
+            try:
+                await websocket.send(json.dumps(event))
+            except websockets.ConnectionClosed:
+                recorder.error("WS send")
+                break
+            count += 1
+            await asyncio.sleep(args.interval)
+        sent[user["username"]] = count
+
+        # Ждем, пока собеседник закончит отправку и дойдут все его сообщения
+        grace = time.perf_counter() + args.drain
+        while (peer["username"] not in sent or received < sent[peer["username"]]) and time.perf_counter() < grace and not receiver.done():
+            await asyncio.sleep(0.05)
+        receiver.cancel()
+        lost = sent.get(peer["username"], 0) - received
+        if lost > 0:
+            recorder.errors["WS lost or late"] = recorder.errors.get("WS lost or late", 0) + lost
+
+    await recorder.request(client, "GET /api/chats/{user_id}", "GET", f"/api/chats/{peer['id']}", headers=headers)
+    await recorder.request(client, "POST /api/chats/{user_id}/read", "POST", f"/api/chats/{peer['id']}/read", headers=headers)
+
+
+# Регистрирует пользователя; ID берется из /api/users/me
+async def register(client: httpx.AsyncClient, recorder: Recorder, username: str, semaphore: asyncio.Semaphore) -> dict | None:
+    async with semaphore:
+        response = await recorder.request(client, "POST /api/auth/register", "POST", "/api/auth/register", json={"username": username, "password": "password"})
+        if response is None or not response.is_success:
+            return None
+        token = response.json()["access_token"]
+        response = await client.get("/api/users/me", headers={"Authorization": f"Bearer {token}"})
+        if not response.is_success:
+            return None
+        return {"id": response.json()["id"], "username": username, "token": token}
+
+
+# Запускает приложение в отдельном процессе uvicorn и ждет, пока оно начнет отвечать
+async def spawn_server(args) -> subprocess.Popen:
+    env = {**os.environ, "BACKEND_SECRET_KEY": os.environ.get("BACKEND_SECRET_KEY", "load-test-secret"), "BACKEND_ACCESS_TOKEN_EXPIRE_MINUTES": "60"}
+    if args.database_url:
+        env["BACKEND_DATABASE_URL"] = args.database_url
+    if args.redis_url:
+        env["BACKEND_REDIS_URL"] = args.redis_url
+
+    subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], env=env, check=True)
+    port = args.base_url.rsplit(":", 1)[-1].split("/")[0]
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", port, "--log-level", "warning"], env=env)
+
+    async with httpx.AsyncClient(base_url=args.base_url) as client:
+        for _ in range(100):
+            try:
+                await client.get("/openapi.json")
+                return server
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Server did not start")
+
+
+# Сравнивает результаты с эталонными, возвращает список регрессий
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, result in report.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if reference["p99"] and result["p99"] > reference["p99"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {reference['p99']:.2f}ms -> {result['p99']:.2f}ms")
+        if reference["throughput"] and result["throughput"] < reference["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {reference['throughput']:.0f}/s -> {result['throughput']:.0f}/s")
+        if result["errors"] > reference["errors"]:
+            regressions.append(f"{name}: errors {reference['errors']} -> {result['errors']}")
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"{'operation':<34} {'count':>8} {'errors':>7} {'throughput':>11} {'p50':>10} {'p99':>10}")
+    for name, result in report.items():
+        print(
+            f"{name:<34} {result['count']:>8} {result['errors']:>7} {result['throughput']:>9.0f}/s "
+            f"{result['p50']:>8.2f}ms {result['p99']:>8.2f}ms"
+        )
+
+
+async def run(args) -> dict:
+    recorder = Recorder()
+    prefix = uuid.uuid4().hex[:8]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    elapsed = {}
+
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=120) as client:
+        # Регистрация: bcrypt ограничивает скорость, поэтому число параллельных запросов задается отдельно
+        semaphore = asyncio.Semaphore(args.concurrency)
+        started = time.perf_counter()
+        users = await asyncio.gather(*(register(client, recorder, f"e2e_{prefix}_{index}", semaphore) for index in range(args.users)))
+        elapsed["POST /api/auth/register"] = time.perf_counter() - started
+        users = [user for user in users if user is not None]
+        pairs = [(users[index], users[index + 1]) for index in range(0, len(users) - 1, 2)]
+
+        # Сценарий пользователей: все сокеты открываются до начала обмена сообщениями
+        ready = asyncio.Barrier(len(pairs) * 2 + 1)
+        sent: dict[str, int] = {}                               # username -> сколько сообщений отправил
+        tasks = []
+        for first, second in pairs:
+            tasks.append(asyncio.create_task(virtual_user(args, client, recorder, first, second, ready, sent)))
+            tasks.append(asyncio.create_task(virtual_user(args, client, recorder, second, first, ready, sent)))
+
+        started = time.perf_counter()
+        await ready.wait()
+        connected = time.perf_counter()
+        await asyncio.gather(*tasks)
+        finished = time.perf_counter()
+
+    elapsed["total"] = finished - started
+    for name in ("WS delivery", "WS ack"):
+        elapsed[name] = finished - connected
+    return recorder.report(elapsed)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Сквозной нагрузочный тест: регистрация, вход, REST и обмен сообщениями по веб-сокетам")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=1000, help="виртуальных пользователей (разбиваются на пары)")
+    parser.add_argument("--concurrency", type=int, default=50, help="параллельных HTTP-запросов")
+    parser.add_argument("--duration", type=float, default=30, help="длительность обмена сообщениями (сек)")
+    parser.add_argument("--interval", type=float, default=0.5, help="пауза между сообщениями клиента (сек)")
+    parser.add_argument("--drain", type=float, default=10, help="сколько ждать недоставленные сообщения после окончания (сек)")
+    parser.add_argument("--spawn", action="store_true", help="запустить приложение uvicorn в отдельном процессе")
+    parser.add_argument("--database-url", help="BACKEND_DATABASE_URL для запускаемого приложения")
+    parser.add_argument("--redis-url", help="BACKEND_REDIS_URL для запускаемого приложения")
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON с эталонными результатами для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение относительно эталона")
+    args = parser.parse_args()
+    args.ws_url = args.base_url.replace("http", "ws", 1)
+
+    server = await spawn_server(args) if args.spawn else None
+    try:
+        report = await run(args)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
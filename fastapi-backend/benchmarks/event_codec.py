@@ -0,0 +1,54 @@
+import argparse, json, time
+import msgpack, orjson
+import benchmarks.common  # noqa: F401
+from app.utils.events import Event
+
+
+# Прежний путь события: receive_json, json.dumps для Redis, json.loads в слушателе и повторный json.dumps для send_json
+def legacy_pipeline(frame: str, devices: int):
+    event = json.loads(frame)
+    event["sender"] = "alice"
+    event["receiver"] = "bob"
+    data = json.dumps(event)
+
+    routed = json.loads(data)
+    for _ in range(devices):
+        json.dumps(routed)
+
+
+# Конверт: тело сериализуется один раз, маршрут берется из заголовка, кодировка общая для всех устройств
+def envelope_pipeline(frame: str | bytes, devices: int, codec: str):
+    event = msgpack.unpackb(frame) if codec == "msgpack" else orjson.loads(frame)
+    data = Event.create(event["type"], "alice", "bob", event.get("payload")).pack()
+
+    routed = Event.unpack(data)
+    for _ in range(devices):
+        routed.encode(codec)
+
+
+def measure(name: str, pipeline, frame, events: int, *args):
+    started = time.process_time()
+    for _ in range(events):
+        pipeline(frame, *args)
+    elapsed = time.process_time() - started
+    print(f"{name:<20} {events / elapsed:>12.0f} events/s per core ({elapsed / events * 1e6:.2f} us/event)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность сериализации событий веб-сокета на одно ядро")
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--devices", type=int, default=1, help="устройств получателя на воркере")
+    parser.add_argument("--text-size", type=int, default=100, help="длина текста сообщения")
+    args = parser.parse_args()
+
+    event = {"type": "new_message", "sender": "alice", "receiver": "bob", "payload": {"text": "x" * args.text_size}}
+    json_frame = json.dumps(event)
+    msgpack_frame = msgpack.packb(event)
+
+    measure("json (legacy)", legacy_pipeline, json_frame, args.events, args.devices)
+    measure("envelope + json", envelope_pipeline, json_frame, args.events, args.devices, "json")
+    measure("envelope + msgpack", envelope_pipeline, msgpack_frame, args.events, args.devices, "msgpack")
+
+
+if __name__ == "__main__":
+    main()
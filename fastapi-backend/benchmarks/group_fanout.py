@@ -0,0 +1,104 @@
+import argparse, asyncio, time
+import benchmarks.common  # noqa: F401
+from redis.asyncio import Redis
+from app.utils.connection_manager import WORKER_CHANNEL, ConnectionManager, get_group_channel, pack_inbox_message
+from app.utils.events import Event
+
+
+# Веб-сокет, который только считает отправленные кадры
+class FakeWebSocket:
+    __slots__ = ("sent",)
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_text(self, text: str):
+        self.sent += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+# Раскладывает события по очередям и ждет, пока задачи записи их отправят; возвращает время постановки в очереди
+async def deliver(managers: list[ConnectionManager], batches: list[list[dict]]) -> float:
+    enqueue_time = 0.0
+    for manager, messages in zip(managers, batches):
+        for index in range(0, len(messages), 256):
+            started = time.perf_counter()
+            manager.send_messages_to_receivers(messages[index:index + 256])
+            enqueue_time += time.perf_counter() - started
+            await asyncio.sleep(0)                              # Даем поработать задачам записи
+    while any(manager.stats()["queued"] for manager in managers):
+        await asyncio.sleep(0.001)
+    return enqueue_time
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Рассылка сообщений группы: канал группы против копий каждому участнику")
+    parser.add_argument("--sizes", default="1000,5000,10000", help="размеры групп через запятую")
+    parser.add_argument("--workers", type=int, default=4, help="воркеров, между которыми распределены участники")
+    parser.add_argument("--events", type=int, default=100, help="сообщений в группу на каждый размер")
+    parser.add_argument("--redis-url", help="замерить и стоимость публикации в Redis")
+    args = parser.parse_args()
+
+    redis = Redis.from_url(args.redis_url, decode_responses=True) if args.redis_url else None
+    group_id = 1
+    for size in (int(value) for value in args.sizes.split(",")):
+        # Участники равномерно распределены по воркерам, у каждого по одному сокету
+        managers = [ConnectionManager(max_queue=args.events * 2) for _ in range(args.workers)]
+        members = [f"member{index}" for index in range(size)]
+        connections = []
+        for index, username in enumerate(members):
+            manager = managers[index % args.workers]
+            connections.append((manager, username, await manager.connect(username, FakeWebSocket(), group_ids=[group_id])))
+
+        data = Event.create("new_message", "member0", "", {"text": "hello", "group_id": group_id}).pack()
+        line = f"members={size:<6} workers={args.workers}"
+
+        # Канал группы: Redis доставляет событие один раз каждому воркеру
+        group_batches = [[{"channel": get_group_channel(group_id), "data": data}] * args.events for _ in managers]
+        started = time.perf_counter()
+        enqueue = await deliver(managers, group_batches)
+        elapsed = time.perf_counter() - started
+        line += f"  group channel: {args.workers} deliveries, enqueue {enqueue / args.events * 1000:>7.3f}ms, total {elapsed / args.events * 1000:>7.2f}ms/message"
+
+        # Копии участникам: каждому участнику своя копия события во входящем канале его воркера
+        member_batches = [
+            [
+                {"channel": WORKER_CHANNEL, "data": pack_inbox_message([username], data)}
+                for _ in range(args.events)
+                for username in manager.active_connections
+            ]
+            for manager in managers
+        ]
+        started = time.perf_counter()
+        enqueue = await deliver(managers, member_batches)
+        elapsed = time.perf_counter() - started
+        line += f"  member copies: {size} deliveries, enqueue {enqueue / args.events * 1000:>7.3f}ms, total {elapsed / args.events * 1000:>7.2f}ms/message"
+        print(line)
+
+        # Публикация: одна команда против конвейера из команды на каждого участника
+        if redis is not None:
+            started = time.perf_counter()
+            for _ in range(args.events):
+                await redis.publish(get_group_channel(group_id), data)
+            group_publish = (time.perf_counter() - started) / args.events * 1000
+
+            started = time.perf_counter()
+            for _ in range(args.events):
+                async with redis.pipeline(transaction=False) as pipe:
+                    for username in members:
+                        pipe.publish(WORKER_CHANNEL, pack_inbox_message([username], data))
+                    await pipe.execute()
+            member_publish = (time.perf_counter() - started) / args.events * 1000
+            print(f"{'':<23}  publish: group channel {group_publish:>7.3f}ms, member copies {member_publish:>8.3f}ms")
+
+        for manager, username, connection in connections:
+            await manager.disconnect(username, connection)
+
+    if redis is not None:
+        await redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+import argparse, asyncio, time, uuid
+import httpx
+from benchmarks.common import print_latency
+from benchmarks.websocket_load import register, chat_client
+
+
+# Клиент входа: логинится в цикле, пока не будет остановлен
+async def login_worker(client: httpx.AsyncClient, username: str, latencies: list[float], statuses: dict, stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.post("/api/auth/login", json={"username": username, "password": "password"})
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - started)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+# Обмен сообщениями между парами с параллельным «штормом» входов (logins=0 — без шторма)
+async def run_phase(name: str, client: httpx.AsyncClient, ws_url: str, pairs: list, storm_user: dict, logins: int, messages: int, interval: float):
+    delivery_latencies: list[float] = []
+    login_latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    ready = asyncio.Barrier(len(pairs) * 2 + 1)
+    stop = asyncio.Event()
+
+    clients = []
+    for first, second in pairs:
+        clients.append(asyncio.create_task(chat_client(ws_url, first, second, messages, interval, delivery_latencies, ready)))
+        clients.append(asyncio.create_task(chat_client(ws_url, second, first, messages, interval, delivery_latencies, ready)))
+
+    await ready.wait()
+    started = time.perf_counter()
+    workers = [asyncio.create_task(login_worker(client, storm_user["username"], login_latencies, statuses, stop)) for _ in range(logins)]
+
+    await asyncio.gather(*clients)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*workers)
+
+    print(f"--- {name}")
+    print_latency("websocket delivery", delivery_latencies, elapsed)
+    if logins:
+        print_latency("POST /api/auth/login", login_latencies, elapsed)
+        print(f"login statuses: {statuses}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность входа и задержка веб-сокетов во время шторма логинов")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--pairs", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--logins", type=int, default=100, help="параллельных клиентов входа")
+    args = parser.parse_args()
+
+    ws_url = args.base_url.replace("http", "ws", 1)
+    prefix = uuid.uuid4().hex[:8]
+    limits = httpx.Limits(max_connections=args.logins + 10)
+
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=120) as client:
+        users = await asyncio.gather(*(register(client, f"storm_{prefix}_{index}") for index in range(args.pairs * 2 + 1)))
+        storm_user = users.pop()
+        pairs = [(users[index], users[index + 1]) for index in range(0, len(users), 2)]
+
+        await run_phase("baseline", client, ws_url, pairs, storm_user, 0, args.messages, args.interval)
+        await run_phase(f"login storm x{args.logins}", client, ws_url, pairs, storm_user, args.logins, args.messages, args.interval)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
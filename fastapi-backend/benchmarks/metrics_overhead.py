@@ -0,0 +1,73 @@
+import argparse, asyncio, time
+import benchmarks.common  # noqa: F401
+from fastapi import FastAPI
+from app.utils.metrics import REDIS_DELIVERY_LAG, MetricsMiddleware, timed_operation
+
+
+# Минимальное приложение: задержка складывается только из стека ASGI и middleware
+def create_app(with_metrics: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping/{item_id}")
+    async def ping(item_id: int):
+        return {"id": item_id}
+
+    if with_metrics:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+# Прогоняет запросы напрямую через ASGI-интерфейс, без сети и HTTP-клиента
+async def run_requests(app: FastAPI, requests: int) -> float:
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    started = time.perf_counter()
+    for index in range(requests):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+            "path": f"/ping/{index}", "raw_path": f"/ping/{index}".encode(), "root_path": "", "query_string": b"",
+            "headers": [], "server": ("bench", 80), "client": ("bench", 1)
+        }
+        await app(scope, receive, send)
+    return time.perf_counter() - started
+
+
+async def noop():
+    pass
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Накладные расходы метрик на горячих путях")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--operations", type=int, default=200000)
+    args = parser.parse_args()
+
+    # HTTP: одинаковое приложение с middleware метрик и без него
+    for name, with_metrics in (("http without metrics", False), ("http with metrics", True)):
+        app = create_app(with_metrics)
+        await run_requests(app, 1000)                           # Прогрев
+        elapsed = await run_requests(app, args.requests)
+        print(f"{name:<28} {args.requests / elapsed:>10.0f} req/s  {elapsed / args.requests * 1e6:>8.2f} us/request")
+
+    # Операция с БД: обертка timed_operation вокруг пустой корутины
+    for name, func in (("db operation bare", noop), ("db operation timed", timed_operation(noop))):
+        started = time.perf_counter()
+        for _ in range(args.operations):
+            await func()
+        elapsed = time.perf_counter() - started
+        print(f"{name:<28} {elapsed / args.operations * 1e6:>8.3f} us/call")
+
+    # Наблюдение задержки доставки на каждое событие слушателя
+    started = time.perf_counter()
+    for _ in range(args.operations):
+        REDIS_DELIVERY_LAG.observe(0.001)
+    elapsed = time.perf_counter() - started
+    print(f"{'histogram observe':<28} {elapsed / args.operations * 1e6:>8.3f} us/call")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+import argparse, gzip, json, random
+import benchmarks.common  # noqa: F401
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+from websockets.frames import Frame, Opcode
+from app import config
+from app.schemas import chat as chat_schema
+from app.utils.events import Event
+
+try:
+    import brotli
+except ImportError:
+    brotli = None                                               # Brotli замеряется, только если пакет установлен
+
+
+WORDS = "привет как дела сегодня встреча завтра ок hello see you later thanks давай созвонимся позже отправил файл посмотри".split()
+
+
+# Тело ответа так, как его отдает FastAPI (JSONResponse: без пробелов, без экранирования не-ASCII)
+def render(model) -> bytes:
+    return json.dumps(model.model_dump(mode="json"), ensure_ascii=False, separators=(",", ":")).encode()
+
+def random_text(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 20)))
+
+def chat_page(rng: random.Random, first_id: int, count: int) -> chat_schema.Chat:
+    messages = [
+        chat_schema.Message(id=first_id + index, type=rng.choice(("sent", "received")), text=random_text(rng))
+        for index in range(count)
+    ]
+    return chat_schema.Chat(user={"id": 2, "username": "user2"}, messages=messages, next_cursor=first_id - 1)
+
+
+# Размеры тела: без сжатия, gzip с настройками приложения и brotli (если доступен).
+# Ответы меньше GZIP_MINIMUM_SIZE приложение отдает без сжатия
+def sizes(data: bytes) -> list[int]:
+    if len(data) < config.GZIP_MINIMUM_SIZE:
+        return [len(data)] * (3 if brotli is not None else 2)
+    result = [len(data), len(gzip.compress(data, config.GZIP_COMPRESS_LEVEL))]
+    if brotli is not None:
+        result.append(len(brotli.compress(data, quality=5)))
+    return result
+
+def print_sizes(name: str, values: list[int], base: int):
+    columns = ["raw", "gzip", "brotli"]
+    line = "  ".join(f"{column} {value:>8} B ({value / base:>4.0%})" for column, value in zip(columns, values))
+    print(f"{name:<34} {line}")
+
+
+# Суммарный размер кадров веб-сокета без сжатия и с permessage-deflate (с сохранением словаря между кадрами и без).
+# Окно 12 бит — параметры, которые uvicorn с реализацией websockets предлагает клиенту
+def websocket_sizes(frames: list[str | bytes]) -> tuple[int, int, int]:
+    takeover = PerMessageDeflate(False, False, 12, 12)
+    no_takeover = PerMessageDeflate(False, True, 12, 12)
+    raw = compressed = reset = 0
+    for data in frames:
+        opcode = Opcode.BINARY if isinstance(data, bytes) else Opcode.TEXT
+        payload = data if isinstance(data, bytes) else data.encode()
+        raw += len(payload)
+        compressed += len(takeover.encode(Frame(opcode, payload)).data)
+        reset += len(no_takeover.encode(Frame(opcode, payload)).data)
+    return raw, compressed, reset
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Объем трафика истории и событий веб-сокета со сжатием и догрузкой новых сообщений")
+    parser.add_argument("--page-size", type=int, default=config.HISTORY_PAGE_SIZE, help="сообщений на странице истории")
+    parser.add_argument("--missed", default="1,5,20", help="сколько новых сообщений пропустил клиент, через запятую")
+    parser.add_argument("--events", type=int, default=1000, help="событий веб-сокета")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    # Страница истории целиком
+    page = render(chat_page(rng, 1000, args.page_size))
+    print(f"history page, {args.page_size} messages")
+    print_sizes("  full page", sizes(page), len(page))
+
+    # Догрузка после переподключения: раньше клиент заново запрашивал первую страницу, теперь только новые сообщения после after_id
+    for missed in (int(value) for value in args.missed.split(",")):
+        delta = render(chat_page(rng, 1000 + args.page_size, missed))
+        print_sizes(f"  resync {missed} missed: after_id", sizes(delta), len(page))
+
+    # Поток событий new_message одному сокету, с ID журнала, как при доставке из Redis
+    events = [
+        Event.unpack(f"{1700000000000 + index}-0" + Event.create("new_message", "alice", "bob", {"id": 1000 + index, "text": random_text(rng)}).pack())
+        for index in range(args.events)
+    ]
+    print(f"websocket, {args.events} new_message events")
+    for codec in ("json", "msgpack"):
+        raw, compressed, reset = websocket_sizes([event.encode(codec) for event in events])
+        print(
+            f"  {codec:<8} raw {raw:>9} B  permessage-deflate {compressed:>9} B ({compressed / raw:>4.0%})"
+            f"  without context takeover {reset:>9} B ({reset / raw:>4.0%})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse, asyncio, json, time
+from benchmarks.common import print_latency
+from redis.asyncio import Redis
+from app.routers import chats
+from app.utils.connection_manager import WORKER_CHANNEL, ConnectionManager, pack_inbox_message
+from app.utils.events import Event
+from app.utils.event_stream import EventStream
+
+
+# Веб-сокет, который только запоминает задержку доставки
+class FakeWebSocket:
+    def __init__(self):
+        self.latencies: list[float] = []
+
+    async def send_text(self, text: str):
+        event = json.loads(text)
+        self.latencies.append(time.perf_counter() - event["payload"]["ts"])
+
+
+# Прежний слушатель с опросом общего канала раз в 100 мс и разбором каждого события
+async def polling_listener(redis: Redis, manager: ConnectionManager):
+    pubsub = redis.pubsub()
+    await pubsub.subscribe("chat")
+
+    while True:
+        message = await pubsub.get_message(ignore_subscribe_messages=True)
+        if message:
+            event = Event.unpack(message["data"])
+            manager.send_message_to_receiver(event.receiver, event)
+        await asyncio.sleep(0.1)
+
+
+async def run(name: str, listener_factory, redis: Redis, channel: str, pack, events: int, rate: float, duration: float):
+    manager = ConnectionManager()
+    websocket = FakeWebSocket()
+    await manager.connect("receiver", websocket)
+
+    listener = asyncio.create_task(listener_factory(manager))
+    await asyncio.sleep(0.5)                                    # Даем слушателю подписаться
+
+    # Публикуем события с заданной частотой (0 — без ограничения)
+    started = time.perf_counter()
+    for index in range(events):
+        event = Event.create("new_message", "sender", "receiver", {"ts": time.perf_counter()})
+        await redis.publish(channel, pack(event.pack()))
+        if rate:
+            await asyncio.sleep(max(0.0, started + (index + 1) / rate - time.perf_counter()))
+
+    # Ждем доставки, но не дольше заданного времени
+    deadline = time.perf_counter() + duration
+    while len(websocket.latencies) < events and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    listener.cancel()
+    try:
+        await listener
+    except asyncio.CancelledError:
+        pass
+
+    print_latency(name, websocket.latencies, elapsed)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Сравнение опроса Redis и push-слушателя")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/1")
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=0, help="событий в секунду, 0 — без ограничения")
+    parser.add_argument("--duration", type=float, default=30, help="максимальное время ожидания доставки (сек)")
+    args = parser.parse_args()
+
+    redis = Redis.from_url(args.redis_url, decode_responses=True)
+    chats.redis = redis
+    chats.event_stream = EventStream(redis)
+
+    async def push_listener(manager: ConnectionManager):
+        chats.manager = manager
+        await chats.redis_listener()
+
+    await run("polling (sleep 100 ms)", lambda manager: polling_listener(redis, manager), redis, "chat", lambda data: data, args.events, args.rate, args.duration)
+    await run(
+        "push + batch drain",
+        push_listener,
+        redis,
+        WORKER_CHANNEL,
+        lambda data: pack_inbox_message(["receiver"], data),
+        args.events,
+        args.rate,
+        args.duration
+    )
+
+    await redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+import argparse, asyncio, json, time, uuid
+import httpx, websockets
+from benchmarks.common import print_latency
+
+
+# Регистрирует пользователя и возвращает его ID и токен
+async def register(client: httpx.AsyncClient, username: str) -> dict:
+    response = await client.post("/api/auth/register", json={"username": username, "password": "password"})
+    response.raise_for_status()
+    token = response.json()["access_token"]
+
+    response = await client.get("/api/users/me", headers={"Authorization": f"Bearer {token}"})
+    response.raise_for_status()
+    return {"id": response.json()["id"], "username": username, "token": token}
+
+
+# Клиент чата: отправляет сообщения собеседнику и замеряет задержку доставки входящих
+async def chat_client(ws_url: str, user: dict, peer: dict, messages: int, interval: float, latencies: list[float], ready: asyncio.Barrier):
+    url = f"{ws_url}/api/chats/{peer['id']}/ws?access_token={user['token']}"
+    async with websockets.connect(url, max_queue=None) as websocket:
+        await ready.wait()
+
+        async def receive():
+            received = 0
+            while received < messages:
+                event = json.loads(await websocket.recv())
+                if event["type"] == "new_message" and event["sender"] == peer["username"]:
+                    latencies.append(time.perf_counter() - event["payload"]["ts"])
+                    received += 1
+
+        receiver = asyncio.create_task(receive())
+        for _ in range(messages):
+            event = {"type": "new_message", "sender": user["username"], "receiver": peer["username"], "payload": {"text": "load", "ts": time.perf_counter()}}
+            await websocket.send(json.dumps(event))
+            await asyncio.sleep(interval)
+
+        try:
+            await asyncio.wait_for(receiver, 30)
+        except asyncio.TimeoutError:
+            pass
+
+
+# Читатель истории: нагружает БД REST-запросами, пока идет обмен сообщениями
+async def history_reader(client: httpx.AsyncClient, user: dict, peer: dict, latencies: list[float], stop: asyncio.Event):
+    headers = {"Authorization": f"Bearer {user['token']}"}
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.get(f"/api/chats/{peer['id']}", headers=headers)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Задержка доставки по веб-сокетам при параллельной нагрузке на БД")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--pairs", type=int, default=100, help="количество пар собеседников")
+    parser.add_argument("--messages", type=int, default=50, help="сообщений от каждого клиента")
+    parser.add_argument("--interval", type=float, default=0.05, help="пауза между сообщениями клиента (сек)")
+    parser.add_argument("--readers", type=int, default=20, help="параллельных читателей истории")
+    args = parser.parse_args()
+
+    ws_url = args.base_url.replace("http", "ws", 1)
+    prefix = uuid.uuid4().hex[:8]
+    limits = httpx.Limits(max_connections=args.readers + 10)
+
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        users = await asyncio.gather(*(register(client, f"load_{prefix}_{index}") for index in range(args.pairs * 2)))
+        pairs = [(users[index], users[index + 1]) for index in range(0, len(users), 2)]
+
+        delivery_latencies: list[float] = []
+        history_latencies: list[float] = []
+        ready = asyncio.Barrier(args.pairs * 2 + 1)
+        stop = asyncio.Event()
+
+        clients = []
+        for first, second in pairs:
+            clients.append(asyncio.create_task(chat_client(ws_url, first, second, args.messages, args.interval, delivery_latencies, ready)))
+            clients.append(asyncio.create_task(chat_client(ws_url, second, first, args.messages, args.interval, delivery_latencies, ready)))
+
+        await ready.wait()
+        started = time.perf_counter()
+        readers = [asyncio.create_task(history_reader(client, *pairs[index % len(pairs)], history_latencies, stop)) for index in range(args.readers)]
+
+        await asyncio.gather(*clients)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await asyncio.gather(*readers)
+
+    print_latency("websocket delivery", delivery_latencies, elapsed)
+    print_latency("GET /api/chats/{user_id}", history_latencies, elapsed)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,27 +1,92 @@
-import asyncio
+import asyncio, signal, threading
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from app import config
 from app.routers.auth import router as auth_router
 from app.routers.users import router as users_router
 from app.routers.chats import router as chats_router
+from app.routers.groups import router as groups_router
 from app.routers.chats import redis_listener as chats_redis_listener
+from app.routers.chats import message_writer as chats_message_writer
+from app.routers.chats import background_tasks as chats_background_tasks
+from app.routers.chats import drain_connections as chats_drain_connections
+from app.database.partitions import maintain_partitions
+from app.database.replicas import replica_router
+from app.utils.connection_directory import connection_directory
+from app.utils.password_hasher import password_hasher
+from app.utils.presence import presence
+from app.utils.metrics import MetricsMiddleware, metrics_endpoint
 from app.metadata import tags_metadata
 
 
+# Разгружает воркер: закрывает сокеты с подсказкой о переподключении, затем дописывает сообщения и присутствие
+async def drain():
+    await chats_drain_connections()
+    
+    # Дописываем в БД все сообщения из очереди, прежде чем останавливать остальное
+    await chats_message_writer.stop()
+    await asyncio.gather(*chats_background_tasks, return_exceptions=True)      # Рассылаем уже сохраненные сообщения
+    await presence.stop()                                                      # Снимаем отметки присутствия пользователей воркера
+    await connection_directory.stop()                                          # Снимаем аренды, чтобы события не шли на остановленный воркер
+
+
+# Запускает разгрузку по SIGTERM и только после нее передает сигнал серверу.
+# Uvicorn при остановке сам закрывает веб-сокеты до завершения lifespan, и клиенты не получили бы событие reconnect
+def handle_sigterm(start_draining):
+    previous = signal.getsignal(signal.SIGTERM)
+    if not callable(previous) or threading.current_thread() is not threading.main_thread():
+        return
+    loop = asyncio.get_running_loop()
+    
+    def start():
+        start_draining().add_done_callback(lambda _: previous(signal.SIGTERM, None))
+    
+    def handler(signum, frame):
+        signal.signal(signal.SIGTERM, previous)                                # Повторный SIGTERM останавливает сервер сразу
+        loop.call_soon_threadsafe(start)
+    
+    signal.signal(signal.SIGTERM, handler)
+
+
 # Lifespan для FastAPI
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Запускаем отложенную запись сообщений в БД и сервис присутствия
+    chats_message_writer.start()
+    presence.start()
+    replica_router.start()                                                     # Измеряем отставание реплик БД
+    connection_directory.start()                                               # Продлеваем аренды пользователей воркера в каталоге подключений
+    
     # Добавляем слушатель Redis для отправки сообщений по веб-сокетам
     chat_redis = asyncio.create_task(chats_redis_listener())
     
+    # Заранее создаем секции сообщений на следующие месяцы
+    partitions = asyncio.create_task(maintain_partitions())
+    
+    # Разгрузка выполняется один раз: по SIGTERM или при завершении lifespan, если сигнала не было
+    draining = None
+    def start_draining() -> asyncio.Task:
+        nonlocal draining
+        if draining is None:
+            draining = asyncio.create_task(drain())
+        return draining
+    handle_sigterm(start_draining)
+    
     yield
     
-    chat_redis.cancel()
-    try:
-        await chat_redis
-    except asyncio.CancelledError:
-        pass
+    await start_draining()
+    
+    for task in (chat_redis, partitions):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    
+    await replica_router.stop()
+    password_hasher.shutdown()
 
 
 app = FastAPI(lifespan=lifespan,tags_metadata=tags_metadata)        # Приложение FastAPI
@@ -35,8 +100,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Сжимаем большие ответы (страницы истории, списки чатов) для клиентов с Accept-Encoding: gzip
+app.add_middleware(GZipMiddleware, minimum_size=config.GZIP_MINIMUM_SIZE, compresslevel=config.GZIP_COMPRESS_LEVEL)
+
+# Метрики задержки HTTP-запросов и эндпоинт /metrics для Prometheus
+app.add_middleware(MetricsMiddleware)
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
 
 # Подключаем роутеры
 app.include_router(auth_router, prefix="/api")
 app.include_router(users_router, prefix="/api")
 app.include_router(chats_router, prefix="/api")
+app.include_router(groups_router, prefix="/api")
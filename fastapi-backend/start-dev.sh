@@ -2,4 +2,4 @@
 
 
 poetry run alembic upgrade head
-poetry run uvicorn main:app --host 0.0.0.0 --reload
\ No newline at end of file
+poetry run uvicorn main:app --host 0.0.0.0 --reload --ws websockets --ws-per-message-deflate true
\ No newline at end of file
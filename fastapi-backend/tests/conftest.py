@@ -0,0 +1,6 @@
+import os
+
+
+# Значения по умолчанию, без которых не импортируется app.config
+os.environ.setdefault("BACKEND_SECRET_KEY", "test-secret")
+os.environ.setdefault("BACKEND_ACCESS_TOKEN_EXPIRE_MINUTES", "60")
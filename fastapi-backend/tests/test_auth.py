@@ -0,0 +1,40 @@
+import asyncio, os, uuid
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+from app.database import models, operations
+from app.routers import auth as auth_router
+from app.schemas import user as user_schema
+
+
+# Тесты работают с БД из BACKEND_DATABASE_URL, к которой применены миграции
+DATABASE_URL = os.environ.get("BACKEND_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="BACKEND_DATABASE_URL is not set")
+
+
+async def register_taken_name() -> HTTPException:
+    engine = create_async_engine(DATABASE_URL, poolclass=NullPool)
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+    username = f"register_{uuid.uuid4().hex[:8]}"
+    try:
+        async with Session() as db:
+            db.add(models.User(username=username, hashed_password="-"))
+            await db.commit()
+
+        async with Session() as db:
+            with pytest.raises(HTTPException) as error:
+                await auth_router.register_user(user_schema.UserAuth(username=username, password="password"), db)
+            return error.value
+    finally:
+        await engine.dispose()
+
+
+def test_register_race_returns_400(monkeypatch):
+    # Параллельный запрос занял имя уже после проверки
+    async def get_user_by_username(db, username):
+        return None
+
+    monkeypatch.setattr(operations, "get_user_by_username", get_user_by_username)
+    error = asyncio.run(register_taken_name())
+    assert error.status_code == 400 and error.detail == "Username already registered"
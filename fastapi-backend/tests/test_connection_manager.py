@@ -0,0 +1,65 @@
+import asyncio, json
+from app.utils.connection_manager import WORKER_CHANNEL, ConnectionManager, pack_inbox_message
+from app.utils.events import Event
+
+
+# Веб-сокет, который запоминает отправленные кадры
+class FakeWebSocket:
+    def __init__(self):
+        self.sent: list[dict] = []
+
+    async def send_text(self, text: str):
+        self.sent.append(json.loads(text))
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def journal_event(event_id: str, text: str) -> Event:
+    return Event.unpack(event_id + Event.create("new_message", "alice", "bob", {"text": text}).pack())
+
+
+async def live_event_during_replay() -> list[dict]:
+    manager = ConnectionManager()
+    websocket = FakeWebSocket()
+    connection = await manager.connect("bob", websocket, replay=True)
+
+    # Живое событие приходит раньше, чем прочитан журнал: оно должно дождаться пропущенных
+    live = journal_event("3-0", "live")
+    manager.send_messages_to_receivers([{"channel": WORKER_CHANNEL, "data": pack_inbox_message(["bob"], live.pack())}])
+    connection.finish_replay([journal_event("1-0", "first"), journal_event("2-0", "second"), live], (0, 0))
+
+    for _ in range(100):
+        if len(websocket.sent) >= 3:
+            break
+        await asyncio.sleep(0.01)
+    await manager.disconnect("bob", connection)
+    return websocket.sent
+
+
+def test_replay_is_not_lost_behind_live_event():
+    sent = asyncio.run(live_event_during_replay())
+    assert [event["payload"]["text"] for event in sent] == ["first", "second", "live"]
+
+
+async def live_event_before_stream_end() -> list[dict]:
+    manager = ConnectionManager()
+    websocket = FakeWebSocket()
+    connection = await manager.connect("bob", websocket, replay=True)
+
+    # Клиент без last_event_id: событие пришло раньше, чем прочитан конец журнала, который его уже включает
+    live = journal_event("5-0", "live")
+    manager.send_messages_to_receivers([{"channel": WORKER_CHANNEL, "data": pack_inbox_message(["bob"], live.pack())}])
+    connection.finish_replay([], end=(5, 0))
+
+    for _ in range(100):
+        if websocket.sent:
+            break
+        await asyncio.sleep(0.01)
+    await manager.disconnect("bob", connection)
+    return websocket.sent
+
+
+def test_fresh_socket_keeps_live_event_held_during_replay():
+    sent = asyncio.run(live_event_before_stream_end())
+    assert [event["payload"]["text"] for event in sent] == ["live"]
@@ -0,0 +1,23 @@
+import asyncio
+import pytest
+from app.utils.message_writer import MessageWriter
+
+
+async def message_after_stop_signal() -> asyncio.Future:
+    writer = MessageWriter()
+    writer.start()
+
+    # Отправитель, ждавший места в очереди, встает в нее уже после сигнала остановки
+    saved = asyncio.get_running_loop().create_future()
+    writer.queue.put_nowait(None)
+    writer.queue.put_nowait(({"sender_id": 1, "receiver_id": 2, "group_id": None, "text": "late"}, saved))
+    await writer.stop()
+    return saved
+
+
+def test_stop_rejects_messages_queued_after_signal():
+    saved = asyncio.run(message_after_stop_signal())
+
+    assert saved.done()
+    with pytest.raises(RuntimeError):
+        saved.result()
@@ -0,0 +1,28 @@
+import asyncio
+import pytest
+from app.utils import presence as presence_module
+from app.utils.presence import PresenceService
+from app.utils.redis_client import redis
+
+
+async def failing_flush(monkeypatch) -> dict:
+    service = PresenceService(redis)
+    service._mark(1, "alice", True)
+    service._mark(2, "bob", False)
+
+    # Пока рассылка ждет БД, alice успевает выйти из сети
+    async def get_contacts(db, user_ids, limit):
+        service._mark(1, "alice", False)
+        raise RuntimeError("database is unavailable")
+
+    monkeypatch.setattr(presence_module.operations, "get_contacts", get_contacts)
+    with pytest.raises(RuntimeError):
+        await service.flush()
+    return service._pending
+
+
+def test_failed_flush_keeps_pending_changes(monkeypatch):
+    pending = asyncio.run(failing_flush(monkeypatch))
+
+    # Изменение bob возвращается целиком, для alice исходное состояние сохраняется вместе с более новой отметкой
+    assert pending == {1: ["alice", False, False], 2: ["bob", True, False]}
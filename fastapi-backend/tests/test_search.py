@@ -0,0 +1,47 @@
+import asyncio, os, uuid
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+from app.database import models, operations
+
+
+# Тесты работают с БД из BACKEND_DATABASE_URL, к которой применены миграции
+DATABASE_URL = os.environ.get("BACKEND_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="BACKEND_DATABASE_URL is not set")
+
+
+async def search_as_group_sender() -> tuple[list, list, list]:
+    engine = create_async_engine(DATABASE_URL, poolclass=NullPool)
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+    prefix = uuid.uuid4().hex[:8]
+    word = f"needle{prefix}"
+    try:
+        async with Session() as db:
+            sender, member, peer = (models.User(username=f"search_{prefix}_{name}", hashed_password="-") for name in ("sender", "member", "peer"))
+            db.add_all([sender, member, peer])
+            await db.commit()
+            group = await operations.create_group(db, "search", sender.id, [member.id])
+
+            db.add_all([
+                models.Message(sender_id=sender.id, group_id=group.id, text=f"{word} sent to group"),
+                models.Message(sender_id=member.id, group_id=group.id, text=f"{word} received in group"),
+                models.Message(sender_id=sender.id, receiver_id=peer.id, text=f"{word} direct")
+            ])
+            await db.commit()
+
+            everywhere = await operations.search_messages(db, sender.id, word)
+            with_self = await operations.search_messages(db, sender.id, word, peer_id=sender.id)
+            with_peer = await operations.search_messages(db, sender.id, word, peer_id=peer.id)
+            return everywhere, with_self, with_peer
+    finally:
+        await engine.dispose()
+
+
+def test_search_skips_group_messages_of_sender():
+    everywhere, with_self, with_peer = asyncio.run(search_as_group_sender())
+
+    # Найдено только личное сообщение, у каждого результата есть собеседник
+    assert [text for _, _, _, text, _ in everywhere] == [text for _, _, _, text, _ in with_peer]
+    assert len(everywhere) == 1 and everywhere[0][3].endswith("direct")
+    assert all(receiver_id is not None for _, _, receiver_id, _, _ in everywhere)
+    assert with_self == []